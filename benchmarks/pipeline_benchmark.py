@@ -0,0 +1,481 @@
+"""
+Offline benchmarks for the RESONA analysis pipeline.
+
+Times each stage in isolation (URL parsing, decoding, front-end resampling, model load, inference,
+vector search, response serialisation) over synthetic clips of several lengths, sample rates and
+channel counts, plus any fixture files given with --fixtures. A load-test mode drives the FastAPI
+app in-process with yt-dlp replaced by a stub that serves local audio, so the real ffmpeg decode,
+embedding and search path runs without network access.
+
+Results (throughput and p50/p95/p99 latency per benchmark) are written as JSON. Pass a previous
+result file with --compare to print the change in each latency and flag regressions.
+
+Usage:
+    python -m benchmarks.pipeline_benchmark [--quick] [--skip-model] [--output results.json]
+    python -m benchmarks.pipeline_benchmark --load-test --requests 200 --concurrency 16
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import soundfile as sf
+
+logger = logging.getLogger("benchmarks")
+
+DEFAULT_OUTPUT_DIR = os.path.join("cache", "benchmarks")
+# Synthetic clip matrix: every combination of these is generated.
+CLIP_SECONDS = (5, 20, 60)
+CLIP_SAMPLE_RATES = (22050, 44100, 48000)
+CLIP_CHANNELS = (1, 2)
+# Index sizes for the vector search benchmark.
+INDEX_SIZES = (10_000, 100_000)
+# A latency is reported as a regression when it is this much slower than the baseline.
+REGRESSION_THRESHOLD = 0.10
+
+
+# --- Measurement ---
+
+def summarize(durations: Sequence[float], items_per_call: float = 1.0) -> Dict[str, Any]:
+    """Latency percentiles (ms) and throughput (items/s) for a list of per-call durations in seconds."""
+    if not durations:
+        return {"calls": 0}
+    ms = np.asarray(durations, dtype=np.float64) * 1000
+    total = float(np.sum(durations))
+    return {
+        "calls": len(durations),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+        "throughput_per_s": round(len(durations) * items_per_call / total, 3) if total else None,
+    }
+
+
+def time_calls(fn: Callable[[], Any], repeat: int, warmup: int = 1) -> List[float]:
+    for _ in range(warmup):
+        fn()
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+# --- Fixtures ---
+
+def synthetic_clip(seconds: float, sample_rate: int, channels: int, seed: int = 0) -> np.ndarray:
+    """A deterministic music-like test signal: a few harmonics with a slow envelope plus light noise."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate), dtype=np.float32) / sample_rate
+    signal = sum(0.2 / (k + 1) * np.sin(2 * np.pi * 220.0 * (k + 1) * t) for k in range(4))
+    signal *= 0.6 + 0.4 * np.sin(2 * np.pi * 0.5 * t)
+    signal += 0.01 * rng.standard_normal(t.shape[0]).astype(np.float32)
+    if channels == 1:
+        return signal.astype(np.float32)
+    return np.stack([signal, np.roll(signal, 17)], axis=1).astype(np.float32)
+
+
+def encode_clip(audio: np.ndarray, sample_rate: int, fmt: str = "WAV") -> bytes:
+    buffer = io.BytesIO()
+    sf.write(buffer, audio, sample_rate, format=fmt)
+    return buffer.getvalue()
+
+
+def build_fixtures(quick: bool, fixture_dir: Optional[str]) -> List[Dict[str, Any]]:
+    """Returns clips as dicts with 'name', 'seconds', 'sample_rate', 'channels', 'audio' and encoded 'wav'/'flac' bytes."""
+    lengths = CLIP_SECONDS[:2] if quick else CLIP_SECONDS
+    fixtures = []
+    for seconds in lengths:
+        for sample_rate in CLIP_SAMPLE_RATES:
+            for channels in CLIP_CHANNELS:
+                audio = synthetic_clip(seconds, sample_rate, channels)
+                fixtures.append({
+                    "name": f"synthetic_{seconds}s_{sample_rate}hz_{channels}ch",
+                    "seconds": seconds,
+                    "sample_rate": sample_rate,
+                    "channels": channels,
+                    "audio": audio,
+                    "wav": encode_clip(audio, sample_rate, "WAV"),
+                    "flac": encode_clip(audio, sample_rate, "FLAC"),
+                })
+    if fixture_dir:
+        for file_name in sorted(os.listdir(fixture_dir)):
+            path = os.path.join(fixture_dir, file_name)
+            try:
+                audio, sample_rate = sf.read(path, dtype="float32")
+            except RuntimeError:
+                logger.warning(f"Skipping fixture {path}: not readable by soundfile")
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            fixtures.append({
+                "name": f"fixture_{file_name}",
+                "seconds": round(audio.shape[0] / sample_rate, 2),
+                "sample_rate": sample_rate,
+                "channels": 1 if audio.ndim == 1 else audio.shape[1],
+                "audio": audio,
+                "wav": data,
+                "flac": None,
+            })
+    return fixtures
+
+
+# --- Stage benchmarks ---
+
+def bench_parse_urls(repeat: int) -> Dict[str, Any]:
+    from services.youtube_service import parse_youtube_url
+    urls = [
+        "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+        "https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=1m10s",
+        "https://youtu.be/dQw4w9WgXcQ?t=42",
+        "https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=10s&end=40s",
+    ]
+    durations = time_calls(lambda: [parse_youtube_url(url) for url in urls], repeat * 10)
+    return summarize(durations, items_per_call=len(urls))
+
+
+def bench_decode(fixtures: List[Dict[str, Any]], repeat: int) -> Dict[str, Any]:
+    from services.audio_decoding import decode_audio_bytes
+    results = {}
+    for fixture in fixtures:
+        for fmt in ("wav", "flac"):
+            data = fixture[fmt]
+            if data is None:
+                continue
+            durations = time_calls(lambda: decode_audio_bytes(data), repeat)
+            results[f"{fixture['name']}.{fmt}"] = summarize(durations, items_per_call=fixture["seconds"])
+    return results
+
+
+def bench_frontend(fixtures: List[Dict[str, Any]], repeat: int) -> Dict[str, Any]:
+    from services.audio_processor import prepare_audio
+    results = {}
+    for fixture in fixtures:
+        resample_ms: List[float] = []
+
+        def run() -> None:
+            timings: Dict[str, float] = {}
+            prepare_audio(fixture["audio"], fixture["sample_rate"], timings=timings)
+            resample_ms.append(timings["resample_ms"])
+
+        durations = time_calls(run, repeat)
+        summary = summarize(durations, items_per_call=fixture["seconds"])
+        summary["resample_p50_ms"] = round(float(np.percentile(resample_ms[-repeat:], 50)), 3)
+        results[fixture["name"]] = summary
+    return results
+
+
+def bench_model_load() -> Dict[str, Any]:
+    from services.model_registry import DEFAULT_MODEL_CONFIGS, _load_model
+    results = {}
+    for key in DEFAULT_MODEL_CONFIGS:
+        start = time.perf_counter()
+        _load_model(tuple(key))
+        results["/".join(map(str, key))] = {"load_and_warmup_ms": round((time.perf_counter() - start) * 1000, 1)}
+    return results
+
+
+def bench_inference(fixtures: List[Dict[str, Any]], repeat: int) -> Dict[str, Any]:
+    from services.audio_embedding_service import TARGET_SR, get_openl3_embedding_from_array
+    from services.audio_processor import EMBEDDING_PARAMS, prepare_audio
+    results = {}
+    # Inference cost depends only on clip length once the front-end has run.
+    for fixture in fixtures:
+        if fixture["sample_rate"] != TARGET_SR or fixture["channels"] != 1:
+            continue
+        audio = prepare_audio(fixture["audio"], fixture["sample_rate"])
+        durations = time_calls(lambda: get_openl3_embedding_from_array(audio, TARGET_SR, **EMBEDDING_PARAMS), repeat)
+        results[fixture["name"]] = summarize(durations, items_per_call=fixture["seconds"])
+    return results
+
+
+def bench_profiles(fixtures: List[Dict[str, Any]], repeat: int) -> Dict[str, Any]:
+    """Latency of each embedding profile, and how closely its clip embedding matches the dense "accurate" one."""
+    from services.audio_embedding_service import TARGET_SR, compute_frame_embeddings, get_openl3_embedding_from_array
+    from services.audio_processor import EMBEDDING_PARAMS, prepare_audio
+    from services.embedding_profiles import DEFAULT_PROFILE, PROFILES
+    results = {}
+    for fixture in fixtures:
+        if fixture["sample_rate"] != TARGET_SR or fixture["channels"] != 1:
+            continue
+        audio = prepare_audio(fixture["audio"], fixture["sample_rate"])
+        baseline = get_openl3_embedding_from_array(audio, TARGET_SR, profile=DEFAULT_PROFILE, **EMBEDDING_PARAMS)
+        for name, profile in PROFILES.items():
+            embedding = get_openl3_embedding_from_array(audio, TARGET_SR, profile=name, **EMBEDDING_PARAMS)
+            durations = time_calls(lambda: get_openl3_embedding_from_array(audio, TARGET_SR, profile=name, **EMBEDDING_PARAMS), repeat)
+            summary = summarize(durations, items_per_call=fixture["seconds"])
+            summary.update(profile.describe())
+            summary["frames"] = len(compute_frame_embeddings(audio, TARGET_SR, profile=name, **EMBEDDING_PARAMS)[0])
+            summary["cosine_to_accurate"] = round(float(embedding @ baseline / (np.linalg.norm(embedding) * np.linalg.norm(baseline))), 6)
+            results[f"{fixture['name']}_{name}"] = summary
+    return results
+
+
+def bench_inference_backends(fixtures: List[Dict[str, Any]], repeat: int) -> Dict[str, Any]:
+    """Parity and throughput of every inference backend against Keras, on the same fixture clip."""
+    from services.audio_embedding_service import DEFAULT_HOP_SECONDS, TARGET_SR
+    from services.audio_processor import EMBEDDING_PARAMS, prepare_audio
+    from services.inference_backend import INFERENCE_THREADS, all_configs, compare_backends
+    from services.model_registry import get_model, import_openl3
+    fixture = next(f for f in fixtures if f["sample_rate"] == TARGET_SR and f["channels"] == 1)
+    audio = prepare_audio(fixture["audio"], fixture["sample_rate"])
+    frames = import_openl3().core.preprocess_audio(audio, TARGET_SR, hop_size=DEFAULT_HOP_SECONDS, input_repr=None, center=True)
+    model = get_model(EMBEDDING_PARAMS["input_repr"], EMBEDDING_PARAMS["content_type"], EMBEDDING_PARAMS["embedding_size"])
+    configs = [config for config in all_configs() if config != ("keras", "float32")]
+    results = compare_backends(model, frames, configs, threads=INFERENCE_THREADS, repeat=repeat)
+    return {"clip": fixture["name"], "threads": INFERENCE_THREADS, **results}
+
+
+def bench_vector_search(quick: bool, repeat: int) -> Dict[str, Any]:
+    from services.segment_filters import SearchFilter
+    from services.vector_index import VectorIndex
+    results = {}
+    rng = np.random.default_rng(0)
+    # Filtered searches should cost about the same as unfiltered ones (see VectorIndex.search).
+    filters = {
+        "not_artist": SearchFilter(exclude_artists=["Artist 0"]),
+        "one_artist": SearchFilter(artists=["Artist 1"]),
+        "duration": SearchFilter(min_duration_seconds=15, max_duration_seconds=25),
+    }
+    for size in INDEX_SIZES[:1] if quick else INDEX_SIZES:
+        vectors = rng.standard_normal((size, 512)).astype(np.float32)
+        ids = [f"seg_{i}" for i in range(size)]
+        metadatas = [{"artist": f"Artist {i % 200}", "duration_seconds": float(10 * (1 + i % 4))} for i in range(size)]
+        queries = vectors[rng.choice(size, size=repeat * 10)] + 0.05 * rng.standard_normal((repeat * 10, 512)).astype(np.float32)
+        for mode in ("exact", "ivf"):
+            index = VectorIndex(dim=512, mode=mode, initial_capacity=size)
+            build_start = time.perf_counter()
+            index.add_batch(ids, vectors, metadatas)
+            if mode == "ivf":
+                index.train()
+            build_seconds = time.perf_counter() - build_start
+            query_iter = iter(queries)
+            durations = time_calls(lambda: index.search(next(query_iter), k=6), repeat * 10 - 1)
+            summary = summarize(durations)
+            summary["build_ms"] = round(build_seconds * 1000, 1)
+            results[f"{mode}_{size}"] = summary
+            for name, search_filter in filters.items():
+                query_iter = iter(queries)
+                durations = time_calls(lambda: index.search(next(query_iter), k=6, search_filter=search_filter), repeat * 10 - 1)
+                results[f"{mode}_{size}_{name}"] = summarize(durations)
+    return results
+
+
+def bench_temporal(repeat: int) -> Dict[str, Any]:
+    """Costs of the fine stage of coarse-to-fine search, beyond the coarse vector search above."""
+    from services.temporal_embedding import TemporalEmbedding, alignment_scores, pack_sketch, unpack_sketch
+    results = {}
+    rng = np.random.default_rng(0)
+    # 20 s of OpenL3 frames at the default 0.1 s hop.
+    frames = rng.standard_normal((200, 512)).astype(np.float32)
+    results["pooling_20s"] = summarize(time_calls(lambda: TemporalEmbedding(frames), repeat * 10))
+    sketch = TemporalEmbedding(frames).sketch
+    packed = pack_sketch(sketch)
+    results["pack"] = summarize(time_calls(lambda: pack_sketch(sketch), repeat * 10))
+    results["unpack"] = summarize(time_calls(lambda: unpack_sketch(packed, 512), repeat * 10))
+    results["sketch_bytes"] = len(packed)
+    for candidates in (10, 50, 200):
+        sketches = [unpack_sketch(pack_sketch(TemporalEmbedding(rng.standard_normal((200, 512)).astype(np.float32)).sketch), 512) for _ in range(candidates)]
+        durations = time_calls(lambda: alignment_scores(sketch, sketches), repeat)
+        results[f"align_{candidates}"] = summarize(durations, items_per_call=candidates)
+    return results
+
+
+def bench_serialization(repeat: int) -> Dict[str, Any]:
+    from main import AnalysisResponse, SegmentInfo
+    from services.embedding_codec import format_embedding
+    rng = np.random.default_rng(0)
+    results = {}
+    for embedding_format in ("json", "base64", "none"):
+        def build_and_dump() -> bytes:
+            similar = [
+                SegmentInfo(id=f"yt_{i}_0_20", title="Title", artist="Artist", youtube_link="https://www.youtube.com/watch?v=x",
+                            segment_display_time="00:00 - 00:20", similarity_score=0.9)
+                for i in range(6)
+            ]
+            source = SegmentInfo(id="yt_src_0_20", title="Title", artist="Artist", youtube_link="https://www.youtube.com/watch?v=x",
+                                 segment_display_time="00:00 - 00:20",
+                                 embedding=format_embedding(rng.standard_normal(512).astype(np.float32), embedding_format, "float16"))
+            return AnalysisResponse(source_segment_info=source, similar_segments=similar).model_dump_json().encode()
+
+        payload_bytes = len(build_and_dump())
+        summary = summarize(time_calls(build_and_dump, repeat * 10))
+        summary["payload_bytes"] = payload_bytes
+        results[embedding_format] = summary
+    return results
+
+
+# --- Load test ---
+
+def run_load_test(requests: int, concurrency: int, clip_seconds: int, distinct: Optional[int]) -> Dict[str, Any]:
+    """
+    Sends `requests` POST /api/analyze-segment calls from `concurrency` client threads to the app
+    running in-process. yt-dlp metadata extraction is stubbed to point ffmpeg at a local WAV file.
+    """
+    scratch = tempfile.mkdtemp(prefix="resona-bench-")
+    # Isolate the run: no embedding cache, and a throwaway similarity index.
+    os.environ["RESONA_EMBEDDING_CACHE"] = "0"
+    os.environ["RESONA_VECTOR_INDEX_PATH"] = os.path.join(scratch, "segment_index")
+
+    track_path = os.path.join(scratch, "track.wav")
+    sf.write(track_path, synthetic_clip(max(clip_seconds * 4, 90), 44100, 2), 44100)
+
+    from services import youtube_service
+
+    def stub_extract_stream(video_id: str) -> Tuple[Dict[str, Any], str, Dict[str, str]]:
+        return {"title": f"Benchmark {video_id}", "uploader": "benchmark", "thumbnail": None}, track_path, {}
+
+    # Stands in for yt-dlp behind the stream info cache, so cache hits are measured as in production.
+    youtube_service.stream_info_cache.extract = stub_extract_stream
+
+    import main
+    from fastapi.testclient import TestClient
+
+    distinct = distinct or requests
+    urls = [f"https://www.youtube.com/watch?v=bench{i % distinct:06d}&t={(i % distinct) % 60}s" for i in range(requests)]
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    stage_samples: Dict[str, List[float]] = {}
+
+    with TestClient(main.app) as client:
+        def send(url: str) -> None:
+            start = time.perf_counter()
+            response = client.post("/api/analyze-segment?embedding_format=none", json={"youtube_url": url})
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if response.status_code == 200:
+                for stage, value in (response.json().get("stage_timings_ms") or {}).items():
+                    if stage.endswith("_ms"):
+                        stage_samples.setdefault(stage, []).append(value / 1000)
+
+        wall_start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(send, urls))
+        wall_seconds = time.perf_counter() - wall_start
+        server_stats = {
+            "scheduler": client.get("/api/scheduler").json(),
+            "batching": client.get("/api/batching").json(),
+            "extractor": client.get("/api/extractor").json(),
+        }
+
+    summary = summarize(latencies)
+    summary["throughput_per_s"] = round(len(latencies) / wall_seconds, 3)
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "distinct_segments": distinct,
+        "wall_seconds": round(wall_seconds, 3),
+        "latency": summary,
+        "status_codes": {str(code): count for code, count in sorted(statuses.items())},
+        "server_stages": {stage: summarize(values) for stage, values in sorted(stage_samples.items())},
+        "server_stats": server_stats,
+    }
+
+
+# --- Reporting ---
+
+def compare_results(current: Dict[str, Any], baseline: Dict[str, Any], path: str = "") -> List[str]:
+    """Lists p50/p95 latency changes between two result trees, marking regressions beyond REGRESSION_THRESHOLD."""
+    lines = []
+    for key, value in current.items():
+        if key not in baseline:
+            continue
+        label = f"{path}/{key}" if path else key
+        if isinstance(value, dict):
+            lines += compare_results(value, baseline[key], label)
+        elif key in ("p50_ms", "p95_ms") and isinstance(baseline[key], (int, float)) and baseline[key] > 0:
+            change = value / baseline[key] - 1
+            marker = "  REGRESSION" if change > REGRESSION_THRESHOLD else ""
+            lines.append(f"{label}: {baseline[key]:.3f} -> {value:.3f} ms ({change:+.1%}){marker}")
+    return lines
+
+
+def environment_info() -> Dict[str, Any]:
+    return {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the RESONA analysis pipeline.")
+    parser.add_argument("--quick", action="store_true", help="Fewer clip lengths and index sizes, for a fast smoke run.")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed calls per benchmark case.")
+    parser.add_argument("--fixtures", help="Directory of extra audio files to include.")
+    parser.add_argument("--skip-model", action="store_true", help="Skip model load and inference benchmarks.")
+    parser.add_argument("--only", nargs="*", help="Run only these benchmarks (parse, decode, frontend, model_load, inference, profiles, backends, search, temporal, serialization).")
+    parser.add_argument("--load-test", action="store_true", help="Run the in-process HTTP load test instead of the stage benchmarks.")
+    parser.add_argument("--requests", type=int, default=100, help="Load test: total requests.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Load test: concurrent clients.")
+    parser.add_argument("--distinct", type=int, default=None, help="Load test: distinct segments requested (default: all distinct).")
+    parser.add_argument("--clip-seconds", type=int, default=20, help="Load test: length of the stub track's segments.")
+    parser.add_argument("--ffmpeg", help="Path to the ffmpeg binary, if it is not on PATH.")
+    parser.add_argument("--output", help="Where to write the JSON results (default: cache/benchmarks/<timestamp>.json).")
+    parser.add_argument("--compare", help="Previous JSON results to compare against.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logger.setLevel(logging.INFO)
+    if args.ffmpeg:
+        from services import audio_decoding
+        audio_decoding.FFMPEG_BINARY = args.ffmpeg
+
+    results: Dict[str, Any] = {"environment": environment_info()}
+    if args.load_test:
+        logger.info(f"Load test: {args.requests} requests, concurrency {args.concurrency}")
+        results["load_test"] = run_load_test(args.requests, args.concurrency, args.clip_seconds, args.distinct)
+    else:
+        fixtures = build_fixtures(args.quick, args.fixtures)
+        benchmarks: List[Tuple[str, Callable[[], Any]]] = [
+            ("parse", lambda: bench_parse_urls(args.repeat)),
+            ("decode", lambda: bench_decode(fixtures, args.repeat)),
+            ("frontend", lambda: bench_frontend(fixtures, args.repeat)),
+            ("search", lambda: bench_vector_search(args.quick, args.repeat)),
+            ("temporal", lambda: bench_temporal(args.repeat)),
+            ("serialization", lambda: bench_serialization(args.repeat)),
+        ]
+        if not args.skip_model:
+            benchmarks[3:3] = [
+                ("model_load", bench_model_load),
+                ("inference", lambda: bench_inference(fixtures, max(3, args.repeat // 4))),
+                ("profiles", lambda: bench_profiles(fixtures, max(3, args.repeat // 4))),
+                ("backends", lambda: bench_inference_backends(fixtures, max(3, args.repeat // 4))),
+            ]
+        for name, run in benchmarks:
+            if args.only and name not in args.only:
+                continue
+            logger.info(f"Running {name} benchmark")
+            results[name] = run()
+
+    output = args.output or os.path.join(DEFAULT_OUTPUT_DIR, f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps({k: v for k, v in results.items() if k != "environment"}, indent=2))
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        lines = compare_results(results, baseline)
+        print(f"\nComparison with {args.compare}:")
+        print("\n".join(lines) if lines else "No comparable measurements.")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,17 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Body
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Body, Depends, Query
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import uvicorn
 import os
-import shutil
-from typing import List, Dict, Any, Optional
+import logging
+import threading
+import time
+import hashlib
+import json
+import numpy as np
+from contextlib import asynccontextmanager
+from typing import Callable, List, Dict, Any, Literal, Optional, Tuple, Union
 from pydantic import BaseModel # Ensure BaseModel is imported early
 
 # Placeholder for actual service imports
@@ -14,14 +21,111 @@ from pydantic import BaseModel # Ensure BaseModel is imported early
 
 # --- Service Imports ---
 # Assuming services directory is at the same level as main.py
-from services.youtube_service import parse_youtube_url, download_youtube_segment
-from services.audio_processor import process_audio_segment
+from services.youtube_service import parse_youtube_url, download_youtube_segment, stream_info_cache, ytdlp_session
+from services.audio_processor import process_audio_segment, process_audio_stream, EMBEDDING_PARAMS, CACHE_KEY_PARAMS
+from services.model_registry import DEFAULT_MODEL_CONFIGS, preload_models, get_model_stats, models_loaded, openl3_import_seconds, read_rss_bytes
+from services.scheduler import PipelineScheduler, SchedulerBusyError
+from services.embedding_batcher import start_batcher, stop_all_batchers, get_batcher_stats
+from services.embedding_server import DEFAULT_SOCKET_DIR as DEFAULT_EMBED_SERVER_SOCKET_DIR, EmbeddingServerClient, EmbeddingServerPool, set_embedding_client
+from services.embedding_cache import EmbeddingCache, youtube_cache_key, upload_cache_key
+from services.vector_index import VectorIndex
+from services.segment_filters import SearchFilter
+from services.temporal_embedding import TemporalEmbedding, rerank
+from services.embedding_codec import format_embedding
+from services.job_store import Job, JobFailed, JobStore
+from services.single_flight import SingleFlight
+from services.bulk_pipeline import BulkRun
+from services.scratch_space import ScratchSpace, ScratchSpaceFull, ram_root
+from services.metrics import registry as metrics_registry, span
+
+# --- Logging ---
+# INFO logs startup and errors only. Per-request detail (parsed IDs, sample counts, stage timings)
+# is logged at DEBUG, which RESONA_VERBOSE=1 enables; when disabled it produces no output.
+LOG_LEVEL = "DEBUG" if os.environ.get("RESONA_VERBOSE", "0") == "1" else os.environ.get("RESONA_LOG_LEVEL", "INFO").upper()
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger("resona.api")
+
+# --- Application Lifespan ---
+# OpenL3 models are loaded and warmed up once per worker and reused by every request. Importing
+# this module does not import TensorFlow; see MODEL_PRELOAD for when the models are loaded.
+model_preload_state = {"state": "pending", "error": None}
+embed_server_pool: Optional[EmbeddingServerPool] = None
+embed_server_client: Optional[EmbeddingServerClient] = None
+
+def _load_models() -> None:
+    model_preload_state["state"] = "loading"
+    try:
+        logger.info(f"Preloading OpenL3 models: {DEFAULT_MODEL_CONFIGS}")
+        for model_name, stats in preload_models(DEFAULT_MODEL_CONFIGS).items():
+            logger.info(f"Model {model_name} loaded in {stats['load_seconds']}s, warm-up {stats['warmup_seconds']}s, weights {stats['weights_bytes']} bytes")
+        if EMBED_BATCHING:
+            for input_repr, content_type, embedding_size in DEFAULT_MODEL_CONFIGS:
+                start_batcher(input_repr, content_type, embedding_size, max_batch_frames=EMBED_MAX_BATCH_FRAMES, max_wait_ms=EMBED_MAX_WAIT_MS)
+    except Exception as e:
+        # Requests still try to load the model themselves and report the failure individually.
+        model_preload_state.update(state="failed", error=str(e))
+        logger.error(f"Preloading OpenL3 models failed: {e}", exc_info=True)
+        return
+    model_preload_state["state"] = "ready"
+
+def _models_ready() -> bool:
+    if embed_server_client is not None:
+        return embed_server_client.healthy_workers() > 0
+    return models_loaded(DEFAULT_MODEL_CONFIGS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global vector_index, embed_server_pool, embed_server_client
+    if SCRATCH_RAM and ram_root() is None:
+        logger.warning(f"RESONA_SCRATCH_RAM is set but /dev/shm does not exist; scratch space stays at {SCRATCH_DIR}")
+    scratch_space.start(redirect_tempfiles=SCRATCH_SPOOL_UPLOADS)
+    if EMBED_SERVER == "spawn":
+        embed_server_pool = EmbeddingServerPool(
+            EMBED_SERVER_SOCKET_DIR,
+            workers=EMBED_SERVER_WORKERS,
+            model_configs=DEFAULT_MODEL_CONFIGS,
+            intra_op_threads=EMBED_SERVER_THREADS,
+            batcher_kwargs={"max_batch_frames": EMBED_MAX_BATCH_FRAMES, "max_wait_ms": EMBED_MAX_WAIT_MS},
+        )
+        embed_server_pool.start()
+    if EMBED_SERVER in ("spawn", "connect"):
+        # Inference runs in the embedding server; this process never loads a model.
+        embed_server_client = EmbeddingServerClient(EMBED_SERVER_SOCKET_DIR)
+        embed_server_client.start()
+        set_embedding_client(embed_server_client)
+    elif MODEL_PRELOAD == "startup":
+        _load_models()
+    elif MODEL_PRELOAD == "background":
+        threading.Thread(target=_load_models, name="resona-model-preload", daemon=True).start()
+    if VECTOR_STORE == "mmap":
+        vector_index = VectorIndex.open_store(VECTOR_INDEX_PATH, dim=EMBEDDING_PARAMS["embedding_size"], mode=VECTOR_INDEX_MODE, nprobe=VECTOR_INDEX_NPROBE)
+        logger.info(f"Similarity index is backed by the segment store with {len(vector_index)} segments")
+    elif os.path.exists(f"{VECTOR_INDEX_PATH}.npy"):
+        vector_index = VectorIndex.load(VECTOR_INDEX_PATH, mode=VECTOR_INDEX_MODE, nprobe=VECTOR_INDEX_NPROBE)
+        logger.info(f"Loaded {len(vector_index)} segments into the similarity index")
+    yield
+    await job_store.cancel_all()
+    stop_all_batchers()
+    if embed_server_client is not None:
+        set_embedding_client(None)
+        embed_server_client.stop()
+    if embed_server_pool is not None:
+        embed_server_pool.stop()
+    scheduler.shutdown()
+    if vector_index.store is not None:
+        vector_index.store.close()
+    elif len(vector_index):
+        vector_index.save(VECTOR_INDEX_PATH)
+    if embedding_cache is not None:
+        embedding_cache.close()
+    scratch_space.stop()
 
 # --- Application Setup ---
 app = FastAPI(
     title="RESONA API",
     description="API for analyzing audio segments and finding similar ones.",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 # --- CORS Configuration ---
@@ -46,10 +150,280 @@ if not os.path.exists(STATIC_DIR):
 # You will need to move your index.html into a 'static' folder in your project root.
 app.mount(f"/{STATIC_DIR}", StaticFiles(directory=STATIC_DIR), name="static")
 
-# --- Directory Setup ---
-TEMP_AUDIO_DIR = "temp_audio"
-if not os.path.exists(TEMP_AUDIO_DIR):
-    os.makedirs(TEMP_AUDIO_DIR)
+# --- Scratch Space ---
+# Scratch files go under SCRATCH_DIR, one subdirectory per process. Every multipart request
+# reserves its Content-Length against SCRATCH_QUOTA_BYTES (0 disables the quota) before its body
+# is read, and is refused with 503 and Retry-After if it does not fit.
+# RESONA_SCRATCH_RAM=1 puts the default root on tmpfs (/dev/shm), trading RAM for disk I/O.
+# RESONA_SCRATCH_SPOOL_UPLOADS=1 also sends uploads Starlette spools to disk (parts over 1 MB),
+# and everything else this process writes through tempfile, to SCRATCH_DIR instead of the
+# system temporary directory.
+# A reaper removes the directories of exited processes and request directories leaked for
+# SCRATCH_ORPHAN_AGE_SECONDS; it never touches files it did not create. See /api/scratch.
+SCRATCH_RAM = os.environ.get("RESONA_SCRATCH_RAM", "0") == "1"
+SCRATCH_DIR = os.environ.get("RESONA_SCRATCH_DIR", (SCRATCH_RAM and ram_root()) or os.path.join("temp_audio", "scratch"))
+SCRATCH_SPOOL_UPLOADS = os.environ.get("RESONA_SCRATCH_SPOOL_UPLOADS", "0") == "1"
+SCRATCH_QUOTA_BYTES = int(os.environ.get("RESONA_SCRATCH_QUOTA_BYTES", str(2 * 1024 * 1024 * 1024)))
+SCRATCH_ORPHAN_AGE_SECONDS = float(os.environ.get("RESONA_SCRATCH_ORPHAN_AGE_SECONDS", "900"))
+SCRATCH_REAP_INTERVAL_SECONDS = float(os.environ.get("RESONA_SCRATCH_REAP_INTERVAL_SECONDS", "60"))
+
+scratch_space = ScratchSpace(
+    SCRATCH_DIR,
+    quota_bytes=SCRATCH_QUOTA_BYTES,
+    orphan_age_seconds=SCRATCH_ORPHAN_AGE_SECONDS,
+    reap_interval_seconds=SCRATCH_REAP_INTERVAL_SECONDS,
+)
+
+# --- Worker Pools ---
+# Blocking work (yt-dlp downloads, file writes, OpenL3 inference) runs on these pools so the event
+# loop keeps serving other requests. When a pool's running + queued jobs reach its limit, new
+# requests are rejected with 429 (download) or 503 (embed) rather than queued indefinitely.
+DOWNLOAD_WORKERS = int(os.environ.get("RESONA_DOWNLOAD_WORKERS", "4"))
+DOWNLOAD_QUEUE_DEPTH = int(os.environ.get("RESONA_DOWNLOAD_QUEUE_DEPTH", "16"))
+# With batching enabled, embed workers only resample/frame audio and wait on the shared batcher,
+# so several of them are needed for requests to actually land in the same batch.
+EMBED_WORKERS = int(os.environ.get("RESONA_EMBED_WORKERS", "4"))
+EMBED_QUEUE_DEPTH = int(os.environ.get("RESONA_EMBED_QUEUE_DEPTH", "8"))
+SEARCH_WORKERS = int(os.environ.get("RESONA_SEARCH_WORKERS", "2"))
+SEARCH_QUEUE_DEPTH = int(os.environ.get("RESONA_SEARCH_QUEUE_DEPTH", "32"))
+
+# --- Inference Batching ---
+# Frames from concurrent requests are merged into one model.predict call. A batch is flushed when
+# it reaches EMBED_MAX_BATCH_FRAMES frames (~200 per 20s clip) or after EMBED_MAX_WAIT_MS.
+EMBED_BATCHING = os.environ.get("RESONA_EMBED_BATCHING", "1") == "1"
+EMBED_MAX_BATCH_FRAMES = int(os.environ.get("RESONA_EMBED_MAX_BATCH_FRAMES", "512"))
+EMBED_MAX_WAIT_MS = float(os.environ.get("RESONA_EMBED_MAX_WAIT_MS", "15"))
+
+# --- Model Loading ---
+# When the OpenL3/TensorFlow stack is imported and the models are warmed up:
+#   "startup"    - before the server accepts requests (startup takes several seconds).
+#   "background" - in a thread once the server is up, so it starts in well under a second.
+#                  Embedding requests arriving earlier wait for the load; the rest are unaffected.
+#   "lazy"       - on the first embedding request, without batching; for CLI and test runs.
+MODEL_PRELOAD = os.environ.get("RESONA_MODEL_PRELOAD", "background")
+
+# --- Embedding Server ---
+# Where OpenL3 inference runs:
+#   "off"     - in this process (see MODEL_PRELOAD).
+#   "spawn"   - in RESONA_EMBED_SERVER_WORKERS inference processes started and supervised by this one.
+#   "connect" - in inference processes started separately with `python -m services.embedding_server`,
+#               so any number of API workers share a fixed number of model copies.
+# PCM is handed over through shared memory; batching settings above apply inside each inference process.
+EMBED_SERVER = os.environ.get("RESONA_EMBED_SERVER", "off")
+EMBED_SERVER_WORKERS = int(os.environ.get("RESONA_EMBED_SERVER_WORKERS", "2"))
+EMBED_SERVER_SOCKET_DIR = os.environ.get("RESONA_EMBED_SERVER_SOCKET_DIR", DEFAULT_EMBED_SERVER_SOCKET_DIR)
+# TensorFlow intra-op threads per inference process; 0 leaves TensorFlow's default.
+EMBED_SERVER_THREADS = int(os.environ.get("RESONA_EMBED_SERVER_THREADS", "0"))
+# The inference backend (Keras, tf.function, TFLite or ONNX Runtime), its weight precision and
+# runtime threads are read from RESONA_INFERENCE_BACKEND, RESONA_INFERENCE_PRECISION and
+# RESONA_INFERENCE_THREADS by services/inference_backend.py, so embedding server processes pick
+# them up too. /api/models reports each model's backend and its parity check against Keras.
+
+scheduler = PipelineScheduler(
+    download_workers=DOWNLOAD_WORKERS,
+    download_queue=DOWNLOAD_QUEUE_DEPTH,
+    embed_workers=EMBED_WORKERS,
+    embed_queue=EMBED_QUEUE_DEPTH,
+    search_workers=SEARCH_WORKERS,
+    search_queue=SEARCH_QUEUE_DEPTH,
+)
+
+# --- Embedding Cache ---
+# Embeddings (plus segment metadata) are cached by video ID + segment window, or by upload content
+# hash, together with CACHE_KEY_PARAMS. Repeat submissions skip download and inference entirely.
+EMBEDDING_CACHE_ENABLED = os.environ.get("RESONA_EMBEDDING_CACHE", "1") == "1"
+EMBEDDING_CACHE_PATH = os.environ.get("RESONA_EMBEDDING_CACHE_PATH", os.path.join("cache", "embeddings.sqlite3"))
+EMBEDDING_CACHE_MEMORY_ENTRIES = int(os.environ.get("RESONA_EMBEDDING_CACHE_MEMORY_ENTRIES", "1024"))
+EMBEDDING_CACHE_DISK_ENTRIES = int(os.environ.get("RESONA_EMBEDDING_CACHE_DISK_ENTRIES", "100000"))
+# "float16" halves the on-disk cache; cosine similarity is unaffected to ~3 decimal places.
+EMBEDDING_CACHE_DTYPE = os.environ.get("RESONA_EMBEDDING_CACHE_DTYPE", "float32")
+
+embedding_cache = EmbeddingCache(
+    db_path=EMBEDDING_CACHE_PATH,
+    memory_max_entries=EMBEDDING_CACHE_MEMORY_ENTRIES,
+    disk_max_entries=EMBEDDING_CACHE_DISK_ENTRIES,
+    storage_dtype=EMBEDDING_CACHE_DTYPE,
+) if EMBEDDING_CACHE_ENABLED else None
+
+# --- Similarity Index ---
+# Every analysed YouTube segment is added to a local cosine-similarity index, which answers the
+# "similar segments" part of each response. Mode is "exact", "ivf" or "auto" (see vector_index.py).
+VECTOR_INDEX_MODE = os.environ.get("RESONA_VECTOR_INDEX_MODE", "auto")
+VECTOR_INDEX_NPROBE = int(os.environ.get("RESONA_VECTOR_INDEX_NPROBE", "16"))
+VECTOR_INDEX_PATH = os.environ.get("RESONA_VECTOR_INDEX_PATH", os.path.join("cache", "segment_index"))
+SIMILAR_SEGMENTS_K = int(os.environ.get("RESONA_SIMILAR_SEGMENTS_K", "6"))
+# How the index is persisted:
+#   "mmap"     - every added segment is appended to '<path>.f32' (memory-mapped vectors) and
+#                '<path>.sqlite3' (IDs and metadata) at once. Startup maps the file instead of
+#                reading it, and workers on the host share it and see each other's additions.
+#   "snapshot" - kept in memory and written to '<path>.npy' / '<path>.json' at shutdown.
+VECTOR_STORE = os.environ.get("RESONA_VECTOR_STORE", "mmap")
+# Coarse-to-fine search. With RESONA_TEMPORAL_RERANK=1, each embedded segment keeps a compact
+# frame sketch (1 s bins, int8) in the index. A search retrieves RERANK_CANDIDATES segments by
+# their mean vector, then re-ranks them by how well their frames line up with the query's
+# (see temporal_embedding.py). Stage timings are reported as coarse_search_ms and rerank_ms.
+TEMPORAL_RERANK = os.environ.get("RESONA_TEMPORAL_RERANK", "0") == "1"
+RERANK_CANDIDATES = int(os.environ.get("RESONA_RERANK_CANDIDATES", "50"))
+RERANK_WEIGHT = float(os.environ.get("RESONA_RERANK_WEIGHT", "0.5"))
+
+vector_index = VectorIndex(dim=EMBEDDING_PARAMS["embedding_size"], mode=VECTOR_INDEX_MODE, nprobe=VECTOR_INDEX_NPROBE)
+
+# --- Uploads ---
+# Uploads above MAX_UPLOAD_BYTES are rejected with 413 (0 disables the limit). Uploads above
+# STREAMING_UPLOAD_THRESHOLD_BYTES are decoded and embedded block by block instead of in one piece,
+# so a long recording (e.g. an hour-long DJ set) needs no more memory than a short clip.
+MAX_UPLOAD_BYTES = int(os.environ.get("RESONA_MAX_UPLOAD_BYTES", str(512 * 1024 * 1024)))
+STREAMING_UPLOAD_THRESHOLD_BYTES = int(os.environ.get("RESONA_STREAMING_UPLOAD_THRESHOLD_BYTES", str(8 * 1024 * 1024)))
+# Window length and spacing for per-window embeddings requested with ?include_windows=true.
+UPLOAD_WINDOW_SECONDS = float(os.environ.get("RESONA_UPLOAD_WINDOW_SECONDS", "20"))
+UPLOAD_WINDOW_HOP_SECONDS = float(os.environ.get("RESONA_UPLOAD_WINDOW_HOP_SECONDS", "10"))
+
+# --- Scratch Space Admission ---
+# A request without a Content-Length reserves the largest upload MAX_UPLOAD_BYTES allows.
+class ScratchAdmissionMiddleware:
+    """
+    Reserves scratch space for each multipart request before its body is read, and releases it
+    once the response has been sent in full (bulk upload responses stream long after the handler
+    returns, with the uploads still spooled). The lease is in request.state.scratch_lease.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        headers = dict(scope.get("headers") or ()) if scope["type"] == "http" else {}
+        if not headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+            await self.app(scope, receive, send)
+            return
+        length = headers.get(b"content-length", b"")
+        # Without a Content-Length, assume the largest upload that could be accepted.
+        nbytes = int(length) if length.isdigit() else min([limit for limit in (MAX_UPLOAD_BYTES, SCRATCH_QUOTA_BYTES) if limit] or [0])
+        if SCRATCH_QUOTA_BYTES and nbytes > SCRATCH_QUOTA_BYTES:
+            response = JSONResponse(status_code=413, content={"detail": f"Request body is {nbytes} bytes; the scratch space quota is {SCRATCH_QUOTA_BYTES} bytes."})
+            await response(scope, receive, send)
+            return
+        try:
+            lease = scratch_space.reserve(nbytes)
+        except ScratchSpaceFull as e:
+            logger.warning(f"Rejecting upload, scratch space is full ({e.requested_bytes} bytes requested, {e.available_bytes} available)")
+            response = JSONResponse(status_code=e.status_code, content={"detail": str(e)}, headers={"Retry-After": str(e.retry_after_seconds)})
+            await response(scope, receive, send)
+            return
+        scope.setdefault("state", {})["scratch_lease"] = lease
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            lease.release()
+
+app.add_middleware(ScratchAdmissionMiddleware)
+
+# --- Jobs ---
+# Finished asynchronous jobs and their results are kept this long for clients to collect.
+JOB_RESULT_TTL_SECONDS = float(os.environ.get("RESONA_JOB_RESULT_TTL_SECONDS", "600"))
+JOB_MAX_ENTRIES = int(os.environ.get("RESONA_JOB_MAX_ENTRIES", "10000"))
+
+job_store = JobStore(result_ttl_seconds=JOB_RESULT_TTL_SECONDS, max_jobs=JOB_MAX_ENTRIES)
+
+# --- Request Coalescing ---
+# Identical segments (same parse_youtube_url result and CACHE_KEY_PARAMS, i.e. the same cache key)
+# requested concurrently are downloaded and embedded once; see /api/coalescing for counts.
+segment_flights = SingleFlight("segments")
+
+# Fields of download_youtube_segment's result that are stored alongside a cached embedding.
+CACHED_SEGMENT_FIELDS = ("title", "artist", "album", "thumbnail_url", "original_url", "duration_seconds", "segment_display_time")
+
+@app.exception_handler(SchedulerBusyError)
+async def scheduler_busy_handler(request, exc: SchedulerBusyError):
+    logger.warning(f"Rejecting request, {exc.stage} pool is full ({exc.status_code})")
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after_seconds)},
+    )
+
+# --- Metrics ---
+REQUEST_SECONDS = metrics_registry.histogram("resona_http_request_seconds", "HTTP request latency.", ("method", "route", "status"))
+
+@app.middleware("http")
+async def record_request_metrics(request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Label by route template (e.g. /api/jobs/{job_id}) so IDs don't create a series each.
+    route = request.scope.get("route")
+    REQUEST_SECONDS.observe(
+        time.perf_counter() - start,
+        method=request.method,
+        route=getattr(route, "path", "unmatched"),
+        status=str(response.status_code),
+    )
+    return response
+
+def _collect_service_metrics():
+    families = []
+    pool_stats = scheduler.stats()
+    for field, metric_type in (("running", "gauge"), ("queued", "gauge"), ("completed", "counter"), ("rejected", "counter")):
+        name = f"resona_pool_{field}" + ("_total" if metric_type == "counter" else "")
+        families.append((name, metric_type, f"Jobs {field} per worker pool.", [({"pool": pool}, stats[field]) for pool, stats in pool_stats.items()]))
+    if embedding_cache is not None:
+        cache_stats = embedding_cache.stats()
+        families += [
+            ("resona_cache_lookups_total", "counter", "Embedding cache lookups by result.",
+             [({"result": result}, cache_stats[result]) for result in ("memory_hits", "disk_hits", "misses")]),
+            ("resona_cache_hit_ratio", "gauge", "Embedding cache hit rate since start.", [({}, cache_stats["hit_rate"])]),
+            ("resona_cache_entries", "gauge", "Embedding cache entries per tier.",
+             [({"tier": "memory"}, cache_stats["memory_entries"]), ({"tier": "disk"}, cache_stats["disk_entries"])]),
+        ]
+    families.append(("resona_index_vectors", "gauge", "Segments in the similarity index.", [({}, len(vector_index))]))
+    model_stats = get_model_stats()
+    families += [
+        ("resona_model_weights_bytes", "gauge", "Size of each loaded model's weights.", [({"model": name}, stats["weights_bytes"]) for name, stats in model_stats.items()]),
+        ("resona_model_rss_delta_bytes", "gauge", "Resident memory added by loading each model.", [({"model": name}, stats["rss_delta_bytes"]) for name, stats in model_stats.items()]),
+        ("resona_process_resident_memory_bytes", "gauge", "Resident set size of this worker.", [({}, read_rss_bytes())]),
+        ("resona_models_ready", "gauge", "1 once the default OpenL3 models are loaded and warmed up.", [({}, int(_models_ready()))]),
+    ]
+    # Models whose configured inference backend was checked against the Keras reference at load (see services/inference_backend.py).
+    checked = {name: stats["inference"] for name, stats in model_stats.items() if "parity" in stats.get("inference", {})}
+    families += [
+        ("resona_inference_parity_min_cosine", "gauge", "Lowest per-frame cosine similarity of each model's inference backend to the Keras reference.",
+         [({"model": name, "backend": info["backend"], "precision": info["precision"]}, info["parity"]["min_cosine"]) for name, info in checked.items()]),
+        ("resona_inference_speedup", "gauge", "Throughput of each model's inference backend relative to Keras on the parity clip.",
+         [({"model": name, "backend": info["backend"], "precision": info["precision"]}, info["parity"]["speedup"]) for name, info in checked.items()]),
+    ]
+    if embed_server_client is not None:
+        server_stats = embed_server_client.stats()
+        families += [
+            ("resona_embed_server_healthy_workers", "gauge", "Embedding server workers answering health checks.", [({}, server_stats["healthy_workers"])]),
+            ("resona_embed_server_in_flight", "gauge", "Requests in flight per embedding server worker.", [({"worker": name}, w["in_flight"]) for name, w in server_stats["workers"].items()]),
+            ("resona_embed_server_failures_total", "counter", "Failed requests per embedding server worker.", [({"worker": name}, w["failures"]) for name, w in server_stats["workers"].items()]),
+        ]
+    if embed_server_pool is not None:
+        families.append(("resona_embed_server_restarts_total", "counter", "Embedding server workers restarted after exiting.", [({}, embed_server_pool.stats()["restarts"])]))
+    batch_stats = get_batcher_stats()
+    families += [
+        ("resona_batcher_queue_depth", "gauge", "Requests waiting for the inference batcher.", [({"model": name}, stats["queue_depth"]) for name, stats in batch_stats.items()]),
+        ("resona_batcher_frames_total", "counter", "Frames embedded by the inference batcher.", [({"model": name}, stats["frames"]) for name, stats in batch_stats.items()]),
+    ]
+    extractor_stats = stream_info_cache.stats()
+    families += [
+        ("resona_ytdlp_info_lookups_total", "counter", "yt-dlp stream info cache lookups by result.",
+         [({"result": result}, extractor_stats[result]) for result in ("hits", "misses")]),
+        ("resona_ytdlp_extract_seconds_total", "counter", "Time spent in yt-dlp extraction.", [({}, extractor_stats["extract_seconds_total"])]),
+        ("resona_ytdlp_seconds_saved_total", "counter", "Estimated extraction time saved by stream info cache hits.", [({}, extractor_stats["estimated_seconds_saved"])]),
+    ]
+    scratch_stats = scratch_space.stats()
+    families += [
+        ("resona_scratch_reserved_bytes", "gauge", "Scratch space reserved by requests in flight.", [({}, scratch_stats["reserved_bytes"])]),
+        ("resona_scratch_quota_bytes", "gauge", "Scratch space quota (0 when unlimited).", [({}, scratch_stats["quota_bytes"])]),
+        ("resona_scratch_file_bytes", "gauge", "Bytes in scratch process directories at the last reaper pass.", [({}, scratch_stats["file_bytes"])]),
+        ("resona_scratch_filesystem_free_bytes", "gauge", "Free space on the filesystem holding the scratch root.", [({}, scratch_stats["filesystem_free_bytes"])]),
+    ]
+    flight_stats = segment_flights.stats()
+    families.append(("resona_coalesced_requests_total", "counter", "Segment requests that shared an in-flight analysis.", [({}, flight_stats["coalesced"])]))
+    job_stats = job_store.stats()
+    families.append(("resona_jobs_running", "gauge", "Asynchronous jobs currently running.", [({}, job_stats["running"])]))
+    return families
+
+metrics_registry.register_collector(_collect_service_metrics)
 
 # --- Pydantic Models (Data Schemas) ---
 # These will be moved to models/segment.py later.
@@ -57,6 +431,16 @@ if not os.path.exists(TEMP_AUDIO_DIR):
 class SegmentAnalysisRequest(BaseModel):
     youtube_url: str
 
+class EncodedEmbedding(BaseModel):
+    dtype: str # "float32", "float16" or "int8"
+    shape: List[int]
+    data: str # base64 of the little-endian vector bytes
+    scale: Optional[float] = None # int8 only: multiply the values by this to recover floats
+
+# Query parameters selecting how embeddings appear in responses (see services/embedding_codec.py).
+EmbeddingFormat = Literal["json", "base64", "none"]
+EmbeddingDtype = Literal["float32", "float16", "int8"]
+
 class SegmentInfo(BaseModel):
     id: str
     title: str
@@ -64,13 +448,76 @@ class SegmentInfo(BaseModel):
     youtube_link: str
     thumbnail_url: Optional[str] = None
     segment_display_time: str # e.g., "01:10 - 01:40"
+    duration_seconds: Optional[float] = None
     matched_features: List[str] = []
     similarity_score: Optional[float] = None
-    embedding: Optional[List[float]] = None
+    embedding: Optional[Union[List[float], EncodedEmbedding]] = None
+
+class SegmentWindow(BaseModel):
+    start_seconds: float
+    end_seconds: float
+    embedding: Optional[Union[List[float], EncodedEmbedding]] = None
 
 class AnalysisResponse(BaseModel):
     source_segment_info: SegmentInfo
     similar_segments: List[SegmentInfo]
+    stage_timings_ms: Optional[Dict[str, float]] = None
+    bytes_fetched: Optional[int] = None
+    segment_windows: Optional[List[SegmentWindow]] = None
+
+# SegmentInfo fields that are not stored in the similarity index alongside the vector.
+INDEX_EXCLUDED_FIELDS = {"embedding", "similarity_score"}
+
+def similarity_filters(
+    artist: Optional[List[str]] = Query(None, description="Only return segments by these artists."),
+    exclude_artist: Optional[List[str]] = Query(None, description="Leave out segments by these artists."),
+    tag: Optional[List[str]] = Query(None, description="Only return segments carrying all of these matched_features."),
+    min_duration: Optional[float] = Query(None, ge=0, description="Minimum segment length in seconds."),
+    max_duration: Optional[float] = Query(None, ge=0, description="Maximum segment length in seconds."),
+    exclude_same_artist: bool = Query(False, description="Leave out segments by the analysed segment's artist."),
+) -> Tuple[SearchFilter, bool]:
+    """Query parameters restricting which indexed segments a similarity search may return."""
+    return SearchFilter(artist, exclude_artist, tag, min_duration, max_duration), exclude_same_artist
+
+def _with_source_artist(filters: Optional[Tuple[SearchFilter, bool]], artist: str) -> Optional[SearchFilter]:
+    """Resolves exclude_same_artist against the analysed segment's artist."""
+    if filters is None:
+        return None
+    search_filter, exclude_same_artist = filters
+    if exclude_same_artist and artist:
+        # A copy: bulk requests share one filter across items with different artists.
+        search_filter = SearchFilter(
+            search_filter.artists, search_filter.exclude_artists + [artist], search_filter.tags,
+            search_filter.min_duration_seconds, search_filter.max_duration_seconds,
+        )
+    return None if search_filter.is_empty() else search_filter
+
+def _search_segments(
+    embedding: np.ndarray, exclude_ids: List[str], search_filter: Optional[SearchFilter], sketch: Optional[np.ndarray], timings: Dict[str, float]
+) -> List[Tuple[str, float, Dict[str, Any]]]:
+    if sketch is None:
+        return vector_index.search(embedding, SIMILAR_SEGMENTS_K, exclude_ids, None, search_filter)
+    with span("coarse_search", timings):
+        hits = vector_index.search(embedding, max(SIMILAR_SEGMENTS_K, RERANK_CANDIDATES), exclude_ids, None, search_filter)
+    with span("rerank", timings):
+        return rerank(sketch, hits, vector_index.sketches([segment_id for segment_id, _, _ in hits]), SIMILAR_SEGMENTS_K, RERANK_WEIGHT)
+
+async def find_similar_segments(
+    embedding: Optional[np.ndarray],
+    exclude_ids: List[str],
+    timings: Dict[str, float],
+    search_filter: Optional[SearchFilter] = None,
+    sketch: Optional[np.ndarray] = None,
+) -> List[SegmentInfo]:
+    """
+    Runs a filtered top-k cosine search on the search pool and converts the hits to SegmentInfo.
+
+    With the query's frame sketch, the top RERANK_CANDIDATES hits are re-ranked by frame alignment.
+    """
+    if embedding is None or len(vector_index) == 0:
+        return []
+    hits = await scheduler.run("search", _search_segments, embedding, exclude_ids, search_filter, sketch, timings, timings=timings)
+    return [SegmentInfo(**metadata, similarity_score=round(score, 4)) for _, score, metadata in hits]
 
 # --- API Endpoints ---
 
@@ -78,122 +525,451 @@ class AnalysisResponse(BaseModel):
 async def read_root():
     return {"message": f"Welcome to the RESONA API. Visit /{STATIC_DIR}/index.html for the app."}
 
-@app.post("/api/analyze-segment", response_model=AnalysisResponse)
-async def analyze_youtube_segment_endpoint(request_data: SegmentAnalysisRequest = Body(...)):
-    youtube_url = request_data.youtube_url
-    print(f"API: Received YouTube URL via JSON: {youtube_url}")
+@app.get("/api/models")
+async def list_loaded_models():
+    """Reports load time, warm-up time, memory use and inference backend of each preloaded OpenL3 model."""
+    return get_model_stats()
+
+@app.get("/api/health")
+async def health():
+    """Liveness and readiness: 'ready' is true once embeddings can be computed without waiting for a model load."""
+    if embed_server_client is not None:
+        return {
+            "status": "ok",
+            "ready": _models_ready(),
+            "embedding_server": {**embed_server_client.stats(), **({"pool": embed_server_pool.stats()} if embed_server_pool is not None else {})},
+        }
+    return {
+        "status": "ok",
+        "ready": _models_ready(),
+        "model_preload": MODEL_PRELOAD,
+        "model_preload_state": model_preload_state["state"],
+        "model_preload_error": model_preload_state["error"],
+        "openl3_import_seconds": openl3_import_seconds(),
+    }
+
+@app.get("/api/scheduler")
+async def scheduler_status():
+    """Reports running, queued, completed and rejected job counts for each worker pool."""
+    return scheduler.stats()
+
+@app.get("/api/batching")
+async def batching_status():
+    """Reports how many requests and frames each inference batcher has merged per predict call."""
+    return get_batcher_stats()
+
+@app.get("/api/index")
+async def index_status():
+    """Reports size, mode and memory of the similarity index."""
+    return vector_index.stats()
+
+@app.get("/api/coalescing")
+async def coalescing_status():
+    """Reports how many segment requests ran their own download/embedding and how many shared one."""
+    return segment_flights.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics: latency histograms, pool queue depths, cache hit rates, bytes fetched, model memory."""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/extractor")
+async def extractor_status():
+    """Reports yt-dlp stream info cache hit rate, extraction time and estimated time saved."""
+    return {**stream_info_cache.stats(), "session": ytdlp_session.stats()}
+
+@app.get("/api/scratch")
+async def scratch_status():
+    """Reports scratch space reservations against the quota, disk usage and the last reaper pass."""
+    return scratch_space.stats()
+
+@app.get("/api/cache")
+async def cache_status():
+    """Reports hit/miss counters and occupancy of the embedding cache."""
+    return embedding_cache.stats() if embedding_cache is not None else {"enabled": False}
+
+async def _fetch_and_embed_segment(
+    video_id: str, start_s: int, end_s: int, cache_key: str, report_stage: Callable[[str], None]
+) -> Tuple[Dict[str, Any], Optional[np.ndarray], Optional[np.ndarray], Dict[str, float]]:
+    """
+    Downloads and embeds one segment and caches the embedding. Runs once per in-flight segment;
+    `report_stage` reaches every caller sharing it.
+
+    Returns (download_info, embedding, frame sketch or None, timings).
+    """
+    timings: Dict[str, float] = {}
+    download_info = await scheduler.run("download", download_youtube_segment, video_id, start_s, end_s, timings=timings)
+
+    if not download_info or download_info.get("audio") is None:
+        raise HTTPException(status_code=500, detail="Failed to download or process YouTube segment.")
+
+    segment_audio = download_info.pop("audio")
+    if download_info.pop("info_cached", False):
+        timings["info_cache_hit"] = 1.0
+    logger.debug(f"Segment fetched for {video_id}: {segment_audio.shape[0]} samples ({download_info.get('bytes_fetched')} bytes fetched, {download_info.get('fetch_mode')} mode)")
+
+    # Process audio to get embedding
+    report_stage("embed")
+    segment_embedding = await scheduler.run(
+        "embed", process_audio_segment, segment_audio, download_info["sample_rate"], timings, TEMPORAL_RERANK, timings=timings
+    )
+    segment_sketch = None
+    if isinstance(segment_embedding, TemporalEmbedding):
+        segment_embedding, segment_sketch = segment_embedding.mean, segment_embedding.sketch
+    if segment_embedding is not None:
+        logger.debug(f"Embedding generated for {video_id}. Dimension: {len(segment_embedding)}")
+        if embedding_cache is not None:
+            metadata = {field: download_info.get(field) for field in CACHED_SEGMENT_FIELDS}
+            embedding_cache.put(cache_key, segment_embedding, metadata)
+    else:
+        logger.warning(f"Failed to generate embedding for {video_id}.")
+    return download_info, segment_embedding, segment_sketch, timings
+
+async def analyze_youtube_segment(
+    youtube_url: str,
+    embedding_format: str = "json",
+    embedding_dtype: str = "float16",
+    on_stage: Optional[Callable[[str], None]] = None,
+    filters: Optional[Tuple[SearchFilter, bool]] = None,
+) -> AnalysisResponse:
+    """
+    Runs the full segment pipeline (cache lookup, download + decode, embed, search, index).
+
+    Shared by the synchronous endpoint and asynchronous jobs. `on_stage` is called with the name
+    of each stage as it starts. `filters` comes from similarity_filters. Errors are raised as
+    HTTPException or SchedulerBusyError.
+    """
+    report_stage = on_stage or (lambda stage: None)
+    request_start = time.perf_counter()
+    timings: Dict[str, float] = {}
     
     try:
-        video_id, start_s, end_s = parse_youtube_url(youtube_url)
+        with span("parse_url", timings):
+            video_id, start_s, end_s = parse_youtube_url(youtube_url)
         if not video_id:
             raise HTTPException(status_code=400, detail="Invalid YouTube URL or could not parse Video ID.")
 
-        print(f"API: Parsed ID: {video_id}, Start: {start_s}s, End: {end_s}s")
-        
-        download_info = download_youtube_segment(video_id, start_s, end_s)
-        
-        if not download_info or not download_info.get("file_path"):
-            raise HTTPException(status_code=500, detail="Failed to download or process YouTube segment.")
-
-        file_path_for_processing = download_info.get("file_path")
-        print(f"API: Segment downloaded: {file_path_for_processing}")
-
-        # Process audio to get embedding
-        segment_embedding = None
-        if file_path_for_processing:
-            segment_embedding = process_audio_segment(file_path_for_processing)
-            if segment_embedding:
-                print(f"API: Embedding generated for {file_path_for_processing}. Dimension: {len(segment_embedding)}")
-            else:
-                print(f"API: Failed to generate embedding for {file_path_for_processing}.")
+        logger.debug(f"Parsed ID: {video_id}, Start: {start_s}s, End: {end_s}s")
+        segment_id = f"yt_{video_id}_{start_s if start_s is not None else 0}_{end_s if end_s is not None else 'end'}"
+
+        cache_key = youtube_cache_key(video_id, start_s, end_s, CACHE_KEY_PARAMS)
+        cached = embedding_cache.get(cache_key) if embedding_cache is not None else None
+        coalesced = False
+        if cached is not None:
+            cached_embedding, download_info = cached
+            segment_embedding = cached_embedding
+            # The cache holds only the mean vector; the sketch was stored when the segment was indexed.
+            segment_sketch = vector_index.sketches([segment_id])[0] if TEMPORAL_RERANK else None
+            timings["cache_hit"] = 1.0
+            logger.debug(f"Cache hit for {cache_key}")
+        else:
+            # ffmpeg decodes while it downloads, so "download" covers both.
+            report_stage("download")
+            # Concurrent requests for the same segment share one download and embedding, and each
+            # reports its stages and download/embed timings as its own.
+            (download_info, segment_embedding, segment_sketch, shared_timings), coalesced = await segment_flights.run(
+                cache_key, lambda notify: _fetch_and_embed_segment(video_id, start_s, end_s, cache_key, notify), listener=report_stage
+            )
+            timings.update(shared_timings)
+            if coalesced:
+                timings["coalesced"] = 1.0
+                logger.debug(f"Shared in-flight analysis of {cache_key}")
 
         source_segment = SegmentInfo(
-            id=f"yt_{video_id}_{start_s if start_s is not None else 0}_{end_s if end_s is not None else 'end'}",
+            id=segment_id,
             title=download_info.get("title", "Unknown Title"),
             artist=download_info.get("artist", "Unknown Artist"),
             youtube_link=download_info.get("original_url", youtube_url),
             thumbnail_url=download_info.get("thumbnail_url"),
             segment_display_time=download_info.get("segment_display_time", "N/A"),
+            duration_seconds=download_info.get("duration_seconds"),
             matched_features=["YouTube Segment", f"Duration: {(end_s if end_s else 0) - (start_s if start_s else 0)}s"],
-            embedding=segment_embedding
+            embedding=format_embedding(segment_embedding, embedding_format, embedding_dtype)
         )
         
-        similar_segments_placeholder = [
-            SegmentInfo(
-                id="similar_abc_placeholder", 
-                title="Placeholder Similar Song 1", 
-                artist="Demo Artist", 
-                youtube_link="https://www.youtube.com/watch?v=placeholder1",
-                thumbnail_url="https://placehold.co/400x225/E81C4F/white?text=Similar+1&font=lora",
-                segment_display_time="01:00 - 01:30", 
-                matched_features=["Similar Tempo", "Vibey Horns"],
-                similarity_score=0.92
-            )
-        ]
-
-        try:
-            # Ensure cleanup happens for the correct path
-            if file_path_for_processing and os.path.exists(file_path_for_processing):
-                os.remove(file_path_for_processing)
-                print(f"API: Cleaned up temporary file: {file_path_for_processing}")
-        except Exception as e_clean:
-            print(f"API: Error cleaning up file {file_path_for_processing}: {e_clean}")
+        report_stage("search")
+        search_filter = _with_source_artist(filters, source_segment.artist)
+        similar_segments = await find_similar_segments(segment_embedding, [source_segment.id], timings, search_filter, segment_sketch)
+        if segment_embedding is not None:
+            vector_index.add(source_segment.id, segment_embedding, source_segment.model_dump(exclude=INDEX_EXCLUDED_FIELDS), segment_sketch)
 
-        return AnalysisResponse(source_segment_info=source_segment, similar_segments=similar_segments_placeholder)
+        timings["total_ms"] = round((time.perf_counter() - request_start) * 1000, 2)
+        logger.debug(f"Stage timings for {video_id}: {timings}")
+        return AnalysisResponse(
+            source_segment_info=source_segment,
+            similar_segments=similar_segments,
+            stage_timings_ms=timings,
+            bytes_fetched=0 if cached is not None or coalesced else download_info.get("bytes_fetched"),
+        )
 
+    except SchedulerBusyError:
+        raise
     except ValueError as ve:
-        print(f"API: ValueError during YouTube processing: {ve}")
+        logger.warning(f"ValueError during YouTube processing: {ve}")
         raise HTTPException(status_code=400, detail=str(ve))
     except HTTPException as he:
-        print(f"API: HTTPException caught: {he.detail}")
+        logger.warning(f"HTTPException caught: {he.detail}")
         raise
     except Exception as e:
-        print(f"API: Unexpected error in analyze_youtube_segment: {e}")
+        logger.error(f"Unexpected error in analyze_youtube_segment: {e}")
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
 
-@app.post("/api/analyze-audio", response_model=AnalysisResponse)
-async def analyze_audio_file_endpoint(audio_file: UploadFile = File(...)):
-    file_path = os.path.join(TEMP_AUDIO_DIR, audio_file.filename)
-    print(f"API: Receiving audio file: {audio_file.filename}")
+@app.post("/api/analyze-segment", response_model=AnalysisResponse)
+async def analyze_youtube_segment_endpoint(
+    request_data: SegmentAnalysisRequest = Body(...),
+    embedding_format: EmbeddingFormat = "json",
+    embedding_dtype: EmbeddingDtype = "float16",
+    filters: Tuple[SearchFilter, bool] = Depends(similarity_filters),
+):
+    logger.debug(f"Received YouTube URL via JSON: {request_data.youtube_url}")
+    return await analyze_youtube_segment(request_data.youtube_url, embedding_format, embedding_dtype, filters=filters)
+
+# --- Asynchronous Jobs ---
+# POST /api/jobs/analyze-segment returns a job ID immediately. Clients follow progress by polling
+# GET /api/jobs/{job_id} or subscribing to GET /api/jobs/{job_id}/events (server-sent events).
+# Results stay retrievable for JOB_RESULT_TTL_SECONDS, so a reconnecting client never recomputes.
+
+class JobSubmission(BaseModel):
+    job_id: str
+    status: str
+    status_url: str
+    events_url: str
+
+async def _run_segment_job(
+    job: Job, youtube_url: str, embedding_format: str, embedding_dtype: str, filters: Tuple[SearchFilter, bool]
+) -> Dict[str, Any]:
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(audio_file.file, buffer)
-        print(f"API: Audio file saved to: {file_path}")
-    except Exception as e:
-        print(f"API: Error saving file: {e}")
-        raise HTTPException(status_code=500, detail=f"Could not save file: {e}")
-    finally:
-        audio_file.file.close()
-
-    # Process uploaded audio to get embedding
-    segment_embedding_upload = None
-    if os.path.exists(file_path):
-        segment_embedding_upload = process_audio_segment(file_path)
-        if segment_embedding_upload:
-            print(f"API: Embedding generated for uploaded file {audio_file.filename}. Dimension: {len(segment_embedding_upload)}")
+        response = await analyze_youtube_segment(
+            youtube_url, embedding_format, embedding_dtype, on_stage=lambda stage: job_store.set_stage(job, stage), filters=filters
+        )
+    except HTTPException as he:
+        raise JobFailed(he.status_code, str(he.detail))
+    except SchedulerBusyError as e:
+        raise JobFailed(e.status_code, str(e), {"Retry-After": str(e.retry_after_seconds)})
+    return response.model_dump()
+
+@app.post("/api/jobs/analyze-segment", response_model=JobSubmission, status_code=202)
+async def submit_segment_job(
+    request_data: SegmentAnalysisRequest = Body(...),
+    embedding_format: EmbeddingFormat = "json",
+    embedding_dtype: EmbeddingDtype = "float16",
+    filters: Tuple[SearchFilter, bool] = Depends(similarity_filters),
+):
+    job = job_store.create("analyze-segment")
+    job_store.start(job, _run_segment_job(job, request_data.youtube_url, embedding_format, embedding_dtype, filters))
+    logger.debug(f"Submitted job {job.id} for {request_data.youtube_url}")
+    return JobSubmission(job_id=job.id, status=job.status, status_url=f"/api/jobs/{job.id}", events_url=f"/api/jobs/{job.id}/events")
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Returns a job's status and stage history, plus its result or error once finished."""
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job ID.")
+    return job.snapshot()
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """Streams a job's state as server-sent events: one 'progress' event per change, then 'done' or 'failed'."""
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job ID.")
+
+    async def event_stream():
+        async for state in job_store.events(job):
+            if state is None:
+                yield ": keep-alive\n\n"
+                continue
+            event = state["status"] if state["status"] in ("done", "failed") else "progress"
+            yield f"event: {event}\ndata: {json.dumps(state)}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/api/jobs")
+async def job_status():
+    """Reports submitted, finished, failed and running job counts."""
+    return job_store.stats()
+
+def _hash_upload(source_file) -> Tuple[int, str]:
+    """Streams the upload from the start to get its size and SHA-256, then rewinds it for decoding."""
+    digest = hashlib.sha256()
+    size = 0
+    # A retried bulk item may have read the file before.
+    source_file.seek(0)
+    for chunk in iter(lambda: source_file.read(1024 * 1024), b""):
+        digest.update(chunk)
+        size += len(chunk)
+    source_file.seek(0)
+    return size, digest.hexdigest()
+
+async def analyze_uploaded_audio(
+    audio_file: UploadFile,
+    include_windows: bool = False,
+    embedding_format: str = "json",
+    embedding_dtype: str = "float16",
+    filters: Optional[Tuple[SearchFilter, bool]] = None,
+    close_file: bool = True,
+) -> AnalysisResponse:
+    """
+    Runs the upload pipeline (hash, cache lookup, decode + embed, search), then closes the file
+    unless `close_file` is False.
+
+    Shared by the single and bulk upload endpoints. Errors are raised as HTTPException or
+    SchedulerBusyError; bulk items rejected as busy are run again on the same file, so they keep
+    it open until the item has finished.
+    """
+    logger.debug(f"Receiving audio file: {audio_file.filename}")
+    request_start = time.perf_counter()
+    timings: Dict[str, float] = {}
+    try:
+        try:
+            upload_size, content_sha256 = await scheduler.run("download", _hash_upload, audio_file.file, timings=timings)
+            logger.debug(f"Audio file received: {audio_file.filename} ({upload_size} bytes)")
+        except SchedulerBusyError:
+            raise
+        except Exception as e:
+            logger.error(f"Error reading uploaded file: {e}")
+            raise HTTPException(status_code=500, detail=f"Could not read file: {e}")
+        if MAX_UPLOAD_BYTES and upload_size > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"Uploaded file is {upload_size} bytes; the limit is {MAX_UPLOAD_BYTES} bytes.")
+
+        # Process uploaded audio to get embedding. The upload is decoded from memory or streamed
+        # from the spooled upload file, never copied to our own temp files.
+        segment_embedding_upload = None
+        upload_sketch = None
+        segment_windows = None
+        stream_upload = include_windows or upload_size > STREAMING_UPLOAD_THRESHOLD_BYTES
+        # Streamed audio skips the optional front-end conditioning, so it is keyed on the model parameters alone.
+        cache_key = upload_cache_key(content_sha256, EMBEDDING_PARAMS if stream_upload else CACHE_KEY_PARAMS)
+        # Per-window embeddings are not cached, so a request for them always runs the streaming path.
+        cached = embedding_cache.get(cache_key) if embedding_cache is not None and not include_windows else None
+        if cached is not None:
+            segment_embedding_upload = cached[0]
+            timings["cache_hit"] = 1.0
+            logger.debug(f"Cache hit for uploaded file {audio_file.filename} ({cache_key})")
         else:
-            print(f"API: Failed to generate embedding for uploaded file {audio_file.filename}.")
+            if stream_upload:
+                streamed = await scheduler.run(
+                    "embed", process_audio_stream, audio_file.file, include_windows,
+                    UPLOAD_WINDOW_SECONDS, UPLOAD_WINDOW_HOP_SECONDS, timings=timings,
+                )
+                if streamed is not None:
+                    segment_embedding_upload = streamed["embedding"]
+                    if include_windows:
+                        segment_windows = [
+                            SegmentWindow(
+                                start_seconds=window["start_seconds"],
+                                end_seconds=window["end_seconds"],
+                                embedding=format_embedding(window["embedding"], embedding_format, embedding_dtype),
+                            )
+                            for window in streamed["windows"]
+                        ]
+                    logger.debug(f"Streamed {streamed['duration_seconds']}s of audio from {audio_file.filename} ({streamed['frame_count']} frames)")
+            else:
+                audio_bytes = await audio_file.read()
+                # Only uploads embedded in one piece get a frame sketch; streamed ones are searched by their mean alone.
+                segment_embedding_upload = await scheduler.run("embed", process_audio_segment, audio_bytes, None, timings, TEMPORAL_RERANK, timings=timings)
+                if isinstance(segment_embedding_upload, TemporalEmbedding):
+                    segment_embedding_upload, upload_sketch = segment_embedding_upload.mean, segment_embedding_upload.sketch
+            if segment_embedding_upload is not None:
+                logger.debug(f"Embedding generated for uploaded file {audio_file.filename}. Dimension: {len(segment_embedding_upload)}")
+                if embedding_cache is not None:
+                    embedding_cache.put(cache_key, segment_embedding_upload)
+            else:
+                logger.warning(f"Failed to generate embedding for uploaded file {audio_file.filename}.")
+    finally:
+        if close_file:
+            audio_file.file.close()
 
     source_info_placeholder = SegmentInfo(
-        id=f"upload_{audio_file.filename.split('.')[0]}_{int(os.path.getmtime(file_path))}", 
+        id=f"upload_{audio_file.filename.split('.')[0]}_{content_sha256[:12]}", 
         title=audio_file.filename, 
         artist="Uploaded Audio", 
         youtube_link="#", 
         thumbnail_url="https://placehold.co/400x225/777/fff?text=Audio+File",
         segment_display_time="Full duration",
         matched_features=["Uploaded File", "Local Analysis"],
-        embedding=segment_embedding_upload
+        embedding=format_embedding(segment_embedding_upload, embedding_format, embedding_dtype)
     )
-    similar_segments_placeholder = [] 
-    
-    try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            print(f"API: Cleaned up temporary uploaded file: {file_path}")
-    except Exception as e_clean:
-        print(f"API: Error cleaning up uploaded file {file_path}: {e_clean}")
+    # Uploads are matched against the catalogue but not added to it, since they have no public link.
+    # Uploads have no known artist, so exclude_same_artist has nothing to exclude.
+    similar_segments = await find_similar_segments(segment_embedding_upload, [], timings, _with_source_artist(filters, ""), upload_sketch)
+
+    timings["total_ms"] = round((time.perf_counter() - request_start) * 1000, 2)
+    logger.debug(f"Stage timings for upload {audio_file.filename}: {timings}")
+    return AnalysisResponse(
+        source_segment_info=source_info_placeholder,
+        similar_segments=similar_segments,
+        stage_timings_ms=timings,
+        segment_windows=segment_windows,
+    )
+
+@app.post("/api/analyze-audio", response_model=AnalysisResponse)
+async def analyze_audio_file_endpoint(
+    audio_file: UploadFile = File(...),
+    include_windows: bool = False,
+    embedding_format: EmbeddingFormat = "json",
+    embedding_dtype: EmbeddingDtype = "float16",
+    filters: Tuple[SearchFilter, bool] = Depends(similarity_filters),
+):
+    return await analyze_uploaded_audio(audio_file, include_windows, embedding_format, embedding_dtype, filters)
+
+# --- Bulk Analysis ---
+# POST /api/bulk/analyze-segment (JSON list of URLs) and POST /api/bulk/analyze-audio (multipart
+# files) run up to BULK_MAX_ITEMS items per request through the same pipeline as the single-item
+# endpoints, BULK_CONCURRENCY at a time, so downloads of later items overlap embedding of earlier
+# ones. Results stream back as NDJSON, one line per item as it finishes ({"index", "status",
+# "result"} or {"index", "status": "error", "status_code", "error"}), then a {"summary"} line.
+BULK_MAX_ITEMS = int(os.environ.get("RESONA_BULK_MAX_ITEMS", "500"))
+# Default: enough items in flight to keep every download and embed worker busy.
+BULK_CONCURRENCY = int(os.environ.get("RESONA_BULK_CONCURRENCY", str(DOWNLOAD_WORKERS + EMBED_WORKERS)))
+
+class BulkSegmentAnalysisRequest(BaseModel):
+    youtube_urls: List[str]
 
-    return AnalysisResponse(source_segment_info=source_info_placeholder, similar_segments=similar_segments_placeholder)
+def _bulk_response(items: List[Any], process: Callable[[Any], Any], finish: Optional[Callable[[Any], None]] = None) -> StreamingResponse:
+    if not items:
+        raise HTTPException(status_code=400, detail="No items to analyze.")
+    if len(items) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"{len(items)} items submitted; the limit is {BULK_MAX_ITEMS} per request.")
+
+    async def process_item(item: Any) -> Dict[str, Any]:
+        return (await process(item)).model_dump()
+
+    async def ndjson_lines():
+        async for record in BulkRun(items, process_item, BULK_CONCURRENCY, finish=finish):
+            yield json.dumps(record) + "\n"
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/api/bulk/analyze-segment")
+async def bulk_analyze_segments(
+    request_data: BulkSegmentAnalysisRequest = Body(...),
+    embedding_format: EmbeddingFormat = "none",
+    embedding_dtype: EmbeddingDtype = "float16",
+    filters: Tuple[SearchFilter, bool] = Depends(similarity_filters),
+):
+    """Analyzes many YouTube segments, streaming one NDJSON line per segment and a summary. Embeddings are left out unless requested."""
+    logger.debug(f"Received bulk request for {len(request_data.youtube_urls)} YouTube URLs")
+    return _bulk_response(
+        request_data.youtube_urls,
+        lambda url: analyze_youtube_segment(url, embedding_format, embedding_dtype, filters=filters),
+    )
+
+@app.post("/api/bulk/analyze-audio")
+async def bulk_analyze_audio(
+    audio_files: List[UploadFile] = File(...),
+    embedding_format: EmbeddingFormat = "none",
+    embedding_dtype: EmbeddingDtype = "float16",
+    filters: Tuple[SearchFilter, bool] = Depends(similarity_filters),
+):
+    """Analyzes many uploaded files, streaming one NDJSON line per file and a summary. Embeddings are left out unless requested."""
+    logger.debug(f"Received bulk request for {len(audio_files)} uploaded files")
+    return _bulk_response(
+        audio_files,
+        lambda audio_file: analyze_uploaded_audio(audio_file, False, embedding_format, embedding_dtype, filters, close_file=False),
+        finish=lambda audio_file: audio_file.file.close(),
+    )
 
 # --- Main Execution Guard ---
 if __name__ == "__main__":
@@ -0,0 +1,199 @@
+import io
+import logging
+import re
+import subprocess
+import threading
+from typing import BinaryIO, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import soundfile as sf
+
+try:
+    import soxr  # Streaming resampler; installed with librosa >= 0.10.
+except ImportError:
+    soxr = None
+
+logger = logging.getLogger(__name__)
+
+# Everything decoded here comes out in the embedder's native input format.
+DECODE_SAMPLE_RATE = 48000
+DECODE_CHANNELS = 1
+
+FFMPEG_BINARY = "ffmpeg"
+
+# At -loglevel verbose, ffmpeg reports how many bytes each input was read for when it closes it.
+_BYTES_READ_PATTERN = re.compile(r"Statistics: (\d+) bytes read")
+
+
+class AudioDecodeError(Exception):
+    """Raised when audio cannot be decoded from a buffer, stream or URL."""
+
+
+def ffmpeg_decode(
+    input_url: str = "pipe:0",
+    input_bytes: Optional[bytes] = None,
+    pre_input_args: Sequence[str] = (),
+    post_input_args: Sequence[str] = (),
+    sample_rate: int = DECODE_SAMPLE_RATE,
+    channels: int = DECODE_CHANNELS,
+    timeout: Optional[float] = 120,
+) -> Tuple[np.ndarray, Dict[str, int]]:
+    """
+    Decodes audio with ffmpeg straight into a float32 NumPy array, with no intermediate file.
+
+    Args:
+        input_url: What ffmpeg reads from: a URL, a path, or 'pipe:0' to read `input_bytes` from stdin.
+        input_bytes: Encoded audio to feed through stdin when `input_url` is 'pipe:0'.
+        pre_input_args: Arguments placed before '-i' (e.g. '-ss' for input seeking, '-headers').
+        post_input_args: Arguments placed after '-i' (e.g. '-t' to bound the duration).
+        sample_rate: Output sample rate.
+        channels: Output channel count.
+        timeout: Seconds before the ffmpeg process is killed.
+
+    Returns:
+        A tuple (audio, stats). `audio` is float32 of shape (samples,) for mono or (samples, channels).
+        `stats` has 'bytes_read', the bytes ffmpeg pulled from its input.
+
+    Raises:
+        AudioDecodeError: If ffmpeg is missing, fails, or produces no audio.
+    """
+    command: List[str] = [FFMPEG_BINARY, "-hide_banner", "-loglevel", "verbose"]
+    if input_bytes is None:
+        command.append("-nostdin")
+    command += list(pre_input_args)
+    command += ["-i", input_url, "-vn"]
+    command += list(post_input_args)
+    command += ["-ac", str(channels), "-ar", str(sample_rate), "-f", "f32le", "pipe:1"]
+
+    try:
+        completed = subprocess.run(command, input=input_bytes, capture_output=True, timeout=timeout)
+    except FileNotFoundError as e:
+        raise AudioDecodeError("ffmpeg is not installed or not on PATH.") from e
+    except subprocess.TimeoutExpired as e:
+        raise AudioDecodeError(f"ffmpeg timed out after {timeout}s decoding {input_url if input_bytes is None else 'buffer'}.") from e
+
+    stderr = completed.stderr.decode("utf-8", errors="replace")
+    if completed.returncode != 0:
+        last_lines = " | ".join(line for line in stderr.strip().splitlines()[-3:])
+        raise AudioDecodeError(f"ffmpeg exited with code {completed.returncode}: {last_lines}")
+
+    audio = np.frombuffer(completed.stdout, dtype=np.float32)
+    if audio.size == 0:
+        raise AudioDecodeError("ffmpeg produced no audio samples.")
+    if channels > 1:
+        audio = audio.reshape(-1, channels)
+
+    # The first 'Statistics' line belongs to the input; output stats are reported as bytes written.
+    bytes_read = _BYTES_READ_PATTERN.findall(stderr)
+    stats = {"bytes_read": int(bytes_read[0]) if bytes_read else (len(input_bytes) if input_bytes is not None else 0)}
+    return audio, stats
+
+
+def decode_audio_bytes(data: bytes) -> Tuple[np.ndarray, int]:
+    """
+    Decodes an encoded audio file held in memory (e.g. an upload) to a float32 array.
+
+    libsndfile formats (WAV, FLAC, OGG, and MP3 on recent builds) are decoded in-process at their
+    native rate. Anything else is piped through ffmpeg, which also resamples to 48 kHz mono.
+
+    Returns:
+        A tuple (audio, sample_rate).
+    """
+    if not data:
+        raise AudioDecodeError("Audio buffer is empty.")
+    try:
+        audio, sr = sf.read(io.BytesIO(data), dtype="float32", always_2d=False)
+        if audio.size:
+            return audio, sr
+    except (RuntimeError, TypeError) as e:
+        logger.debug(f"soundfile could not decode buffer ({e}); falling back to ffmpeg")
+    audio, _ = ffmpeg_decode(input_bytes=data)
+    return audio, DECODE_SAMPLE_RATE
+
+
+def _iter_ffmpeg_blocks(source: BinaryIO, block_samples: int, sample_rate: int) -> Iterator[np.ndarray]:
+    """Decodes `source` incrementally through an ffmpeg pipe, yielding mono float32 blocks."""
+    command = [FFMPEG_BINARY, "-hide_banner", "-loglevel", "error", "-i", "pipe:0", "-vn",
+               "-ac", "1", "-ar", str(sample_rate), "-f", "f32le", "pipe:1"]
+    try:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except FileNotFoundError as e:
+        raise AudioDecodeError("ffmpeg is not installed or not on PATH.") from e
+
+    def _feed() -> None:
+        try:
+            for chunk in iter(lambda: source.read(1024 * 1024), b""):
+                process.stdin.write(chunk)
+        except (BrokenPipeError, ValueError):
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    # stdin is fed from a separate thread so ffmpeg never blocks on a full stdout pipe.
+    feeder = threading.Thread(target=_feed, name="resona-ffmpeg-feed", daemon=True)
+    feeder.start()
+    block_bytes = block_samples * 4
+    produced = 0
+    try:
+        while True:
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+            # f32le samples are 4 bytes; a short read can only happen at the very end of the stream.
+            usable = len(data) - len(data) % 4
+            produced += usable
+            yield np.frombuffer(data[:usable], dtype=np.float32)
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        feeder.join(timeout=1)
+    if produced == 0:
+        raise AudioDecodeError("ffmpeg produced no audio samples.")
+
+
+def iter_pcm_blocks(source: BinaryIO, block_seconds: float = 10.0, sample_rate: int = DECODE_SAMPLE_RATE) -> Iterator[np.ndarray]:
+    """
+    Yields an audio file as consecutive mono float32 blocks at `sample_rate`, one block at a time.
+
+    Memory use depends on `block_seconds`, not on the length of the file. libsndfile formats are
+    read with soundfile's block reader and resampled with a streaming resampler, so block
+    boundaries introduce no discontinuities. Other formats, or any resampling without soxr
+    available, are decoded incrementally by ffmpeg.
+
+    Args:
+        source: A seekable binary file object positioned at the start of the audio.
+        block_seconds: Length of each yielded block, in seconds of output audio.
+        sample_rate: Output sample rate.
+    """
+    block_samples = int(block_seconds * sample_rate)
+    start_position = source.tell()
+    try:
+        sound_file = sf.SoundFile(source)
+    except (RuntimeError, TypeError) as e:
+        logger.debug(f"soundfile could not open stream ({e}); decoding incrementally with ffmpeg")
+        sound_file = None
+
+    if sound_file is not None and (sound_file.samplerate == sample_rate or soxr is not None):
+        with sound_file:
+            native_rate = sound_file.samplerate
+            resampler = soxr.ResampleStream(native_rate, sample_rate, 1, dtype="float32") if native_rate != sample_rate else None
+            native_block = max(1, int(block_seconds * native_rate))
+            blocks = sound_file.blocks(blocksize=native_block, dtype="float32", always_2d=True)
+            for block in blocks:
+                mono = block.mean(axis=1) if block.shape[1] > 1 else block[:, 0]
+                if resampler is not None:
+                    is_last = sound_file.tell() >= sound_file.frames
+                    mono = resampler.resample_chunk(mono, last=is_last)
+                if mono.size:
+                    yield np.ascontiguousarray(mono, dtype=np.float32)
+        return
+
+    if sound_file is not None:
+        sound_file.close()
+    source.seek(start_position)
+    yield from _iter_ffmpeg_blocks(source, block_samples, sample_rate)
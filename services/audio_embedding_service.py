@@ -1,16 +1,23 @@
-import openl3
 import soundfile as sf
 import numpy as np
 import logging
-from typing import Optional, List
+from typing import Optional, List, Dict, Any, Iterable, Tuple, Union
+
+from .model_registry import get_backend, import_openl3
+from .embedding_batcher import get_running_batcher
+from .embedding_server import get_embedding_client
+from .embedding_profiles import get_profile
+from .metrics import registry, span
+from .temporal_embedding import FRAME_HOP_SECONDS, TemporalEmbedding
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO)
 
 # OpenL3 expects audio to be at 48kHz. 
 # The get_audio_embedding function handles resampling if needed, but it's good to be aware.
 TARGET_SR = 48000 
 
+EMBEDDED_FRAMES = registry.counter("resona_embedded_frames_total", "OpenL3 frames embedded, by embedding profile.", ("profile",))
+
 def get_openl3_embedding(
     audio_file_path: str, 
     input_repr: str = "mel256", 
@@ -31,40 +38,299 @@ def get_openl3_embedding(
         or None if an error occurs.
     """
     try:
-        audio, sr = sf.read(audio_file_path)
+        audio, sr = sf.read(audio_file_path, dtype="float32")
         if audio is None:
             logger.error(f"Could not read audio from {audio_file_path}")
             return None
 
-        logger.info(f"Successfully read audio from {audio_file_path}, SR: {sr}, Shape: {audio.shape}")
+        logger.debug(f"Successfully read audio from {audio_file_path}, SR: {sr}, Shape: {audio.shape}")
+    except Exception as e:
+        logger.error(f"Error reading audio file {audio_file_path}: {e}", exc_info=True)
+        return None
+
+    return get_openl3_embedding_from_array(
+        audio, sr,
+        input_repr=input_repr,
+        content_type=content_type,
+        embedding_size=embedding_size,
+        source_label=audio_file_path
+    )
+
+def compute_frame_embeddings(
+    audio: np.ndarray,
+    sr: int,
+    input_repr: str = "mel256",
+    content_type: str = "music",
+    embedding_size: int = 512,
+    profile: Optional[str] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns frame-level OpenL3 embeddings and timestamps for `audio`, as openl3.get_audio_embedding does.
+
+    Frames are cut and chosen as the embedding profile says (see embedding_profiles); with the
+    default "accurate" profile that is OpenL3's own framing. Inference goes to the embedding
+    server when this process is connected to one, otherwise to the in-process batcher for the
+    model if it is running, otherwise straight to the model's inference backend.
+    """
+    key = (input_repr, content_type, embedding_size)
+    embedding_profile = get_profile(profile)
+    client = get_embedding_client()
+    if client is not None:
+        embeddings, timestamps = client.embed_audio(audio, sr, key, embedding_profile.name)
+    else:
+        # The kapre frontend computes the spectrogram inside the model, so frames are raw audio here.
+        frames = import_openl3().core.preprocess_audio(audio, sr, hop_size=embedding_profile.hop_seconds, input_repr=None, center=True)
+        selected = embedding_profile.select(frames)
+        if selected is None:
+            timestamps = np.arange(frames.shape[0]) * embedding_profile.hop_seconds
+        else:
+            frames = frames[selected]
+            timestamps = selected * embedding_profile.hop_seconds
+        batcher = get_running_batcher(*key)
+        if batcher is not None:
+            embeddings = batcher.submit_frames(frames).result()
+        else:
+            embeddings = get_backend(*key).predict(frames, 32)
+    EMBEDDED_FRAMES.inc(len(embeddings), profile=embedding_profile.name)
+    return embeddings, timestamps
 
+def get_openl3_embedding_from_array(
+    audio: np.ndarray,
+    sr: int,
+    input_repr: str = "mel256",
+    content_type: str = "music",
+    embedding_size: int = 512,
+    source_label: str = "in-memory audio",
+    temporal: bool = False,
+    profile: Optional[str] = None,
+) -> Optional[Union[np.ndarray, TemporalEmbedding]]:
+    """
+    Generates an OpenL3 embedding for audio samples that are already in memory.
+
+    Args:
+        audio: Mono (samples,) or multi-channel (samples, channels) audio.
+        sr: Sample rate of `audio`.
+        input_repr: OpenL3 input representation ('linear', 'mel128', 'mel256').
+        content_type: OpenL3 content type ('music', 'env').
+        embedding_size: OpenL3 embedding size (512 or 6144).
+        source_label: Description of the audio's origin, used only in log messages.
+        temporal: Return the frames pooled at several time scales instead of only their mean.
+        profile: Name of the embedding profile that sets the frame hop and budget; None for the default.
+
+    Returns:
+        A NumPy array representing the mean embedding for the audio (a TemporalEmbedding, whose
+        `mean` is that same vector, if `temporal`), or None if an error occurs.
+    """
+    try:
         # Get embedding. This function can handle mono or stereo audio.
         # It returns a list of embedding vectors (emb_list) and a list of corresponding timestamps (ts_list).
         # For a short clip (e.g., 20s), we might get multiple embeddings if OpenL3's hop size is small.
         # We will average these embeddings to get a single representative vector for the clip.
-        emb_list, ts_list = openl3.get_audio_embedding(
-            audio, 
-            sr, 
-            input_repr=input_repr, 
-            content_type=content_type, 
-            embedding_size=embedding_size
-        )
+        with span("openl3_inference"):
+            emb_list, ts_list = compute_frame_embeddings(audio, sr, input_repr, content_type, embedding_size, profile)
 
         if emb_list is None or len(emb_list) == 0:
-            logger.error(f"OpenL3 did not return any embeddings for {audio_file_path}.")
+            logger.error(f"OpenL3 did not return any embeddings for {source_label}.")
             return None
 
+        if temporal:
+            # Frames picked under a frame budget are near-evenly spaced; pool them at their mean spacing.
+            hop_seconds = float(ts_list[-1] - ts_list[0]) / (len(ts_list) - 1) if len(ts_list) > 1 else FRAME_HOP_SECONDS
+            with span("temporal_pooling"):
+                pooled = TemporalEmbedding(emb_list, hop_seconds=hop_seconds)
+            logger.debug(f"Generated temporal OpenL3 embedding for {source_label}: {pooled.frame_count} frames, sketch {pooled.sketch.shape}")
+            return pooled
+
         # Average the embeddings to get a single vector representation for the clip
         mean_embedding = np.mean(emb_list, axis=0)
-        logger.info(f"Generated OpenL3 embedding for {audio_file_path}. Shape: {mean_embedding.shape}")
+        logger.debug(f"Generated OpenL3 embedding for {source_label}. Shape: {mean_embedding.shape}")
         
         return mean_embedding
 
     except Exception as e:
-        logger.error(f"Error generating OpenL3 embedding for {audio_file_path}: {e}", exc_info=True)
+        logger.error(f"Error generating OpenL3 embedding for {source_label}: {e}", exc_info=True)
+        return None
+
+# Frame geometry used by OpenL3: one-second frames, by default 0.1s apart.
+FRAME_SECONDS = 1.0
+DEFAULT_HOP_SECONDS = 0.1
+# Frames sent to the model per inference call while streaming. Bounds the frame buffer to
+# STREAM_INFERENCE_FRAMES x 48000 float32 samples (~12 MB at 64) regardless of input length.
+STREAM_INFERENCE_FRAMES = 64
+
+def frame_audio(buffer: np.ndarray, frame_len: int, hop_len: int) -> np.ndarray:
+    """Cuts every complete frame of `frame_len` samples, `hop_len` apart, from `buffer` as model input of shape (frames, 1, frame_len)."""
+    view = np.lib.stride_tricks.sliding_window_view(buffer, frame_len)[::hop_len]
+    return np.ascontiguousarray(view)[:, np.newaxis, :]
+
+def embed_buffer_frames(buffer: np.ndarray, frame_len: int, hop_len: int, key: Tuple[str, str, int]) -> np.ndarray:
+    """
+    Embeds every complete frame of `buffer` (mono float32 at TARGET_SR), routed like compute_frame_embeddings.
+
+    The embedding server receives the buffer rather than the frames, which overlap and would be
+    frame_len / hop_len times larger.
+    """
+    client = get_embedding_client()
+    if client is not None:
+        return client.embed_frames(buffer, frame_len, hop_len, key)
+    frames = frame_audio(buffer, frame_len, hop_len)
+    batcher = get_running_batcher(*key)
+    if batcher is not None:
+        return batcher.submit_frames(frames).result()
+    return get_backend(*key).predict(frames, 32)
+
+class StreamingEmbedder:
+    """
+    Computes OpenL3 embeddings over an audio stream fed block by block, with bounded memory.
+
+    Only the samples needed for the next frames, a running sum of frame embeddings and the
+    currently open windows are kept, so memory does not grow with the length of the input.
+    Framing matches openl3.get_audio_embedding with center=True: half a frame of silence is
+    added at the start, frames are taken every `hop_seconds`, and the tail is zero-padded into
+    one last frame if any samples are not yet covered, so the stream yields the same frames as
+    embedding the whole buffer at once.
+
+    If `window_seconds` is set, frame embeddings are also averaged into windows of that length
+    starting every `window_hop_seconds`, for segment-level indexing of long recordings.
+    """
+
+    def __init__(
+        self,
+        input_repr: str = "mel256",
+        content_type: str = "music",
+        embedding_size: int = 512,
+        hop_seconds: float = DEFAULT_HOP_SECONDS,
+        window_seconds: Optional[float] = None,
+        window_hop_seconds: Optional[float] = None,
+    ):
+        self.key = (input_repr, content_type, embedding_size)
+        self.frame_len = int(FRAME_SECONDS * TARGET_SR)
+        self.hop_len = int(hop_seconds * TARGET_SR)
+        self.hop_seconds = hop_seconds
+        self.window_seconds = window_seconds
+        self.window_hop_seconds = window_hop_seconds or window_seconds
+        # Centre padding for the first frame, as openl3 does with center=True.
+        self._buffer = np.zeros(self.frame_len // 2, dtype=np.float32)
+        self._samples_seen = 0
+        self._frame_index = 0
+        self._embedding_sum: Optional[np.ndarray] = None
+        self._open_windows: Dict[int, List[Any]] = {}
+        self._closed_windows: List[Dict[str, Any]] = []
+        self._finished = False
+
+    def _accumulate(self, embeddings: np.ndarray) -> None:
+        if self._embedding_sum is None:
+            self._embedding_sum = np.zeros(embeddings.shape[1], dtype=np.float64)
+        self._embedding_sum += embeddings.sum(axis=0, dtype=np.float64)
+        if self.window_seconds is None:
+            self._frame_index += embeddings.shape[0]
+            return
+        for embedding in embeddings:
+            t = self._frame_index * self.hop_seconds
+            first = max(0, int(np.ceil((t - self.window_seconds) / self.window_hop_seconds + 1e-9)))
+            last = int(np.floor(t / self.window_hop_seconds + 1e-9))
+            for w in range(first, last + 1):
+                window = self._open_windows.setdefault(w, [np.zeros_like(self._embedding_sum), 0])
+                window[0] += embedding
+                window[1] += 1
+            # Windows that end at or before this frame will receive no more frames.
+            for w in [w for w in self._open_windows if w * self.window_hop_seconds + self.window_seconds <= t]:
+                self._close_window(w)
+            self._frame_index += 1
+
+    def _close_window(self, w: int) -> None:
+        total, count = self._open_windows.pop(w)
+        start = w * self.window_hop_seconds
+        self._closed_windows.append({
+            "start_seconds": round(start, 3),
+            "end_seconds": round(min(start + self.window_seconds, self._samples_seen / TARGET_SR), 3),
+            "embedding": (total / count).astype(np.float32),
+        })
+
+    def _drain(self) -> None:
+        while self._buffer.shape[0] >= self.frame_len:
+            available = (self._buffer.shape[0] - self.frame_len) // self.hop_len + 1
+            count = min(available, STREAM_INFERENCE_FRAMES)
+            needed = (count - 1) * self.hop_len + self.frame_len
+            self._accumulate(embed_buffer_frames(self._buffer[:needed], self.frame_len, self.hop_len, self.key))
+            self._buffer = self._buffer[count * self.hop_len:]
+
+    def feed(self, block: np.ndarray) -> None:
+        """Adds the next block of mono float32 audio at TARGET_SR and embeds every complete frame."""
+        if self._finished:
+            raise RuntimeError("StreamingEmbedder.feed called after finish().")
+        block = np.asarray(block, dtype=np.float32).reshape(-1)
+        self._samples_seen += block.shape[0]
+        self._buffer = np.concatenate((self._buffer, block))
+        self._drain()
+
+    def finish(self) -> Optional[Dict[str, Any]]:
+        """
+        Flushes the remaining audio and returns the results.
+
+        Returns:
+            A dict with 'embedding' (mean over all frames), 'frame_count', 'duration_seconds' and
+            'windows' (list of dicts with 'start_seconds', 'end_seconds', 'embedding'; empty unless
+            window_seconds was set), or None if the stream contained no audio.
+        """
+        if not self._finished:
+            self._finished = True
+            remaining = self._buffer.shape[0]
+            # _drain() leaves less than a frame. Its last frame_len - hop_len samples were already
+            # in the previous frame; anything beyond them (or any audio at all, if no frame has
+            # been cut yet) gets a zero-padded final frame, as openl3's _pad_audio does.
+            if self._samples_seen > 0 and (self._frame_index == 0 or remaining > self.frame_len - self.hop_len):
+                self._buffer = np.concatenate((self._buffer, np.zeros(self.frame_len - remaining, dtype=np.float32)))
+                self._drain()
+            for w in sorted(self._open_windows):
+                self._close_window(w)
+
+        if self._embedding_sum is None or self._frame_index == 0:
+            return None
+        return {
+            "embedding": (self._embedding_sum / self._frame_index).astype(np.float32),
+            "frame_count": self._frame_index,
+            "duration_seconds": round(self._samples_seen / TARGET_SR, 3),
+            "windows": list(self._closed_windows),
+        }
+
+def get_openl3_embedding_streaming(
+    blocks: Iterable[np.ndarray],
+    input_repr: str = "mel256",
+    content_type: str = "music",
+    embedding_size: int = 512,
+    window_seconds: Optional[float] = None,
+    window_hop_seconds: Optional[float] = None,
+    source_label: str = "audio stream"
+) -> Optional[Dict[str, Any]]:
+    """
+    Generates OpenL3 embeddings for audio delivered as an iterable of mono float32 blocks at TARGET_SR.
+
+    See StreamingEmbedder for the framing and windowing rules.
+
+    Returns:
+        The dict returned by StreamingEmbedder.finish(), or None if an error occurs.
+    """
+    try:
+        embedder = StreamingEmbedder(
+            input_repr, content_type, embedding_size,
+            window_seconds=window_seconds,
+            window_hop_seconds=window_hop_seconds,
+        )
+        for block in blocks:
+            embedder.feed(block)
+        result = embedder.finish()
+        if result is None:
+            logger.error(f"No audio frames were embedded for {source_label}.")
+            return None
+        logger.debug(f"Generated streaming OpenL3 embedding for {source_label}: {result['frame_count']} frames, {result['duration_seconds']}s, {len(result['windows'])} windows")
+        return result
+    except Exception as e:
+        logger.error(f"Error generating streaming OpenL3 embedding for {source_label}: {e}", exc_info=True)
         return None
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
     # Create a dummy audio file for testing (e.g., a 20-second sine wave)
     # This requires numpy and soundfile to be installed.
     import os
@@ -1,42 +1,247 @@
 import logging
-from typing import Optional, List
+import os
+import time
+from typing import Any, BinaryIO, Dict, Optional, List, Tuple, Union
 import numpy as np
+import soundfile as sf
 
-from .audio_embedding_service import get_openl3_embedding, TARGET_SR # Assuming OpenL3 specific settings might be relevant here
+try:
+    import soxr  # Fast, high-quality resampler; installed with librosa >= 0.10.
+except ImportError:
+    soxr = None
+
+from .audio_embedding_service import get_openl3_embedding_from_array, get_openl3_embedding_streaming, TARGET_SR # Assuming OpenL3 specific settings might be relevant here
+from .audio_decoding import decode_audio_bytes, iter_pcm_blocks
+from .embedding_profiles import DEFAULT_PROFILE, get_profile
+from .metrics import span
+from .temporal_embedding import TemporalEmbedding
 
 logger = logging.getLogger(__name__)
 
-def process_audio_segment(audio_file_path: str) -> Optional[List[float]]:
+# OpenL3 parameters used for every segment. These also form part of the embedding cache key,
+# so changing them automatically invalidates previously cached embeddings.
+EMBEDDING_PARAMS = {
+    "input_repr": "mel256",
+    "content_type": "music",
+    "embedding_size": 512,
+}
+
+# --- Audio front-end ---
+# Every clip is converted once to what the embedder consumes (float32, mono, TARGET_SR) before
+# it reaches OpenL3, so the model never resamples or downmixes on its own.
+# Optional conditioning, off by default. Both change embeddings, so they are part of the cache key.
+NORMALIZE_LOUDNESS = os.environ.get("RESONA_NORMALIZE_LOUDNESS", "0") == "1"
+TRIM_SILENCE = os.environ.get("RESONA_TRIM_SILENCE", "0") == "1"
+# RMS level clips are normalised to, in dBFS. Gain is limited so the peak never exceeds 0 dBFS.
+LOUDNESS_TARGET_DBFS = -20.0
+# Leading/trailing audio quieter than this, relative to the clip's loudest frame, is trimmed.
+SILENCE_THRESHOLD_DB = -60.0
+SILENCE_FRAME_SAMPLES = 2048
+# Trimming never leaves less than one OpenL3 frame.
+MIN_TRIMMED_SECONDS = 1.0
+
+# Frame hop and frame budget ("accurate", "balanced" or "fast"; see embedding_profiles). The
+# lighter profiles cut inference cost several times at some cost in fidelity to "accurate".
+EMBEDDING_PROFILE = get_profile(os.environ.get("RESONA_EMBEDDING_PROFILE", DEFAULT_PROFILE)).name
+
+# Parameters that determine an embedding: EMBEDDING_PARAMS plus any enabled front-end options
+# and a non-default embedding profile. Use these to build embedding cache keys.
+CACHE_KEY_PARAMS = {
+    **EMBEDDING_PARAMS,
+    **({"loudness_dbfs": LOUDNESS_TARGET_DBFS} if NORMALIZE_LOUDNESS else {}),
+    **({"trim_db": SILENCE_THRESHOLD_DB} if TRIM_SILENCE else {}),
+    **({"profile": EMBEDDING_PROFILE} if EMBEDDING_PROFILE != DEFAULT_PROFILE else {}),
+}
+
+def resample_audio(audio: np.ndarray, orig_sr: int, target_sr: int = TARGET_SR) -> np.ndarray:
+    """Resamples mono float32 audio, with soxr when available and librosa otherwise."""
+    if orig_sr == target_sr:
+        return audio
+    if soxr is not None:
+        return soxr.resample(audio, orig_sr, target_sr, quality="HQ")
+    import librosa
+    return librosa.resample(audio, orig_sr=orig_sr, target_sr=target_sr).astype(np.float32, copy=False)
+
+def _trim_silence(audio: np.ndarray, sample_rate: int) -> np.ndarray:
+    frame_count = audio.shape[0] // SILENCE_FRAME_SAMPLES
+    if frame_count < 2:
+        return audio
+    frames = audio[:frame_count * SILENCE_FRAME_SAMPLES].reshape(frame_count, SILENCE_FRAME_SAMPLES)
+    energy = np.mean(frames * frames, axis=1)
+    peak = float(energy.max())
+    if peak <= 0:
+        return audio
+    loud = np.flatnonzero(energy >= peak * 10 ** (SILENCE_THRESHOLD_DB / 10))
+    start = loud[0] * SILENCE_FRAME_SAMPLES
+    end = min(audio.shape[0], (loud[-1] + 1) * SILENCE_FRAME_SAMPLES)
+    min_samples = int(MIN_TRIMMED_SECONDS * sample_rate)
+    if end - start < min_samples:
+        # Keep at least one frame, centred on the non-silent part where possible.
+        start = max(0, min(start, audio.shape[0] - min_samples))
+        end = min(audio.shape[0], start + min_samples)
+    return audio[start:end]
+
+def _normalize_loudness(audio: np.ndarray) -> np.ndarray:
+    rms = float(np.sqrt(np.mean(audio * audio, dtype=np.float64))) if audio.size else 0.0
+    peak = float(np.max(np.abs(audio))) if audio.size else 0.0
+    if rms <= 0 or peak <= 0:
+        return audio
+    gain = min(10 ** (LOUDNESS_TARGET_DBFS / 20) / rms, 1.0 / peak)
+    return audio * np.float32(gain)
+
+def prepare_audio(
+    audio: np.ndarray,
+    sample_rate: int,
+    normalize_loudness: bool = NORMALIZE_LOUDNESS,
+    trim_silence: bool = TRIM_SILENCE,
+    timings: Optional[Dict[str, float]] = None,
+) -> np.ndarray:
     """
-    Processes an audio segment file to extract an embedding.
+    Converts decoded audio to the embedder's input format: float32, mono, TARGET_SR.
 
     Args:
-        audio_file_path: The path to the audio segment file.
+        audio: Samples of shape (samples,) or (samples, channels), any float or int dtype.
+        sample_rate: Sample rate of `audio`.
+        normalize_loudness: Scale the clip to LOUDNESS_TARGET_DBFS RMS (peak-limited).
+        trim_silence: Drop leading and trailing audio below SILENCE_THRESHOLD_DB.
+        timings: If given, 'resample_ms' and 'frontend_ms' are recorded in it.
 
     Returns:
-        A list of floats representing the audio embedding, or None if processing fails.
+        A contiguous float32 array of shape (samples,) at TARGET_SR.
     """
-    logger.info(f"Processing audio segment: {audio_file_path}")
+    start = time.perf_counter()
+    audio = np.asarray(audio)
+    if audio.dtype != np.float32:
+        audio = audio.astype(np.float32)
+    if audio.ndim > 1:
+        # Average channels in float32 rather than letting downstream code promote to float64.
+        audio = audio.mean(axis=1, dtype=np.float32)
+
+    resample_start = time.perf_counter()
+    audio = resample_audio(audio, sample_rate, TARGET_SR)
+    resample_ms = (time.perf_counter() - resample_start) * 1000
+
+    if trim_silence:
+        audio = _trim_silence(audio, TARGET_SR)
+    if normalize_loudness:
+        audio = _normalize_loudness(audio)
+    audio = np.ascontiguousarray(audio, dtype=np.float32)
+
+    if timings is not None:
+        timings["resample_ms"] = round(resample_ms, 2)
+        timings["frontend_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return audio
+
+def process_audio_segment(
+    audio_source: Union[str, bytes, np.ndarray],
+    sample_rate: Optional[int] = None,
+    timings: Optional[Dict[str, float]] = None,
+    temporal: bool = False,
+    profile: Optional[str] = None,
+) -> Optional[Union[np.ndarray, TemporalEmbedding]]:
+    """
+    Processes an audio segment to extract an embedding.
+
+    Args:
+        audio_source: One of
+            - a path to an audio segment file,
+            - the encoded bytes of an audio file held in memory (e.g. an upload),
+            - decoded samples as a NumPy array, in which case `sample_rate` is required.
+        sample_rate: Sample rate of `audio_source` when it is a NumPy array.
+        timings: If given, the front-end's 'resample_ms' and 'frontend_ms' are recorded in it.
+        temporal: Return a TemporalEmbedding (frame embeddings pooled at several time scales,
+            plus the frame sketch used for re-ranking) instead of only the mean vector.
+        profile: Embedding profile setting the frame hop and frame budget; None for
+            EMBEDDING_PROFILE. Callers caching the result under CACHE_KEY_PARAMS should leave it unset.
+
+    Returns:
+        A float32 NumPy vector representing the audio embedding, or None if processing fails.
+        Conversion to a serialisable form is left to the API layer (see embedding_codec).
+    """
+    if isinstance(audio_source, str):
+        source_label = audio_source
+    elif isinstance(audio_source, (bytes, bytearray)):
+        source_label = f"{len(audio_source)}-byte buffer"
+    else:
+        source_label = f"array of shape {audio_source.shape} at {sample_rate} Hz"
+    logger.debug(f"Processing audio segment: {source_label}")
     try:
-        # Using default parameters for OpenL3 for now, consistent with audio_embedding_service
-        embedding_np_array = get_openl3_embedding(
-            audio_file_path=audio_file_path,
-            input_repr="mel256", # Default from audio_embedding_service
-            content_type="music", # Default from audio_embedding_service
-            embedding_size=512    # Default from audio_embedding_service
+        if isinstance(audio_source, str):
+            with span("decode"):
+                audio, sample_rate = sf.read(audio_source, dtype="float32", always_2d=False)
+        elif isinstance(audio_source, (bytes, bytearray)):
+            with span("decode"):
+                audio, sample_rate = decode_audio_bytes(bytes(audio_source))
+        elif sample_rate is None:
+            raise ValueError("sample_rate is required when passing decoded audio samples.")
+        else:
+            audio = audio_source
+
+        with span("frontend"):
+            audio = prepare_audio(audio, sample_rate, timings=timings)
+        embedding_np_array = get_openl3_embedding_from_array(
+            audio, TARGET_SR,
+            source_label=source_label,
+            temporal=temporal,
+            profile=profile or EMBEDDING_PROFILE,
+            **EMBEDDING_PARAMS
         )
 
+        if isinstance(embedding_np_array, TemporalEmbedding):
+            logger.debug(f"Successfully generated temporal embedding for {source_label}: {embedding_np_array.frame_count} frames")
+            return embedding_np_array
         if embedding_np_array is not None:
-            # Convert NumPy array to a list of floats for easier serialization/storage
-            embedding_list = embedding_np_array.tolist()
-            logger.info(f"Successfully generated embedding for {audio_file_path}. Embedding dimension: {len(embedding_list)}")
-            return embedding_list
+            embedding = np.asarray(embedding_np_array, dtype=np.float32)
+            logger.debug(f"Successfully generated embedding for {source_label}. Embedding dimension: {embedding.shape[0]}")
+            return embedding
         else:
-            logger.warning(f"Failed to generate embedding for {audio_file_path}. get_openl3_embedding returned None.")
+            logger.warning(f"Failed to generate embedding for {source_label}. OpenL3 embedding returned None.")
             return None
 
     except Exception as e:
-        logger.error(f"Error processing audio segment {audio_file_path}: {e}", exc_info=True)
+        logger.error(f"Error processing audio segment {source_label}: {e}", exc_info=True)
+        return None
+
+def process_audio_stream(
+    source_file: BinaryIO,
+    return_windows: bool = False,
+    window_seconds: float = 20.0,
+    window_hop_seconds: float = 10.0,
+    block_seconds: float = 10.0,
+) -> Optional[Dict[str, Any]]:
+    """
+    Embeds an audio file of any length block by block, with memory independent of its duration.
+
+    Blocks are already float32 mono at TARGET_SR. The optional loudness normalisation and silence
+    trimming of prepare_audio() need the whole clip, so they are not applied here.
+
+    Args:
+        source_file: Seekable binary file object holding an encoded audio file.
+        return_windows: Also return embeddings for windows of `window_seconds`, every `window_hop_seconds`.
+        window_seconds: Window length for per-window embeddings.
+        window_hop_seconds: Distance between window starts.
+        block_seconds: Audio decoded and resampled per step.
+
+    Returns:
+        A dict with 'embedding' (float32 vector, the mean over the whole file), 'duration_seconds',
+        'frame_count' and 'windows' (list of dicts with 'start_seconds', 'end_seconds' and
+        'embedding' as a float32 vector), or None if processing fails.
+    """
+    logger.debug(f"Streaming audio for embedding (windows={return_windows})")
+    try:
+        result = get_openl3_embedding_streaming(
+            iter_pcm_blocks(source_file, block_seconds=block_seconds, sample_rate=TARGET_SR),
+            window_seconds=window_seconds if return_windows else None,
+            window_hop_seconds=window_hop_seconds if return_windows else None,
+            source_label="streamed upload",
+            **EMBEDDING_PARAMS
+        )
+        if result is None:
+            logger.warning("Failed to generate streaming embedding. OpenL3 embedding returned None.")
+            return None
+        return result
+    except Exception as e:
+        logger.error(f"Error processing audio stream: {e}", exc_info=True)
         return None
 
 if __name__ == '__main__':
@@ -67,7 +272,7 @@ if __name__ == '__main__':
         print(f"Attempting to process audio segment: {dummy_file_path_processor}...")
         embedding = process_audio_segment(dummy_file_path_processor)
 
-        if embedding:
+        if embedding is not None:
             print(f"Successfully processed segment. Embedding (first 10 values): {embedding[:10]}")
             print(f"Full embedding dimension: {len(embedding)}")
         else:
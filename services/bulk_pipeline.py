@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Sequence, Set
+
+from .metrics import registry
+from .scheduler import SchedulerBusyError
+
+logger = logging.getLogger(__name__)
+
+# A bulk item rejected by a full stage pool is retried after the pool's Retry-After this many
+# times before it is reported as failed; bulk clients would otherwise have to resubmit it.
+DEFAULT_BUSY_RETRIES = 5
+
+BULK_ITEMS = registry.counter("resona_bulk_items_total", "Items finished by bulk analysis requests, by outcome.", ("status",))
+
+ItemProcessor = Callable[[Any], Awaitable[Dict[str, Any]]]
+
+
+class BulkRun:
+    """
+    Runs many analysis items through the staged pipeline, `concurrency` at a time.
+
+    Each item is one call of `process` (e.g. analyze_youtube_segment), whose stages run on the
+    scheduler's separate download, embed and search pools. Keeping several items in flight
+    lets those pools overlap: item N+1 downloads and decodes while item N is being embedded.
+    Items start in input order; records are yielded as each one finishes, and a summary with
+    overall throughput and summed stage timings comes last.
+
+    An item rejected by a full pool is passed to `process` again, so `process` must not consume
+    it; `finish`, if given, is called once per item after its last attempt (e.g. to close an upload).
+    """
+
+    def __init__(
+        self,
+        items: Sequence[Any],
+        process: ItemProcessor,
+        concurrency: int,
+        busy_retries: int = DEFAULT_BUSY_RETRIES,
+        finish: Optional[Callable[[Any], None]] = None,
+    ):
+        self.items = list(items)
+        self.process = process
+        self.concurrency = max(1, concurrency)
+        self.busy_retries = busy_retries
+        self.finish = finish
+        self._succeeded = 0
+        self._failed = 0
+        self._busy_retries_used = 0
+        self._bytes_fetched = 0
+        self._stage_ms: Dict[str, float] = {}
+
+    async def _run_item(self, index: int, item: Any) -> Dict[str, Any]:
+        try:
+            return await self._attempt(index, item)
+        finally:
+            if self.finish is not None:
+                self.finish(item)
+
+    async def _attempt(self, index: int, item: Any) -> Dict[str, Any]:
+        retries = 0
+        while True:
+            try:
+                result = await self.process(item)
+                break
+            except SchedulerBusyError as e:
+                if retries >= self.busy_retries:
+                    return {"index": index, "status": "error", "status_code": e.status_code, "error": str(e)}
+                retries += 1
+                self._busy_retries_used += 1
+                await asyncio.sleep(e.retry_after_seconds)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # HTTPException carries status_code and detail; anything else is an internal error.
+                return {"index": index, "status": "error", "status_code": getattr(e, "status_code", 500), "error": str(getattr(e, "detail", e))}
+        return {"index": index, "status": "ok", "result": result}
+
+    def _record(self, record: Dict[str, Any]) -> None:
+        BULK_ITEMS.inc(status=record["status"])
+        if record["status"] != "ok":
+            self._failed += 1
+            return
+        self._succeeded += 1
+        result = record["result"]
+        self._bytes_fetched += result.get("bytes_fetched") or 0
+        for name, value in (result.get("stage_timings_ms") or {}).items():
+            if name.endswith("_ms"):
+                self._stage_ms[name] = self._stage_ms.get(name, 0.0) + value
+
+    async def __aiter__(self) -> AsyncIterator[Dict[str, Any]]:
+        start = time.perf_counter()
+        pending: Set[asyncio.Task] = set()
+        next_index = 0
+        try:
+            while next_index < len(self.items) or pending:
+                while next_index < len(self.items) and len(pending) < self.concurrency:
+                    pending.add(asyncio.ensure_future(self._run_item(next_index, self.items[next_index])))
+                    next_index += 1
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    record = task.result()
+                    self._record(record)
+                    yield record
+        finally:
+            # The client went away mid-stream: stop the items still running.
+            for task in pending:
+                task.cancel()
+        yield {"summary": self.summary(time.perf_counter() - start)}
+
+    def summary(self, elapsed_seconds: float) -> Dict[str, Any]:
+        finished = self._succeeded + self._failed
+        return {
+            "items": len(self.items),
+            "succeeded": self._succeeded,
+            "failed": self._failed,
+            "busy_retries": self._busy_retries_used,
+            "concurrency": self.concurrency,
+            "elapsed_seconds": round(elapsed_seconds, 3),
+            "items_per_second": round(finished / elapsed_seconds, 3) if elapsed_seconds > 0 else 0.0,
+            "bytes_fetched": self._bytes_fetched,
+            # Summed over items; compare with elapsed_seconds to see how much the stages overlapped.
+            "stage_ms_totals": {name: round(value, 2) for name, value in sorted(self._stage_ms.items())},
+        }
@@ -0,0 +1,189 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .model_registry import ModelKey, get_backend
+from .metrics import span
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the batching window. A batch is flushed as soon as it holds MAX_BATCH_FRAMES
+# frames or the oldest pending request has waited MAX_WAIT_MS, whichever comes first.
+MAX_BATCH_FRAMES = 512
+MAX_WAIT_MS = 15.0
+# Batch size handed to the inference backend; the combined frame batch is split into chunks of this size.
+PREDICT_BATCH_SIZE = 64
+
+
+class _PendingRequest:
+    __slots__ = ("frames", "future", "enqueued_at")
+
+    def __init__(self, frames: np.ndarray):
+        self.frames = frames
+        self.future: Future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class EmbeddingBatcher:
+    """
+    Gathers OpenL3 input frames from concurrent callers into a single predict call.
+
+    Callers preprocess their own audio (resampling and framing) in their own thread, then hand
+    the frames to a single inference thread that owns the model. That thread concatenates the
+    frames of every request waiting at that moment, runs one predict, and slices the result back
+    out to each caller, so CPU throughput rises with concurrency instead of each request
+    paying for its own small, poorly-utilised predict call.
+    """
+
+    def __init__(
+        self,
+        input_repr: str = "mel256",
+        content_type: str = "music",
+        embedding_size: int = 512,
+        max_batch_frames: int = MAX_BATCH_FRAMES,
+        max_wait_ms: float = MAX_WAIT_MS,
+        predict_batch_size: int = PREDICT_BATCH_SIZE,
+    ):
+        self.key: ModelKey = (input_repr, content_type, int(embedding_size))
+        self.max_batch_frames = max_batch_frames
+        self.max_wait_seconds = max_wait_ms / 1000.0
+        self.predict_batch_size = predict_batch_size
+        self._queue: "queue.Queue[Optional[_PendingRequest]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._frames = 0
+        self._predict_seconds = 0.0
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        # Resolve the model up front so the inference thread never pays the load cost.
+        get_backend(*self.key)
+        self._thread = threading.Thread(target=self._run, name=f"resona-batcher-{self.key[0]}-{self.key[2]}", daemon=True)
+        self._thread.start()
+        logger.info(f"Embedding batcher started for {self.key} (max_batch_frames={self.max_batch_frames}, max_wait_ms={self.max_wait_seconds * 1000:.1f})")
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def submit_frames(self, frames: np.ndarray) -> Future:
+        """Queues already-preprocessed OpenL3 input frames and returns a Future of their embeddings."""
+        request = _PendingRequest(frames)
+        self._queue.put(request)
+        return request.future
+
+    def _collect_batch(self, first: _PendingRequest) -> Tuple[List[_PendingRequest], bool]:
+        batch = [first]
+        frame_count = first.frames.shape[0]
+        deadline = first.enqueued_at + self.max_wait_seconds
+        while frame_count < self.max_batch_frames:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                return batch, True
+            batch.append(request)
+            frame_count += request.frames.shape[0]
+        return batch, False
+
+    def _run(self) -> None:
+        backend = get_backend(*self.key)
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch, stopping = self._collect_batch(first)
+            try:
+                stacked = np.vstack([request.frames for request in batch])
+                predict_start = time.perf_counter()
+                with span("batch_predict"):
+                    embeddings = backend.predict(stacked, self.predict_batch_size)
+                predict_seconds = time.perf_counter() - predict_start
+            except Exception as e:
+                logger.error(f"Batched OpenL3 inference failed for {len(batch)} requests: {e}", exc_info=True)
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            offset = 0
+            for request in batch:
+                count = request.frames.shape[0]
+                request.future.set_result(embeddings[offset:offset + count])
+                offset += count
+
+            with self._stats_lock:
+                self._batches += 1
+                self._requests += len(batch)
+                self._frames += stacked.shape[0]
+                self._predict_seconds += predict_seconds
+
+        # Fail anything still queued so callers are not left waiting on shutdown.
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None:
+                request.future.set_exception(RuntimeError("Embedding batcher stopped."))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            batches = self._batches
+            return {
+                "batches": batches,
+                "requests": self._requests,
+                "frames": self._frames,
+                "mean_requests_per_batch": round(self._requests / batches, 2) if batches else 0.0,
+                "mean_frames_per_batch": round(self._frames / batches, 1) if batches else 0.0,
+                "frames_per_second": round(self._frames / self._predict_seconds, 1) if self._predict_seconds else 0.0,
+                "queue_depth": self._queue.qsize(),
+            }
+
+
+_batchers: Dict[ModelKey, EmbeddingBatcher] = {}
+
+
+def start_batcher(input_repr: str, content_type: str, embedding_size: int, **kwargs: Any) -> EmbeddingBatcher:
+    """Creates and starts the batcher for a model configuration, or returns the one already running."""
+    key = (input_repr, content_type, int(embedding_size))
+    batcher = _batchers.get(key)
+    if batcher is None:
+        batcher = EmbeddingBatcher(input_repr, content_type, embedding_size, **kwargs)
+        _batchers[key] = batcher
+    batcher.start()
+    return batcher
+
+
+def get_running_batcher(input_repr: str, content_type: str, embedding_size: int) -> Optional[EmbeddingBatcher]:
+    """Returns the running batcher for a model configuration, or None if batching is not enabled for it."""
+    batcher = _batchers.get((input_repr, content_type, int(embedding_size)))
+    return batcher if batcher is not None and batcher.running else None
+
+
+def stop_all_batchers() -> None:
+    for batcher in _batchers.values():
+        batcher.stop()
+
+
+def get_batcher_stats() -> Dict[str, Dict[str, Any]]:
+    return {f"{k[0]}/{k[1]}/{k[2]}": b.stats() for k, b in _batchers.items()}
@@ -0,0 +1,149 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DB_PATH = os.path.join("cache", "embeddings.sqlite3")
+
+CacheEntry = Tuple[np.ndarray, Dict[str, Any]]
+
+
+def _config_fragment(embedding_params: Mapping[str, Any]) -> str:
+    # Sorted so that the same parameters always produce the same key regardless of dict order.
+    return ",".join(f"{k}={embedding_params[k]}" for k in sorted(embedding_params))
+
+
+def youtube_cache_key(video_id: str, start_seconds: int, end_seconds: int, embedding_params: Mapping[str, Any]) -> str:
+    """Builds the cache key for a YouTube segment, as returned by parse_youtube_url, under the given embedding parameters."""
+    return f"yt:{video_id}:{start_seconds}:{end_seconds}:{_config_fragment(embedding_params)}"
+
+
+def upload_cache_key(content_sha256: str, embedding_params: Mapping[str, Any]) -> str:
+    """Builds the cache key for uploaded audio from the SHA-256 of its bytes, under the given embedding parameters."""
+    return f"upload:{content_sha256}:{_config_fragment(embedding_params)}"
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache of segment embeddings and their metadata.
+
+    The first tier is an in-process LRU of up to `memory_max_entries` entries. The second is a
+    SQLite file holding up to `disk_max_entries` entries, evicted least-recently-used first, which
+    survives restarts and is shared by all workers on the host. Disk hits are promoted into memory.
+
+    Vectors are stored on disk as `storage_dtype` ("float32" or "float16", which halves the file)
+    and always returned as float32.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, memory_max_entries: int = 1024, disk_max_entries: int = 100_000, storage_dtype: str = "float32"):
+        if storage_dtype not in ("float32", "float16"):
+            raise ValueError(f"Unsupported embedding cache storage dtype: {storage_dtype}")
+        self.db_path = db_path
+        self.storage_dtype = np.dtype(storage_dtype)
+        self.memory_max_entries = memory_max_entries
+        self.disk_max_entries = disk_max_entries
+        self._memory: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "puts": 0, "memory_evictions": 0, "disk_evictions": 0}
+
+        self._db: Optional[sqlite3.Connection] = None
+        self._disk_count = 0
+        if disk_max_entries > 0:
+            db_dir = os.path.dirname(db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY, embedding BLOB NOT NULL, dtype TEXT NOT NULL,"
+                " metadata TEXT NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings (last_access)")
+            self._disk_count = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            logger.info(f"Embedding cache opened at {db_path} with {self._disk_count} entries")
+
+    def _remember(self, key: str, entry: CacheEntry) -> None:
+        # Caller holds self._lock.
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_max_entries:
+            self._memory.popitem(last=False)
+            self._counters["memory_evictions"] += 1
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Returns (embedding, metadata) for `key`, or None on a miss in both tiers."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return entry
+
+            if self._db is not None:
+                row = self._db.execute("SELECT embedding, dtype, metadata FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE embeddings SET last_access = ? WHERE key = ?", (time.time(), key))
+                    embedding = np.frombuffer(row[0], dtype=np.dtype(row[1])).astype(np.float32)
+                    entry = (embedding, json.loads(row[2]))
+                    if self.memory_max_entries > 0:
+                        self._remember(key, entry)
+                    self._counters["disk_hits"] += 1
+                    return entry
+
+            self._counters["misses"] += 1
+            return None
+
+    def put(self, key: str, embedding: np.ndarray, metadata: Optional[Dict[str, Any]] = None) -> None:
+        """Stores `embedding` and JSON-serialisable `metadata` under `key` in both tiers."""
+        embedding = np.ascontiguousarray(embedding, dtype=np.float32)
+        entry = (embedding, dict(metadata or {}))
+        with self._lock:
+            self._counters["puts"] += 1
+            if self.memory_max_entries > 0:
+                self._remember(key, entry)
+            if self._db is None:
+                return
+            now = time.time()
+            is_new = self._db.execute("SELECT 1 FROM embeddings WHERE key = ?", (key,)).fetchone() is None
+            self._db.execute(
+                "INSERT OR REPLACE INTO embeddings (key, embedding, dtype, metadata, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, embedding.astype(self.storage_dtype).tobytes(), self.storage_dtype.str, json.dumps(entry[1]), now, now),
+            )
+            if is_new:
+                self._disk_count += 1
+            overflow = self._disk_count - self.disk_max_entries
+            if overflow > 0:
+                self._db.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,),
+                )
+                self._disk_count -= overflow
+                self._counters["disk_evictions"] += overflow
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._counters["memory_hits"] + self._counters["disk_hits"] + self._counters["misses"]
+            hits = self._counters["memory_hits"] + self._counters["disk_hits"]
+            return {
+                **self._counters,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_max_entries": self.memory_max_entries,
+                "disk_entries": self._disk_count,
+                "disk_max_entries": self.disk_max_entries,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,66 @@
+import base64
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+# How an embedding is represented in an API response:
+#   "json"   - a JSON array of floats (the original format; ~10 KB of text for 512 dimensions).
+#   "base64" - the little-endian bytes of the vector in EMBEDDING_DTYPES, base64-encoded.
+#   "none"   - left out of the response.
+EMBEDDING_FORMATS = ("json", "base64", "none")
+# Element types for the "base64" format. int8 is symmetric linear quantisation with one float scale.
+EMBEDDING_DTYPES = ("float32", "float16", "int8")
+
+
+def quantize_int8(embedding: np.ndarray) -> Tuple[np.ndarray, float]:
+    """Quantises a vector to int8 with a single scale, so that `values * scale` approximates it."""
+    peak = float(np.max(np.abs(embedding))) if embedding.size else 0.0
+    scale = peak / 127.0 if peak > 0 else 1.0
+    return np.clip(np.rint(embedding / scale), -127, 127).astype(np.int8), scale
+
+
+def encode_embedding(embedding: np.ndarray, dtype: str = "float16") -> Dict[str, Any]:
+    """
+    Packs an embedding as base64 bytes of the given element type.
+
+    Returns:
+        A dict with 'dtype', 'shape', 'data' (base64 of the little-endian bytes) and, for int8,
+        'scale'. decode_embedding() reverses it.
+    """
+    if dtype not in EMBEDDING_DTYPES:
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+    embedding = np.asarray(embedding, dtype=np.float32)
+    scale: Optional[float] = None
+    if dtype == "int8":
+        packed, scale = quantize_int8(embedding)
+    else:
+        packed = embedding.astype(np.dtype(dtype).newbyteorder("<"))
+    encoded: Dict[str, Any] = {
+        "dtype": dtype,
+        "shape": list(embedding.shape),
+        "data": base64.b64encode(packed.tobytes()).decode("ascii"),
+    }
+    if scale is not None:
+        encoded["scale"] = scale
+    return encoded
+
+
+def decode_embedding(encoded: Dict[str, Any]) -> np.ndarray:
+    """Unpacks a dict produced by encode_embedding() back to a float32 array."""
+    dtype = np.dtype(encoded["dtype"]).newbyteorder("<")
+    values = np.frombuffer(base64.b64decode(encoded["data"]), dtype=dtype).reshape(encoded["shape"])
+    values = values.astype(np.float32)
+    if encoded.get("scale") is not None:
+        values *= np.float32(encoded["scale"])
+    return values
+
+
+def format_embedding(embedding: Optional[np.ndarray], embedding_format: str = "json", dtype: str = "float16") -> Union[List[float], Dict[str, Any], None]:
+    """Converts an in-memory embedding to its API representation for `embedding_format` (see EMBEDDING_FORMATS)."""
+    if embedding is None or embedding_format == "none":
+        return None
+    if embedding_format == "json":
+        return np.asarray(embedding, dtype=np.float32).tolist()
+    if embedding_format == "base64":
+        return encode_embedding(embedding, dtype)
+    raise ValueError(f"Unsupported embedding format: {embedding_format}")
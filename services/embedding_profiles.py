@@ -0,0 +1,69 @@
+from typing import Dict, Optional
+
+import numpy as np
+
+# How frames are chosen when a clip has more than a profile's frame budget:
+#   "even"   - the middle frame of each of max_frames equal runs of frames.
+#   "energy" - the loudest frame of each run, so near-silent frames are skipped while the
+#              selection still covers the whole clip.
+SELECTIONS = ("even", "energy")
+
+
+class EmbeddingProfile:
+    """
+    How densely a clip is sampled into OpenL3 frames before inference.
+
+    OpenL3 frames are one second long, so at the default 0.1 s hop consecutive frames overlap by
+    90% and a 20-second clip costs about 200 inferences for one mean vector. A profile trades
+    some of that redundancy for latency: frames are cut every `hop_seconds`, and if more than
+    `max_frames` result, only `max_frames` of them (chosen by `selection`) are embedded.
+    """
+
+    __slots__ = ("name", "hop_seconds", "max_frames", "selection")
+
+    def __init__(self, name: str, hop_seconds: float, max_frames: Optional[int] = None, selection: str = "even"):
+        if selection not in SELECTIONS:
+            raise ValueError(f"Unknown frame selection {selection!r}; expected one of {', '.join(SELECTIONS)}")
+        self.name = name
+        self.hop_seconds = hop_seconds
+        self.max_frames = max_frames
+        self.selection = selection
+
+    def select(self, frames: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Picks the frames to embed from OpenL3 input frames of shape (frames, 1, samples).
+
+        Returns:
+            Sorted indices into `frames`, or None when every frame is to be embedded.
+        """
+        count = frames.shape[0]
+        if self.max_frames is None or count <= self.max_frames:
+            return None
+        edges = np.linspace(0, count, self.max_frames + 1).round().astype(np.int64)
+        if self.selection == "even":
+            return (edges[:-1] + edges[1:] - 1) // 2
+        flat = frames.reshape(count, -1)
+        energy = np.einsum("ij,ij->i", flat, flat)
+        return np.array([start + int(np.argmax(energy[start:end])) for start, end in zip(edges[:-1], edges[1:])], dtype=np.int64)
+
+    def describe(self) -> Dict[str, object]:
+        return {"hop_seconds": self.hop_seconds, "max_frames": self.max_frames, "selection": self.selection}
+
+
+# "accurate" is OpenL3's own dense framing and the baseline the others are measured against
+# (see the "profiles" benchmark). For a 20-second clip, "balanced" embeds 48 frames and "fast"
+# 16, about 4x and 12x fewer.
+PROFILES: Dict[str, EmbeddingProfile] = {
+    "accurate": EmbeddingProfile("accurate", hop_seconds=0.1),
+    "balanced": EmbeddingProfile("balanced", hop_seconds=0.25, max_frames=48, selection="energy"),
+    "fast": EmbeddingProfile("fast", hop_seconds=0.5, max_frames=16, selection="energy"),
+}
+DEFAULT_PROFILE = "accurate"
+
+
+def get_profile(name: Optional[str] = None) -> EmbeddingProfile:
+    """Returns the named profile, or the default one for None."""
+    profile = PROFILES.get(name or DEFAULT_PROFILE)
+    if profile is None:
+        raise ValueError(f"Unknown embedding profile {name!r}; expected one of {', '.join(PROFILES)}")
+    return profile
@@ -0,0 +1,454 @@
+import argparse
+import glob
+import logging
+import multiprocessing
+import os
+import secrets
+import tempfile
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .model_registry import DEFAULT_MODEL_CONFIGS, ModelKey
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET_DIR = os.path.join(tempfile.gettempdir(), "resona-embed-server")
+AUTHKEY_FILE = "authkey"
+SOCKET_PATTERN = "worker-*.sock"
+# How often the client pings every worker, and how long a ping may take before the worker is marked unhealthy.
+HEALTH_CHECK_INTERVAL_SECONDS = 5.0
+HEALTH_CHECK_TIMEOUT_SECONDS = 2.0
+# Upper bound on one embedding request, including time spent queued behind other requests in the worker.
+REQUEST_TIMEOUT_SECONDS = 300.0
+# Delay before restarting a crashed worker; doubles on consecutive crashes up to the maximum.
+RESTART_BACKOFF_SECONDS = 1.0
+MAX_RESTART_BACKOFF_SECONDS = 30.0
+
+
+class EmbeddingServerUnavailable(RuntimeError):
+    """Raised when no embedding server worker is reachable."""
+
+
+class EmbeddingServerError(RuntimeError):
+    """Raised when an embedding server worker received a request but failed to compute it."""
+
+
+def _read_authkey(socket_dir: str) -> bytes:
+    with open(os.path.join(socket_dir, AUTHKEY_FILE), "rb") as f:
+        return f.read()
+
+
+# --- Worker process ---
+
+_attach_lock = threading.Lock()
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        pass
+    # Older Pythons register attached blocks with the resource tracker as if this process owned
+    # them. The client creates and unlinks the block, so registering here would either unlink it
+    # again when the worker exits or, with a tracker shared with the client, break its unlink.
+    with _attach_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+def _compute(message: Dict[str, Any], shm: shared_memory.SharedMemory) -> Dict[str, Any]:
+    from .audio_embedding_service import compute_frame_embeddings, embed_buffer_frames
+
+    # A view onto the client's buffer: the PCM is read in place, never copied through the socket.
+    audio = np.ndarray(tuple(message["shape"]), dtype=np.float32, buffer=shm.buf)
+    key = tuple(message["model"])
+    if message["op"] == "embed_audio":
+        embeddings, timestamps = compute_frame_embeddings(audio, message["sr"], *key, profile=message.get("profile"))
+        return {"ok": True, "embeddings": np.asarray(embeddings, dtype=np.float32), "timestamps": np.asarray(timestamps)}
+    embeddings = embed_buffer_frames(audio, message["frame_len"], message["hop_len"], key)
+    return {"ok": True, "embeddings": np.asarray(embeddings, dtype=np.float32)}
+
+
+def _handle_connection(conn: Connection, counters: Dict[str, int]) -> None:
+    from .model_registry import get_model_stats
+    with conn:
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                return
+            if message.get("op") == "ping":
+                conn.send({"ok": True, "pid": os.getpid(), "models": get_model_stats(), **counters})
+                continue
+            counters["requests"] += 1
+            try:
+                shm = _attach(message["shm"])
+                try:
+                    reply = _compute(message, shm)
+                finally:
+                    shm.close()
+            except Exception as e:
+                counters["failures"] += 1
+                logger.error(f"Embedding server request failed: {e}", exc_info=True)
+                reply = {"ok": False, "error": str(e)}
+            conn.send(reply)
+
+
+def _serve(socket_path: str, model_configs: List[ModelKey], intra_op_threads: int, batcher_kwargs: Dict[str, Any]) -> None:
+    """Entry point of one inference process: loads the models, then answers requests on `socket_path`."""
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s %(levelname)s embed-worker[{os.getpid()}] %(name)s: %(message)s")
+    if intra_op_threads:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    from .model_registry import preload_models
+    from .embedding_batcher import start_batcher
+    preload_models(model_configs)
+    # Requests from every connection share one batcher per model, so concurrent API requests
+    # still end up in the same predict call.
+    for input_repr, content_type, embedding_size in model_configs:
+        start_batcher(input_repr, content_type, embedding_size, **batcher_kwargs)
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    counters = {"requests": 0, "failures": 0}
+    # The socket only appears once the models are warm, so clients never route to a loading worker.
+    with Listener(socket_path, family="AF_UNIX", authkey=_read_authkey(os.path.dirname(socket_path))) as listener:
+        logger.info(f"Embedding server worker listening on {socket_path}")
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError) as e:
+                logger.warning(f"Rejected embedding server connection: {e}")
+                continue
+            threading.Thread(target=_handle_connection, args=(conn, counters), daemon=True).start()
+
+
+# --- Supervisor ---
+
+class EmbeddingServerPool:
+    """
+    Runs a fixed number of OpenL3 inference processes and restarts any that exit.
+
+    Each worker loads the models once and listens on its own Unix socket in `socket_dir`. Any
+    number of API processes can share them through EmbeddingServerClient, so model memory is
+    `workers` copies no matter how many web workers are running. The directory is created
+    private to the current user and holds the auth key clients need to connect.
+    """
+
+    def __init__(
+        self,
+        socket_dir: str = DEFAULT_SOCKET_DIR,
+        workers: int = 2,
+        model_configs: Iterable[ModelKey] = DEFAULT_MODEL_CONFIGS,
+        intra_op_threads: int = 0,
+        batcher_kwargs: Optional[Dict[str, Any]] = None,
+    ):
+        self.socket_dir = socket_dir
+        self.workers = workers
+        self.model_configs = [tuple(c) for c in model_configs]
+        self.intra_op_threads = intra_op_threads
+        self.batcher_kwargs = batcher_kwargs or {}
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * workers
+        self._crashes = [0] * workers
+        self._started_at = [0.0] * workers
+        self._restarts = 0
+        self._stopping = threading.Event()
+        self._monitor_thread: Optional[threading.Thread] = None
+
+    def socket_path(self, index: int) -> str:
+        return os.path.join(self.socket_dir, f"worker-{index}.sock")
+
+    def start(self) -> None:
+        os.makedirs(self.socket_dir, mode=0o700, exist_ok=True)
+        os.chmod(self.socket_dir, 0o700)
+        for stale in glob.glob(os.path.join(self.socket_dir, SOCKET_PATTERN)):
+            os.unlink(stale)
+        authkey_path = os.path.join(self.socket_dir, AUTHKEY_FILE)
+        with open(os.open(authkey_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+            f.write(secrets.token_bytes(32))
+        for index in range(self.workers):
+            self._spawn(index)
+        self._monitor_thread = threading.Thread(target=self._monitor, name="resona-embed-server-monitor", daemon=True)
+        self._monitor_thread.start()
+        logger.info(f"Started {self.workers} embedding server workers in {self.socket_dir}")
+
+    def _spawn(self, index: int) -> None:
+        process = self._context.Process(
+            target=_serve,
+            args=(self.socket_path(index), self.model_configs, self.intra_op_threads, self.batcher_kwargs),
+            name=f"resona-embed-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+
+    def _monitor(self) -> None:
+        while not self._stopping.wait(1.0):
+            for index, process in enumerate(self._processes):
+                if process is None or process.is_alive() or self._stopping.is_set():
+                    continue
+                # A worker that ran for a while before exiting starts the backoff over.
+                if time.monotonic() - self._started_at[index] > 2 * MAX_RESTART_BACKOFF_SECONDS:
+                    self._crashes[index] = 0
+                self._crashes[index] += 1
+                backoff = min(RESTART_BACKOFF_SECONDS * 2 ** (self._crashes[index] - 1), MAX_RESTART_BACKOFF_SECONDS)
+                logger.warning(f"Embedding server worker {index} (pid {process.pid}) exited with code {process.exitcode}; restarting in {backoff:.0f}s")
+                if os.path.exists(self.socket_path(index)):
+                    os.unlink(self.socket_path(index))
+                if self._stopping.wait(backoff):
+                    return
+                self._spawn(index)
+                self._restarts += 1
+
+    def stop(self) -> None:
+        self._stopping.set()
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self._processes:
+            if process is not None:
+                process.join(timeout=5)
+        for index in range(self.workers):
+            if os.path.exists(self.socket_path(index)):
+                os.unlink(self.socket_path(index))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "alive": sum(1 for p in self._processes if p is not None and p.is_alive()),
+            "restarts": self._restarts,
+            "pids": [p.pid if p is not None else None for p in self._processes],
+        }
+
+
+# --- Client ---
+
+class _WorkerHandle:
+    __slots__ = ("path", "healthy", "in_flight", "idle", "requests", "failures", "last_error", "info")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.healthy = False
+        self.in_flight = 0
+        self.idle: List[Connection] = []
+        self.requests = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.info: Dict[str, Any] = {}
+
+
+class EmbeddingServerClient:
+    """
+    Sends embedding requests from an API process to the workers of an EmbeddingServerPool.
+
+    PCM is written once into a shared-memory block that the worker reads in place; only a small
+    request header and the resulting embeddings cross the socket. Each request goes to the
+    healthy worker with the fewest requests in flight. A background thread pings every worker
+    and discovers new or restarted ones. A worker whose connection fails (it died or was
+    restarted) is marked unhealthy and the request is retried on another one. A request that
+    times out is not retried: the worker is alive but slow, may still finish it, and sending it
+    again would only add load.
+    """
+
+    def __init__(self, socket_dir: str = DEFAULT_SOCKET_DIR, health_check_interval_seconds: float = HEALTH_CHECK_INTERVAL_SECONDS, request_timeout_seconds: float = REQUEST_TIMEOUT_SECONDS):
+        self.socket_dir = socket_dir
+        self.health_check_interval_seconds = health_check_interval_seconds
+        self.request_timeout_seconds = request_timeout_seconds
+        self._workers: Dict[str, _WorkerHandle] = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.check_health()
+        self._thread = threading.Thread(target=self._health_loop, name="resona-embed-client-health", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        with self._lock:
+            for worker in self._workers.values():
+                for conn in worker.idle:
+                    conn.close()
+                worker.idle.clear()
+
+    def _connect(self, path: str) -> Connection:
+        return Client(path, family="AF_UNIX", authkey=_read_authkey(self.socket_dir))
+
+    def _health_loop(self) -> None:
+        while not self._stopping.wait(self.health_check_interval_seconds):
+            self.check_health()
+
+    def check_health(self) -> int:
+        """Pings every worker socket in the directory and returns the number of healthy workers."""
+        for path in sorted(glob.glob(os.path.join(self.socket_dir, SOCKET_PATTERN))):
+            with self._lock:
+                worker = self._workers.setdefault(path, _WorkerHandle(path))
+            try:
+                with self._connect(path) as conn:
+                    conn.send({"op": "ping"})
+                    if not conn.poll(HEALTH_CHECK_TIMEOUT_SECONDS):
+                        raise TimeoutError("ping timed out")
+                    info = conn.recv()
+                with self._lock:
+                    recovered = not worker.healthy
+                    worker.info = info
+                    worker.healthy = True
+                if recovered:
+                    logger.info(f"Embedding server worker {path} is healthy (pid {info.get('pid')})")
+            except Exception as e:
+                self._mark_unhealthy(worker, e)
+        with self._lock:
+            # Forget sockets that disappeared (a stopped pool or a worker that has not restarted yet).
+            for path in [p for p, w in self._workers.items() if not os.path.exists(p) and w.in_flight == 0]:
+                del self._workers[path]
+            return sum(1 for w in self._workers.values() if w.healthy)
+
+    def _mark_unhealthy(self, worker: _WorkerHandle, error: Exception) -> None:
+        with self._lock:
+            was_healthy = worker.healthy
+            worker.healthy = False
+            worker.last_error = str(error)
+            for conn in worker.idle:
+                conn.close()
+            worker.idle.clear()
+        if was_healthy:
+            logger.warning(f"Embedding server worker {worker.path} is unhealthy: {error}")
+
+    def _acquire(self, tried: set) -> Tuple[_WorkerHandle, Optional[Connection]]:
+        with self._lock:
+            candidates = [w for w in self._workers.values() if w.healthy and w.path not in tried]
+            if not candidates:
+                raise EmbeddingServerUnavailable(f"No healthy embedding server worker in {self.socket_dir}")
+            worker = min(candidates, key=lambda w: w.in_flight)
+            worker.in_flight += 1
+            return worker, worker.idle.pop() if worker.idle else None
+
+    def _request(self, message: Dict[str, Any], audio: np.ndarray) -> Dict[str, Any]:
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+        shm = shared_memory.SharedMemory(create=True, size=max(audio.nbytes, 1))
+        try:
+            np.ndarray(audio.shape, dtype=np.float32, buffer=shm.buf)[...] = audio
+            message = {**message, "shm": shm.name, "shape": audio.shape}
+            tried: set = set()
+            while True:
+                if not any(w.healthy and w.path not in tried for w in list(self._workers.values())):
+                    # Workers may have come back since the last periodic check.
+                    self.check_health()
+                worker, conn = self._acquire(tried)
+                tried.add(worker.path)
+                try:
+                    if conn is None:
+                        conn = self._connect(worker.path)
+                    conn.send(message)
+                    if not conn.poll(self.request_timeout_seconds):
+                        # A late reply would arrive on this connection out of turn, so drop it.
+                        conn.close()
+                        with self._lock:
+                            worker.failures += 1
+                            worker.last_error = f"no reply within {self.request_timeout_seconds}s"
+                        raise EmbeddingServerError(f"Embedding server worker {worker.path} sent no reply within {self.request_timeout_seconds}s")
+                    reply = conn.recv()
+                except (OSError, EOFError) as e:
+                    # The worker is gone or restarted (refused, reset or closed connection); try another.
+                    if conn is not None:
+                        conn.close()
+                    with self._lock:
+                        worker.failures += 1
+                    self._mark_unhealthy(worker, e)
+                    continue
+                except Exception:
+                    if conn is not None:
+                        conn.close()
+                    raise
+                finally:
+                    with self._lock:
+                        worker.in_flight -= 1
+                with self._lock:
+                    worker.requests += 1
+                    worker.idle.append(conn)
+                if not reply.get("ok"):
+                    raise EmbeddingServerError(reply.get("error", "unknown error"))
+                return reply
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def embed_audio(self, audio: np.ndarray, sr: int, key: ModelKey, profile: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Remote equivalent of audio_embedding_service.compute_frame_embeddings."""
+        reply = self._request({"op": "embed_audio", "sr": sr, "model": tuple(key), "profile": profile}, audio)
+        return reply["embeddings"], reply["timestamps"]
+
+    def embed_frames(self, buffer: np.ndarray, frame_len: int, hop_len: int, key: ModelKey) -> np.ndarray:
+        """Remote equivalent of audio_embedding_service.embed_buffer_frames."""
+        reply = self._request({"op": "embed_frames", "frame_len": frame_len, "hop_len": hop_len, "model": tuple(key)}, buffer)
+        return reply["embeddings"]
+
+    def healthy_workers(self) -> int:
+        with self._lock:
+            return sum(1 for w in self._workers.values() if w.healthy)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "socket_dir": self.socket_dir,
+                "healthy_workers": sum(1 for w in self._workers.values() if w.healthy),
+                "workers": {
+                    os.path.basename(w.path): {
+                        "healthy": w.healthy,
+                        "pid": w.info.get("pid"),
+                        "in_flight": w.in_flight,
+                        "requests": w.requests,
+                        "failures": w.failures,
+                        "last_error": w.last_error,
+                    }
+                    for w in self._workers.values()
+                },
+            }
+
+
+_client: Optional[EmbeddingServerClient] = None
+
+
+def set_embedding_client(client: Optional[EmbeddingServerClient]) -> None:
+    """Routes this process's OpenL3 inference to an embedding server (or back to local models with None)."""
+    global _client
+    _client = client
+
+
+def get_embedding_client() -> Optional[EmbeddingServerClient]:
+    return _client
+
+
+if __name__ == '__main__':
+    # Usage: python -m services.embedding_server [--workers N] [--socket-dir DIR] [--threads N]
+    # API processes started with RESONA_EMBED_SERVER=connect and the same socket directory use these workers.
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Run a pool of OpenL3 inference processes for the RESONA API.")
+    parser.add_argument("--workers", type=int, default=2, help="Inference processes (each holds one copy of the models).")
+    parser.add_argument("--socket-dir", default=DEFAULT_SOCKET_DIR, help="Directory for the worker sockets and auth key.")
+    parser.add_argument("--threads", type=int, default=0, help="TensorFlow intra-op threads per worker (default: TensorFlow's choice).")
+    args = parser.parse_args()
+
+    pool = EmbeddingServerPool(args.socket_dir, workers=args.workers, intra_op_threads=args.threads)
+    pool.start()
+    try:
+        while True:
+            time.sleep(60)
+            logger.info(f"Embedding server: {pool.stats()}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.stop()
@@ -0,0 +1,375 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# How OpenL3 inference is executed once a model is loaded:
+#   "keras"       - model.predict on the stock Keras model; the reference every other backend is checked against.
+#   "tf_function" - the model traced once into a tf.function with a fixed input signature (XLA-compiled
+#                   where available), skipping Keras' per-call data adapter and callback machinery.
+#   "tflite"      - the model converted to TensorFlow Lite and run by the TFLite interpreter.
+#   "onnx"        - the model exported with tf2onnx and run by ONNX Runtime (both optional dependencies).
+BACKENDS = ("keras", "tf_function", "tflite", "onnx")
+# Weight precision of the converted model. float16 and int8 (dynamic-range quantised weights,
+# float activations) are available for tflite, and int8 for onnx.
+PRECISIONS = ("float32", "float16", "int8")
+INFERENCE_BACKEND = os.environ.get("RESONA_INFERENCE_BACKEND", "keras")
+INFERENCE_PRECISION = os.environ.get("RESONA_INFERENCE_PRECISION", "float32")
+# Threads used by the TFLite interpreter or ONNX Runtime session; 0 leaves the runtime's default.
+# TensorFlow's own thread pools (keras, tf_function) are set with RESONA_EMBED_SERVER_THREADS.
+INFERENCE_THREADS = int(os.environ.get("RESONA_INFERENCE_THREADS", "0"))
+# Converted models are written here, keyed by model, backend, precision and TensorFlow version,
+# so a restart does not pay for the conversion again.
+INFERENCE_CACHE_DIR = os.environ.get("RESONA_INFERENCE_CACHE_DIR", os.path.join("cache", "models"))
+# Lowest per-frame cosine similarity to the Keras reference a backend must reach on the parity
+# clip when it is loaded; a backend below it is not used and inference stays on Keras.
+# RESONA_INFERENCE_PARITY_MIN_COSINE overrides the per-precision default.
+DEFAULT_PARITY_MIN_COSINE = {"float32": 0.9999, "float16": 0.999, "int8": 0.98}
+PARITY_MIN_COSINE = os.environ.get("RESONA_INFERENCE_PARITY_MIN_COSINE")
+# Length of the synthetic clip embedded by both backends in the load-time parity check.
+PARITY_CLIP_SECONDS = 3.0
+# Frames per call into the backend; larger batches are split into chunks of this size.
+PREDICT_BATCH_SIZE = 64
+
+
+class InferenceBackend:
+    """
+    Runs OpenL3 input frames through a loaded model. This base class is the Keras reference.
+
+    Subclasses compile or convert the model once in __init__ and implement predict(); every
+    backend takes frames shaped like the model input, (frames, 1, samples) float32, and returns
+    (frames, embedding_size) float32 embeddings.
+    """
+
+    name = "keras"
+    precisions: Tuple[str, ...] = ("float32",)
+
+    def __init__(self, model: Any, precision: str = "float32", threads: int = 0, cache_prefix: Optional[str] = None):
+        if precision not in self.precisions:
+            raise ValueError(f"The {self.name} backend supports precisions {', '.join(self.precisions)}, not {precision!r}")
+        self.model = model
+        self.precision = precision
+        self.threads = threads
+        self.cache_prefix = cache_prefix
+        self.convert_seconds = 0.0
+        self.converted_bytes: Optional[int] = None
+
+    def predict(self, frames: np.ndarray, batch_size: int = PREDICT_BATCH_SIZE) -> np.ndarray:
+        return self.model.predict(frames, batch_size=batch_size, verbose=0)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name,
+            "precision": self.precision,
+            "threads": self.threads,
+            "convert_seconds": round(self.convert_seconds, 3),
+            "converted_bytes": self.converted_bytes,
+        }
+
+    def _input_shape(self) -> Tuple[int, ...]:
+        return tuple(int(d) for d in self.model.input_shape[1:])
+
+    def _cached_artifact(self, suffix: str, build: Any) -> bytes:
+        """Returns the converted model from the on-disk cache, or builds, stores and returns it."""
+        start = time.perf_counter()
+        path = None
+        if self.cache_prefix:
+            import tensorflow as tf
+            path = os.path.join(INFERENCE_CACHE_DIR, f"{self.cache_prefix}-{self.name}-{self.precision}-tf{tf.__version__}.{suffix}")
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    content = f.read()
+                logger.info(f"Loaded converted model {path}")
+                self.converted_bytes = len(content)
+                return content
+        content = build()
+        if path is not None:
+            os.makedirs(INFERENCE_CACHE_DIR, exist_ok=True)
+            # Write then rename, so a concurrent worker never reads a partial file.
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        self.convert_seconds = time.perf_counter() - start
+        self.converted_bytes = len(content)
+        logger.info(f"Converted model for the {self.name} backend ({self.precision}) in {self.convert_seconds:.1f}s, {len(content) / 1e6:.1f} MB")
+        return content
+
+
+def _chunks(frames: np.ndarray, batch_size: int):
+    for offset in range(0, frames.shape[0], batch_size):
+        yield np.ascontiguousarray(frames[offset:offset + batch_size], dtype=np.float32)
+
+
+class TfFunctionBackend(InferenceBackend):
+    """The Keras model traced once into a graph function, called directly on each batch."""
+
+    name = "tf_function"
+
+    def __init__(self, model: Any, precision: str = "float32", threads: int = 0, cache_prefix: Optional[str] = None):
+        super().__init__(model, precision, threads, cache_prefix)
+        import tensorflow as tf
+        self._tf = tf
+        start = time.perf_counter()
+        signature = [tf.TensorSpec((None,) + self._input_shape(), tf.float32)]
+        try:
+            self._function = tf.function(lambda x: model(x, training=False), input_signature=signature, jit_compile=True)
+            self._function.get_concrete_function()
+        except Exception as e:
+            # Not every TensorFlow build has XLA, and kapre's STFT layers do not always compile with it.
+            logger.info(f"XLA compilation unavailable for the tf_function backend ({e}); using a plain graph function")
+            self._function = tf.function(lambda x: model(x, training=False), input_signature=signature)
+            self._function.get_concrete_function()
+        self.convert_seconds = time.perf_counter() - start
+
+    def predict(self, frames: np.ndarray, batch_size: int = PREDICT_BATCH_SIZE) -> np.ndarray:
+        return np.concatenate([self._function(self._tf.constant(chunk)).numpy() for chunk in _chunks(frames, batch_size)])
+
+
+class TfLiteBackend(InferenceBackend):
+    """The model converted to a TensorFlow Lite flatbuffer and run by the TFLite interpreter."""
+
+    name = "tflite"
+    precisions = PRECISIONS
+
+    def __init__(self, model: Any, precision: str = "float32", threads: int = 0, cache_prefix: Optional[str] = None):
+        super().__init__(model, precision, threads, cache_prefix)
+        import tensorflow as tf
+        content = self._cached_artifact("tflite", self._convert)
+        self._interpreter = tf.lite.Interpreter(model_content=content, num_threads=threads or None)
+        self._input_index = self._interpreter.get_input_details()[0]["index"]
+        self._output_index = self._interpreter.get_output_details()[0]["index"]
+        self._batch_rows: Optional[int] = None
+        # An interpreter runs one invocation at a time; without a batcher, several embed threads can call in.
+        self._lock = threading.Lock()
+
+    def _convert(self) -> bytes:
+        import tensorflow as tf
+        converter = tf.lite.TFLiteConverter.from_keras_model(self.model)
+        # kapre computes the spectrogram with TensorFlow ops that have no TFLite builtin; those run through the Flex delegate.
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS]
+        if self.precision in ("float16", "int8"):
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if self.precision == "float16":
+            converter.target_spec.supported_types = [tf.float16]
+        return converter.convert()
+
+    def predict(self, frames: np.ndarray, batch_size: int = PREDICT_BATCH_SIZE) -> np.ndarray:
+        outputs = []
+        with self._lock:
+            for chunk in _chunks(frames, batch_size):
+                if chunk.shape[0] != self._batch_rows:
+                    self._interpreter.resize_tensor_input(self._input_index, chunk.shape)
+                    self._interpreter.allocate_tensors()
+                    self._batch_rows = chunk.shape[0]
+                self._interpreter.set_tensor(self._input_index, chunk)
+                self._interpreter.invoke()
+                outputs.append(self._interpreter.get_tensor(self._output_index).copy())
+        return np.concatenate(outputs)
+
+
+class OnnxBackend(InferenceBackend):
+    """The model exported to ONNX with tf2onnx and run by an ONNX Runtime CPU session."""
+
+    name = "onnx"
+    precisions = ("float32", "int8")
+
+    def __init__(self, model: Any, precision: str = "float32", threads: int = 0, cache_prefix: Optional[str] = None):
+        super().__init__(model, precision, threads, cache_prefix)
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise RuntimeError("The onnx inference backend needs onnxruntime and tf2onnx (pip install onnxruntime tf2onnx)") from e
+        content = self._cached_artifact("onnx", self._convert)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.inter_op_num_threads = 1
+        if threads:
+            options.intra_op_num_threads = threads
+        self._session = onnxruntime.InferenceSession(content, sess_options=options, providers=["CPUExecutionProvider"])
+        self._input_name = self._session.get_inputs()[0].name
+
+    def _convert(self) -> bytes:
+        import tensorflow as tf
+        import tf2onnx
+        signature = (tf.TensorSpec((None,) + self._input_shape(), tf.float32, name="frames"),)
+        proto, _ = tf2onnx.convert.from_keras(self.model, input_signature=signature, opset=15)
+        content = proto.SerializeToString()
+        if self.precision == "int8":
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            with tempfile.TemporaryDirectory() as tmp:
+                source, target = os.path.join(tmp, "model.onnx"), os.path.join(tmp, "model.int8.onnx")
+                with open(source, "wb") as f:
+                    f.write(content)
+                quantize_dynamic(source, target, weight_type=QuantType.QInt8)
+                with open(target, "rb") as f:
+                    content = f.read()
+        return content
+
+    def predict(self, frames: np.ndarray, batch_size: int = PREDICT_BATCH_SIZE) -> np.ndarray:
+        return np.concatenate([self._session.run(None, {self._input_name: chunk})[0] for chunk in _chunks(frames, batch_size)])
+
+
+_BACKEND_CLASSES = {cls.name: cls for cls in (InferenceBackend, TfFunctionBackend, TfLiteBackend, OnnxBackend)}
+
+
+def create_backend(model: Any, backend: str = "keras", precision: str = "float32", threads: int = 0, cache_prefix: Optional[str] = None) -> InferenceBackend:
+    """
+    Builds an inference backend for a loaded OpenL3 Keras model.
+
+    Args:
+        model: The Keras model, as returned by model_registry.get_model.
+        backend: One of BACKENDS.
+        precision: One of PRECISIONS; which ones a backend accepts is listed on its class.
+        threads: Runtime threads for tflite and onnx; 0 for the runtime's default.
+        cache_prefix: File name prefix under INFERENCE_CACHE_DIR for the converted model, or None to convert without caching.
+
+    Raises:
+        ValueError: If the backend or precision is unknown or unsupported by the backend.
+    """
+    cls = _BACKEND_CLASSES.get(backend)
+    if cls is None:
+        raise ValueError(f"Unknown inference backend {backend!r}; expected one of {', '.join(BACKENDS)}")
+    return cls(model, precision=precision, threads=threads, cache_prefix=cache_prefix)
+
+
+def model_cache_prefix(model: Any, key: Sequence[Any]) -> str:
+    """A cache file prefix naming the model configuration and fingerprinting its weights."""
+    digest = hashlib.sha1()
+    for weights in model.get_weights():
+        digest.update(np.ascontiguousarray(weights).tobytes())
+    return "openl3-" + "-".join(str(part) for part in key) + f"-{digest.hexdigest()[:12]}"
+
+
+def parity_clip(seconds: float = PARITY_CLIP_SECONDS, sample_rate: int = 48000, seed: int = 0) -> np.ndarray:
+    """A deterministic mono clip of tones and noise; silence would make every backend look identical."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    audio = sum(0.2 * np.sin(2 * np.pi * f * t + rng.uniform(0, np.pi)) for f in (110.0, 440.0, 1250.0, 3300.0))
+    audio = audio * (0.5 + 0.5 * np.sin(2 * np.pi * 0.7 * t)) + 0.05 * rng.standard_normal(t.shape[0])
+    return audio.astype(np.float32)
+
+
+def _timed_predict(backend: InferenceBackend, frames: np.ndarray, batch_size: int, repeat: int) -> Tuple[np.ndarray, float]:
+    # The first call may still build or allocate; it is not timed.
+    output = backend.predict(frames, batch_size)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        output = backend.predict(frames, batch_size)
+    return np.asarray(output, dtype=np.float32), (time.perf_counter() - start) / max(1, repeat)
+
+
+def check_parity(
+    reference: InferenceBackend,
+    candidate: InferenceBackend,
+    frames: np.ndarray,
+    batch_size: int = PREDICT_BATCH_SIZE,
+    repeat: int = 1,
+) -> Dict[str, Any]:
+    """
+    Embeds the same frames with both backends and reports how far the candidate deviates and how fast it is.
+
+    Returns:
+        Per-frame cosine similarity between the two outputs (min and mean, and the matching
+        deviations 1 - cosine), the cosine of the clip-level mean embeddings the API returns,
+        the largest absolute difference, and frames per second of each backend.
+    """
+    expected, reference_seconds = _timed_predict(reference, frames, batch_size, repeat)
+    actual, candidate_seconds = _timed_predict(candidate, frames, batch_size, repeat)
+    if actual.shape != expected.shape:
+        raise ValueError(f"The {candidate.name} backend returned shape {actual.shape}, expected {expected.shape}")
+    norms = np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1)
+    cosines = np.einsum("ij,ij->i", expected, actual) / np.maximum(norms, 1e-12)
+    mean_expected, mean_actual = expected.mean(axis=0), actual.mean(axis=0)
+    clip_cosine = float(mean_expected @ mean_actual / max(np.linalg.norm(mean_expected) * np.linalg.norm(mean_actual), 1e-12))
+    frame_count = frames.shape[0]
+    return {
+        "frames": frame_count,
+        "min_cosine": round(float(cosines.min()), 6),
+        "mean_cosine": round(float(cosines.mean()), 6),
+        "max_cosine_deviation": round(float(1.0 - cosines.min()), 6),
+        "mean_cosine_deviation": round(float(1.0 - cosines.mean()), 6),
+        "clip_cosine": round(clip_cosine, 6),
+        "max_abs_diff": round(float(np.abs(expected - actual).max()), 6),
+        "reference_frames_per_second": round(frame_count / reference_seconds, 1) if reference_seconds > 0 else None,
+        "frames_per_second": round(frame_count / candidate_seconds, 1) if candidate_seconds > 0 else None,
+        "speedup": round(reference_seconds / candidate_seconds, 2) if candidate_seconds > 0 else None,
+    }
+
+
+def parity_threshold(precision: str) -> float:
+    return float(PARITY_MIN_COSINE) if PARITY_MIN_COSINE else DEFAULT_PARITY_MIN_COSINE[precision]
+
+
+def select_backend(
+    model: Any,
+    frames: np.ndarray,
+    backend: str = INFERENCE_BACKEND,
+    precision: str = INFERENCE_PRECISION,
+    threads: int = INFERENCE_THREADS,
+    cache_prefix: Optional[str] = None,
+) -> Tuple[InferenceBackend, Dict[str, Any]]:
+    """
+    Builds the configured backend and checks it against Keras on `frames` before it is used.
+
+    A backend that fails to build, or whose minimum per-frame cosine similarity falls below
+    parity_threshold(precision), is logged and replaced by the Keras reference, so a bad
+    conversion degrades throughput rather than the embeddings.
+
+    Returns:
+        (backend to use, its describe() with the parity report and any fallback reason).
+    """
+    reference = InferenceBackend(model)
+    try:
+        candidate = create_backend(model, backend, precision, threads, cache_prefix)
+        parity = check_parity(reference, candidate, frames)
+    except Exception as e:
+        logger.error(f"Inference backend {backend} ({precision}) is unavailable, using keras: {e}", exc_info=True)
+        return reference, {**reference.describe(), "requested": {"backend": backend, "precision": precision}, "fallback_reason": str(e)}
+    info = {**candidate.describe(), "parity": parity, "parity_min_cosine": parity_threshold(precision)}
+    if parity["min_cosine"] < info["parity_min_cosine"]:
+        reason = f"min cosine {parity['min_cosine']} to the keras reference is below {info['parity_min_cosine']}"
+        logger.error(f"Inference backend {backend} ({precision}) failed its parity check, using keras: {reason}")
+        return reference, {**reference.describe(), "requested": info, "fallback_reason": reason}
+    logger.info(
+        f"Using the {backend} inference backend ({precision}): min cosine {parity['min_cosine']}, "
+        f"{parity['frames_per_second']} frames/s against {parity['reference_frames_per_second']} for keras"
+    )
+    return candidate, info
+
+
+def compare_backends(
+    model: Any,
+    frames: np.ndarray,
+    configs: Sequence[Tuple[str, str]],
+    threads: int = INFERENCE_THREADS,
+    batch_size: int = PREDICT_BATCH_SIZE,
+    repeat: int = 3,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Runs the parity check for each (backend, precision) in `configs` on the same frames.
+
+    Conversions are not cached, so each result also shows what converting costs. Backends that
+    cannot be built here (e.g. onnxruntime not installed) report their error instead.
+    """
+    reference = InferenceBackend(model)
+    results: Dict[str, Dict[str, Any]] = {}
+    for backend, precision in configs:
+        try:
+            candidate = create_backend(model, backend, precision, threads)
+            results[f"{backend}/{precision}"] = {**candidate.describe(), **check_parity(reference, candidate, frames, batch_size, repeat)}
+        except Exception as e:
+            results[f"{backend}/{precision}"] = {"error": str(e)}
+    return results
+
+
+def all_configs() -> List[Tuple[str, str]]:
+    """Every (backend, precision) pair the backends accept."""
+    return [(name, precision) for name, cls in _BACKEND_CLASSES.items() for precision in cls.precisions]
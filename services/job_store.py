@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# How long a finished job (and its result) stays retrievable.
+DEFAULT_RESULT_TTL_SECONDS = 600.0
+# Upper bound on jobs held at once; the oldest finished jobs are dropped first when it is reached.
+DEFAULT_MAX_JOBS = 10_000
+
+TERMINAL_STATUSES = ("done", "failed")
+
+
+class Job:
+    """State of one asynchronous analysis job. Mutated only from the event loop."""
+
+    __slots__ = ("id", "kind", "status", "stage", "stages", "result", "error", "created_at", "updated_at", "finished_at", "_subscribers")
+
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = "queued"  # queued -> running -> done | failed
+        self.stage: Optional[str] = None
+        self.stages: List[Dict[str, Any]] = []
+        self.result: Optional[Any] = None
+        self.error: Optional[Dict[str, Any]] = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.finished_at: Optional[float] = None
+        self._subscribers: List[asyncio.Queue] = []
+
+    @property
+    def finished(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+    def snapshot(self, include_result: bool = True) -> Dict[str, Any]:
+        state: Dict[str, Any] = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "stages": list(self.stages),
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "finished_at": self.finished_at,
+        }
+        if self.error is not None:
+            state["error"] = self.error
+        if include_result and self.result is not None:
+            state["result"] = self.result
+        return state
+
+
+class JobStore:
+    """
+    In-process registry of asynchronous jobs, their progress and their results.
+
+    Jobs run as asyncio tasks on the application's event loop and report stage changes through
+    set_stage(). Clients either poll get() or iterate events() (used for server-sent events).
+    Finished jobs are kept for `result_ttl_seconds` so reconnecting clients can collect the result
+    without resubmitting; expired jobs are purged lazily on access.
+    """
+
+    def __init__(self, result_ttl_seconds: float = DEFAULT_RESULT_TTL_SECONDS, max_jobs: int = DEFAULT_MAX_JOBS):
+        self.result_ttl_seconds = result_ttl_seconds
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._tasks: Set[asyncio.Task] = set()
+        self._counters = {"submitted": 0, "done": 0, "failed": 0, "expired": 0}
+
+    def _purge(self) -> None:
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished and now - job.finished_at > self.result_ttl_seconds]
+        for job_id in expired:
+            del self._jobs[job_id]
+        self._counters["expired"] += len(expired)
+        # Over capacity: drop the oldest finished jobs. Running jobs are never dropped.
+        if len(self._jobs) >= self.max_jobs:
+            for job_id in [job_id for job_id, job in self._jobs.items() if job.finished][:len(self._jobs) - self.max_jobs + 1]:
+                del self._jobs[job_id]
+                self._counters["expired"] += 1
+
+    def create(self, kind: str) -> Job:
+        self._purge()
+        job = Job(kind)
+        self._jobs[job.id] = job
+        self._counters["submitted"] += 1
+        return job
+
+    def start(self, job: Job, coroutine: Any) -> None:
+        """Runs `coroutine` as the job's task. Its return value becomes the job result."""
+        task = asyncio.create_task(self._run(job, coroutine), name=f"resona-job-{job.id}")
+        # The loop only keeps weak references to tasks; hold them until they finish.
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job: Job, coroutine: Any) -> None:
+        job.status = "running"
+        self._publish(job)
+        try:
+            result = await coroutine
+        except asyncio.CancelledError:
+            self.fail(job, 503, "Job cancelled because the server is shutting down.")
+            raise
+        except JobFailed as e:
+            self.fail(job, e.status_code, e.detail, e.headers)
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}", exc_info=True)
+            self.fail(job, 500, f"An unexpected error occurred: {e}")
+        else:
+            self.complete(job, result)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._purge()
+        return self._jobs.get(job_id)
+
+    def set_stage(self, job: Job, stage: str) -> None:
+        now = time.time()
+        if job.stages and job.stages[-1].get("finished_at") is None:
+            job.stages[-1]["finished_at"] = now
+        job.stage = stage
+        job.stages.append({"stage": stage, "started_at": now, "finished_at": None})
+        self._publish(job)
+
+    def complete(self, job: Job, result: Any) -> None:
+        self._finish(job, "done")
+        job.result = result
+        self._counters["done"] += 1
+        self._publish(job)
+
+    def fail(self, job: Job, status_code: int, detail: str, headers: Optional[Dict[str, str]] = None) -> None:
+        self._finish(job, "failed")
+        job.error = {"status_code": status_code, "detail": detail, **({"headers": headers} if headers else {})}
+        self._counters["failed"] += 1
+        self._publish(job)
+
+    def _finish(self, job: Job, status: str) -> None:
+        now = time.time()
+        if job.stages and job.stages[-1].get("finished_at") is None:
+            job.stages[-1]["finished_at"] = now
+        job.status = status
+        job.stage = None
+        job.finished_at = now
+
+    def _publish(self, job: Job) -> None:
+        job.updated_at = time.time()
+        snapshot = job.snapshot(include_result=job.finished)
+        for subscriber in job._subscribers:
+            subscriber.put_nowait(snapshot)
+
+    async def events(self, job: Job, heartbeat_seconds: float = 15.0) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        Yields the job's state now and after every change, ending once it is finished.
+
+        Yields None every `heartbeat_seconds` without a change, so callers can keep idle
+        connections alive through proxies.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        job._subscribers.append(queue)
+        try:
+            state = job.snapshot()
+            yield state
+            while not job.finished or not queue.empty():
+                try:
+                    state = await asyncio.wait_for(queue.get(), timeout=heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield state
+                if state["status"] in TERMINAL_STATUSES:
+                    break
+        finally:
+            job._subscribers.remove(queue)
+
+    async def cancel_all(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        self._purge()
+        running = sum(1 for job in self._jobs.values() if not job.finished)
+        return {
+            **self._counters,
+            "jobs": len(self._jobs),
+            "running": running,
+            "result_ttl_seconds": self.result_ttl_seconds,
+        }
+
+
+class JobFailed(Exception):
+    """Raised inside a job to fail it with an HTTP-style status code and detail."""
+
+    def __init__(self, status_code: int, detail: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.headers = headers
@@ -0,0 +1,171 @@
+import logging
+import resource
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+from .inference_backend import INFERENCE_BACKEND, INFERENCE_PRECISION, InferenceBackend, model_cache_prefix, parity_clip, select_backend
+
+logger = logging.getLogger(__name__)
+
+# A model is identified by the three OpenL3 parameters that change its architecture/weights.
+ModelKey = Tuple[str, str, int]
+
+# Models loaded by default at application startup (see the lifespan hook in main.py).
+DEFAULT_MODEL_CONFIGS = [("mel256", "music", 512)]
+
+# Length of the silent clip pushed through each model after loading. The first predict call
+# builds the TensorFlow graph, so doing it here keeps that cost off the first real request.
+WARMUP_SECONDS = 1.0
+
+_models: Dict[ModelKey, Any] = {}
+_backends: Dict[ModelKey, InferenceBackend] = {}
+_model_stats: Dict[ModelKey, Dict[str, Any]] = {}
+_lock = threading.Lock()
+_openl3: Any = None
+_openl3_import_seconds: Optional[float] = None
+
+
+def read_rss_bytes() -> Optional[int]:
+    """Returns the resident set size of this process, or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as statm:
+            resident_pages = int(statm.read().split()[1])
+        return resident_pages * resource.getpagesize()
+    except Exception:
+        return None
+
+
+def import_openl3() -> Any:
+    """
+    Returns the openl3 module, importing it (and TensorFlow with it) on first use.
+
+    openl3 is never imported at module level, so processes that only serve HTTP, parse URLs or
+    search the index start without paying several seconds and hundreds of MB for TensorFlow.
+    """
+    global _openl3, _openl3_import_seconds
+    if _openl3 is None:
+        import_start = time.perf_counter()
+        import openl3
+        _openl3_import_seconds = round(time.perf_counter() - import_start, 4)
+        _openl3 = openl3
+        logger.info(f"Imported openl3/TensorFlow in {_openl3_import_seconds:.2f}s")
+    return _openl3
+
+
+def openl3_import_seconds() -> Optional[float]:
+    """Returns how long the first openl3 import took, or None if it has not been imported yet."""
+    return _openl3_import_seconds
+
+
+def _load_model(key: ModelKey) -> Any:
+    input_repr, content_type, embedding_size = key
+    logger.info(f"Loading OpenL3 model (input_repr={input_repr}, content_type={content_type}, embedding_size={embedding_size})")
+
+    openl3 = import_openl3()
+    rss_before = read_rss_bytes()
+    load_start = time.perf_counter()
+    model = openl3.models.load_audio_embedding_model(input_repr, content_type, embedding_size)
+    load_seconds = time.perf_counter() - load_start
+
+    # Warm-up: run a short silent clip through the model so graph construction happens now.
+    from .audio_embedding_service import DEFAULT_HOP_SECONDS, TARGET_SR
+    warmup_start = time.perf_counter()
+    openl3.get_audio_embedding(
+        np.zeros(int(TARGET_SR * WARMUP_SECONDS), dtype=np.float32),
+        TARGET_SR,
+        model=model,
+        input_repr=input_repr,
+        content_type=content_type,
+        embedding_size=embedding_size,
+        verbose=False,
+    )
+    warmup_seconds = time.perf_counter() - warmup_start
+
+    # Any backend other than the Keras reference is built now and must pass its parity check before it serves requests.
+    if (INFERENCE_BACKEND, INFERENCE_PRECISION) == ("keras", "float32"):
+        backend = InferenceBackend(model)
+        inference = backend.describe()
+    else:
+        frames = openl3.core.preprocess_audio(parity_clip(sample_rate=TARGET_SR), TARGET_SR, hop_size=DEFAULT_HOP_SECONDS, input_repr=None, center=True)
+        backend, inference = select_backend(model, frames, cache_prefix=model_cache_prefix(model, key))
+    _backends[key] = backend
+    rss_after = read_rss_bytes()
+
+    weights_bytes = int(sum(w.nbytes for w in model.get_weights()))
+    _model_stats[key] = {
+        "input_repr": input_repr,
+        "content_type": content_type,
+        "embedding_size": embedding_size,
+        "load_seconds": round(load_seconds, 4),
+        "warmup_seconds": round(warmup_seconds, 4),
+        "parameter_count": int(model.count_params()),
+        "weights_bytes": weights_bytes,
+        "rss_delta_bytes": (rss_after - rss_before) if rss_before is not None and rss_after is not None else None,
+        "inference": inference,
+    }
+    logger.info(
+        f"OpenL3 model {key} ready: load {load_seconds:.2f}s, warm-up {warmup_seconds:.2f}s, "
+        f"weights {weights_bytes / 1e6:.1f} MB"
+    )
+    return model
+
+
+def get_model(input_repr: str = "mel256", content_type: str = "music", embedding_size: int = 512) -> Any:
+    """
+    Returns the shared OpenL3 Keras model for the given configuration, loading it on first use.
+
+    Args:
+        input_repr: OpenL3 input representation ('linear', 'mel128', 'mel256').
+        content_type: OpenL3 content type ('music', 'env').
+        embedding_size: OpenL3 embedding size (512 or 6144).
+
+    Returns:
+        The loaded Keras model. The same instance is returned for every call with the same configuration.
+    """
+    key = (input_repr, content_type, int(embedding_size))
+    model = _models.get(key)
+    if model is not None:
+        return model
+    with _lock:
+        # Re-check under the lock so concurrent first calls only load the model once.
+        model = _models.get(key)
+        if model is None:
+            model = _load_model(key)
+            _models[key] = model
+    return model
+
+
+def get_backend(input_repr: str = "mel256", content_type: str = "music", embedding_size: int = 512) -> InferenceBackend:
+    """
+    Returns the inference backend that runs the model for the given configuration, loading the model on first use.
+
+    This is the RESONA_INFERENCE_BACKEND backend if it passed its parity check when the model
+    was loaded, and the Keras model otherwise (see inference_backend.select_backend).
+    """
+    get_model(input_repr, content_type, embedding_size)
+    return _backends[(input_repr, content_type, int(embedding_size))]
+
+
+def preload_models(configs: Iterable[ModelKey] = DEFAULT_MODEL_CONFIGS) -> Dict[str, Dict[str, Any]]:
+    """
+    Loads and warms up every model in `configs`. Intended to be called once at application startup.
+
+    Returns:
+        The per-model load statistics, as returned by get_model_stats().
+    """
+    for input_repr, content_type, embedding_size in configs:
+        get_model(input_repr, content_type, embedding_size)
+    return get_model_stats()
+
+
+def models_loaded(configs: Iterable[ModelKey] = DEFAULT_MODEL_CONFIGS) -> bool:
+    """Returns True once every model in `configs` is loaded and warmed up."""
+    return all((c[0], c[1], int(c[2])) in _models for c in configs)
+
+
+def get_model_stats() -> Dict[str, Dict[str, Any]]:
+    """Returns warm-up time and memory figures for every loaded model, keyed by 'input_repr/content_type/embedding_size'."""
+    return {f"{k[0]}/{k[1]}/{k[2]}": dict(v) for k, v in _model_stats.items()}
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+POOL_WAIT_SECONDS = registry.histogram("resona_pool_wait_seconds", "Time jobs spent queued before a stage pool worker picked them up.", ("pool",))
+POOL_RUN_SECONDS = registry.histogram("resona_pool_run_seconds", "Time jobs spent running on a stage pool worker.", ("pool",))
+
+
+class SchedulerBusyError(Exception):
+    """Raised when a stage pool already has as many jobs running and queued as it allows."""
+
+    def __init__(self, stage: str, status_code: int, retry_after_seconds: int = 1):
+        super().__init__(f"The '{stage}' stage is at capacity. Please retry shortly.")
+        self.stage = stage
+        self.status_code = status_code
+        self.retry_after_seconds = retry_after_seconds
+
+
+class _QueuedJob:
+    """Whether a job's queued slot has passed to a worker or been given back by a cancelled caller."""
+
+    __slots__ = ("started", "abandoned")
+
+    def __init__(self):
+        self.started = False
+        self.abandoned = False
+
+
+class StagePool:
+    """
+    A bounded thread pool for one pipeline stage.
+
+    At most `max_workers` jobs run at once and at most `max_queue` more wait for a free worker.
+    Anything beyond that is rejected immediately with SchedulerBusyError instead of piling up.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int, reject_status_code: int = 503):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.reject_status_code = reject_status_code
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"resona-{name}")
+        self._lock = threading.Lock()
+        self._running = 0
+        self._queued = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def _acquire_slot(self) -> None:
+        with self._lock:
+            if self._running + self._queued >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                logger.warning(f"Rejecting job for stage '{self.name}': {self._running} running, {self._queued} queued")
+                raise SchedulerBusyError(self.name, self.reject_status_code)
+            self._queued += 1
+
+    def _run_job(self, job: _QueuedJob, fn: Callable[..., Any], args: tuple, submitted_at: float, timings: Optional[Dict[str, float]]) -> Any:
+        started_at = time.perf_counter()
+        with self._lock:
+            if job.abandoned:
+                # The caller was cancelled before a worker got here and already gave the slot back.
+                return None
+            job.started = True
+            self._queued -= 1
+            self._running += 1
+        try:
+            return fn(*args)
+        finally:
+            finished_at = time.perf_counter()
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+            POOL_WAIT_SECONDS.observe(started_at - submitted_at, pool=self.name)
+            POOL_RUN_SECONDS.observe(finished_at - started_at, pool=self.name)
+            if timings is not None:
+                timings[f"{self.name}_queue_ms"] = round((started_at - submitted_at) * 1000, 2)
+                timings[f"{self.name}_ms"] = round((finished_at - started_at) * 1000, 2)
+
+    async def run(self, fn: Callable[..., Any], *args: Any, timings: Optional[Dict[str, float]] = None) -> Any:
+        """
+        Runs `fn(*args)` on this pool without blocking the event loop.
+
+        Args:
+            fn: The blocking callable to run.
+            *args: Positional arguments for `fn`. Use functools.partial for keyword arguments.
+            timings: Optional dict that receives '<stage>_queue_ms' and '<stage>_ms' entries.
+
+        Returns:
+            Whatever `fn` returns.
+
+        Raises:
+            SchedulerBusyError: If the pool's running and queued jobs are already at the limit.
+        """
+        self._acquire_slot()
+        job = _QueuedJob()
+        submitted_at = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, self._run_job, job, fn, args, submitted_at, timings)
+        finally:
+            # If no worker picked the job up (the caller was cancelled, the pool shut down or the
+            # executor refused it), the executor drops it, so release its queued slot here.
+            with self._lock:
+                if not job.started and not job.abandoned:
+                    job.abandoned = True
+                    self._queued -= 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": self._queued,
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class PipelineScheduler:
+    """
+    Holds one StagePool per pipeline stage: an I/O pool for yt-dlp downloads and uploads,
+    a CPU pool for decoding and OpenL3 inference, and a pool for vector searches. They are sized
+    separately so a burst of slow downloads cannot starve the embedder, and vice versa.
+    """
+
+    def __init__(
+        self,
+        download_workers: int = 4,
+        download_queue: int = 16,
+        embed_workers: int = 1,
+        embed_queue: int = 8,
+        search_workers: int = 2,
+        search_queue: int = 32,
+    ):
+        self.pools: Dict[str, StagePool] = {
+            # A full download queue means the client is submitting faster than we fetch: 429.
+            "download": StagePool("download", download_workers, download_queue, reject_status_code=429),
+            # A full embedding queue means the server is saturated: 503.
+            "embed": StagePool("embed", embed_workers, embed_queue, reject_status_code=503),
+            "search": StagePool("search", search_workers, search_queue, reject_status_code=503),
+        }
+
+    async def run(self, stage: str, fn: Callable[..., Any], *args: Any, timings: Optional[Dict[str, float]] = None) -> Any:
+        """Runs `fn(*args)` on the pool for `stage`. See StagePool.run."""
+        return await self.pools[stage].run(fn, *args, timings=timings)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {name: pool.stats() for name, pool in self.pools.items()}
+
+    def shutdown(self) -> None:
+        for pool in self.pools.values():
+            pool.shutdown()
@@ -0,0 +1,298 @@
+import itertools
+import logging
+import os
+import re
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Each process keeps its scratch files in its own '<root>/proc-<pid>-<token>' directory, so a
+# reaper can tell the directories of processes that have exited from those still in use. Request
+# directories inside it are 'req-<lease id>'. The reaper removes nothing whose name does not match.
+PROCESS_DIR_PREFIX = "proc-"
+PROCESS_DIR_PATTERN = re.compile(r"proc-(\d+)-[0-9a-f]{8}")
+REQUEST_DIR_PATTERN = re.compile(r"req-\d+")
+# Directory under /dev/shm used in RAM-backed mode.
+RAM_DIR_NAME = "resona-scratch"
+
+SCRATCH_ADMISSIONS = registry.counter("resona_scratch_admissions_total", "Scratch space reservations, by result.", ("result",))
+SCRATCH_REAPED = registry.counter("resona_scratch_reaped_total", "Orphaned scratch directories removed by the reaper.")
+SCRATCH_CLEANUP_SECONDS = registry.histogram(
+    "resona_scratch_cleanup_seconds", "Time to remove scratch files: a released request directory or one reaper pass.", ("kind",),
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0),
+)
+
+
+class ScratchSpaceFull(Exception):
+    """Raised when a reservation would take the scratch space over its quota."""
+
+    def __init__(self, requested_bytes: int, available_bytes: int, status_code: int = 503, retry_after_seconds: int = 5):
+        super().__init__(f"Scratch space is full: {requested_bytes} bytes requested, {available_bytes} available. Please retry shortly.")
+        self.requested_bytes = requested_bytes
+        self.available_bytes = available_bytes
+        self.status_code = status_code
+        self.retry_after_seconds = retry_after_seconds
+
+
+def ram_root() -> Optional[str]:
+    """The RAM-backed scratch root under /dev/shm, or None where there is no /dev/shm."""
+    return os.path.join("/dev/shm", RAM_DIR_NAME) if os.path.isdir("/dev/shm") else None
+
+
+def filesystem_type(path: str) -> Optional[str]:
+    """The type ('ext4', 'tmpfs', ...) of the filesystem holding `path`, from /proc/mounts where available."""
+    try:
+        with open("/proc/mounts") as mounts:
+            entries = [line.split()[1:3] for line in mounts if len(line.split()) >= 3]
+    except OSError:
+        return None
+    path = os.path.realpath(path)
+    best = max((m for m in entries if path == m[0] or path.startswith(m[0].rstrip("/") + "/")), key=lambda m: len(m[0]), default=None)
+    return best[1] if best else None
+
+
+def _entry_bytes(path: str) -> int:
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for directory, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(directory, name))
+            except OSError:
+                pass
+    return total
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ScratchLease:
+    """
+    A reservation of scratch bytes for one request, released exactly once.
+
+    `path` is a directory private to the lease, created on first use and removed with
+    everything in it on release.
+    """
+
+    __slots__ = ("space", "nbytes", "lease_id", "acquired_at", "_path", "_released")
+
+    def __init__(self, space: "ScratchSpace", nbytes: int, lease_id: int):
+        self.space = space
+        self.nbytes = nbytes
+        self.lease_id = lease_id
+        self.acquired_at = time.monotonic()
+        self._path: Optional[str] = None
+        self._released = False
+
+    @property
+    def path(self) -> str:
+        if self._path is None:
+            self._path = os.path.join(self.space.process_dir, f"req-{self.lease_id}")
+            os.makedirs(self._path, exist_ok=True)
+        return self._path
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        if self._path is not None:
+            start = time.perf_counter()
+            shutil.rmtree(self._path, ignore_errors=True)
+            SCRATCH_CLEANUP_SECONDS.observe(time.perf_counter() - start, kind="request")
+        self.space._release(self)
+
+    def __enter__(self) -> "ScratchLease":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.release()
+
+
+class ScratchSpace:
+    """
+    Bounded scratch storage for request bodies and intermediate audio files.
+
+    Requests reserve the bytes they may write before writing them; a reservation that would take
+    the total over `quota_bytes` is refused with ScratchSpaceFull, so a burst of large uploads is
+    turned away up front instead of filling the disk and slowing every request's I/O. Only with
+    start(redirect_tempfiles=True) does Python's default temporary directory point at this
+    process's scratch directory, so files spilled by tempfile (e.g. uploads the web framework
+    spools to disk) land under `root` and, when it is on tmpfs, in RAM.
+
+    A reaper thread removes what requests never cleaned up: directories of processes that have
+    exited, and request directories of this process that no lease holds and that have been
+    untouched for `orphan_age_seconds`. It only removes entries named as this class names them,
+    so anything else under `root` is left alone. Several processes may share `root`.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        quota_bytes: int,
+        orphan_age_seconds: float = 900.0,
+        reap_interval_seconds: float = 60.0,
+        retry_after_seconds: int = 5,
+    ):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.orphan_age_seconds = orphan_age_seconds
+        self.reap_interval_seconds = reap_interval_seconds
+        self.retry_after_seconds = retry_after_seconds
+        self.process_dir = os.path.join(root, f"{PROCESS_DIR_PREFIX}{os.getpid()}-{secrets.token_hex(4)}")
+        self._lock = threading.Lock()
+        self._lease_ids = itertools.count(1)
+        self._active: Dict[int, ScratchLease] = {}
+        self._reserved = 0
+        self._peak_reserved = 0
+        self._rejected_bytes = 0
+        self._last_reap: Dict[str, Any] = {}
+        self._stopping = threading.Event()
+        self._reaper: Optional[threading.Thread] = None
+        self._previous_tempdir: Optional[str] = None
+        self._redirected = False
+
+    def start(self, redirect_tempfiles: bool = False) -> None:
+        os.makedirs(self.process_dir, mode=0o700, exist_ok=True)
+        # Clear out what earlier runs left behind before accepting requests.
+        self.reap()
+        if redirect_tempfiles:
+            self._previous_tempdir = tempfile.tempdir
+            tempfile.tempdir = self.process_dir
+            self._redirected = True
+        if self.reap_interval_seconds > 0:
+            self._reaper = threading.Thread(target=self._reap_loop, name="resona-scratch-reaper", daemon=True)
+            self._reaper.start()
+        logger.info(f"Scratch space at {self.root} ({filesystem_type(self.root) or 'unknown filesystem'}), quota {self.quota_bytes} bytes")
+
+    def stop(self) -> None:
+        self._stopping.set()
+        if self._reaper is not None:
+            self._reaper.join(timeout=5)
+            self._reaper = None
+        if self._redirected:
+            tempfile.tempdir = self._previous_tempdir
+            self._redirected = False
+        shutil.rmtree(self.process_dir, ignore_errors=True)
+
+    def reserve(self, nbytes: int) -> ScratchLease:
+        """
+        Reserves `nbytes` of scratch space until the returned lease is released.
+
+        Raises:
+            ScratchSpaceFull: If the reservation does not fit in the quota next to those already held.
+        """
+        nbytes = max(0, int(nbytes))
+        with self._lock:
+            available = self.quota_bytes - self._reserved
+            if self.quota_bytes and nbytes > available:
+                self._rejected_bytes += nbytes
+                SCRATCH_ADMISSIONS.inc(result="rejected")
+                raise ScratchSpaceFull(nbytes, max(0, available), retry_after_seconds=self.retry_after_seconds)
+            lease = ScratchLease(self, nbytes, next(self._lease_ids))
+            self._active[lease.lease_id] = lease
+            self._reserved += nbytes
+            self._peak_reserved = max(self._peak_reserved, self._reserved)
+        SCRATCH_ADMISSIONS.inc(result="admitted")
+        return lease
+
+    def _release(self, lease: ScratchLease) -> None:
+        with self._lock:
+            if self._active.pop(lease.lease_id, None) is not None:
+                self._reserved -= lease.nbytes
+
+    def _reap_loop(self) -> None:
+        while not self._stopping.wait(self.reap_interval_seconds):
+            try:
+                self.reap()
+            except Exception as e:
+                logger.warning(f"Scratch space reaper pass failed: {e}")
+
+    def _is_orphan(self, entry: os.DirEntry, now: float) -> bool:
+        match = PROCESS_DIR_PATTERN.fullmatch(entry.name)
+        if match is not None:
+            return not _pid_alive(int(match.group(1)))
+        # A request directory of this process: its lease is gone, but give a lease reserved
+        # since the active leases were listed time to be registered before treating it as leaked.
+        return now - entry.stat(follow_symlinks=False).st_mtime > self.orphan_age_seconds
+
+    def reap(self) -> Dict[str, Any]:
+        """Removes orphaned scratch directories once and returns what was removed and what remains."""
+        start = time.perf_counter()
+        now = time.time()
+        with self._lock:
+            active_paths = {lease._path for lease in self._active.values() if lease._path is not None}
+        removed = removed_bytes = remaining_bytes = 0
+        candidates = []
+        try:
+            with os.scandir(self.root) as entries:
+                candidates += [entry for entry in entries if PROCESS_DIR_PATTERN.fullmatch(entry.name) and entry.path != self.process_dir]
+            # In this process's own directory, only request directories no lease holds anymore;
+            # anything else there belongs to code still running in this process.
+            with os.scandir(self.process_dir) as entries:
+                candidates += [entry for entry in entries if REQUEST_DIR_PATTERN.fullmatch(entry.name) and entry.path not in active_paths]
+        except FileNotFoundError:
+            pass
+        for entry in candidates:
+            path = entry.path
+            try:
+                if not entry.is_dir(follow_symlinks=False) or not self._is_orphan(entry, now):
+                    continue
+                size = _entry_bytes(path)
+                shutil.rmtree(path)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.warning(f"Could not reap scratch entry {path}: {e}")
+                continue
+            removed += 1
+            removed_bytes += size
+        # What is left: this process's directory and those of processes still running.
+        for path in [self.process_dir] + [entry.path for entry in candidates if PROCESS_DIR_PATTERN.fullmatch(entry.name)]:
+            if os.path.isdir(path):
+                remaining_bytes += _entry_bytes(path)
+        elapsed = time.perf_counter() - start
+        if removed:
+            SCRATCH_REAPED.inc(removed)
+            logger.info(f"Reaped {removed} orphaned scratch entries ({removed_bytes} bytes) in {elapsed * 1000:.1f} ms")
+        SCRATCH_CLEANUP_SECONDS.observe(elapsed, kind="reap")
+        result = {"removed": removed, "removed_bytes": removed_bytes, "file_bytes": remaining_bytes, "seconds": round(elapsed, 4), "at": now}
+        with self._lock:
+            self._last_reap = result
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            usage = shutil.disk_usage(self.root)
+            free_bytes: Optional[int] = usage.free
+        except OSError:
+            free_bytes = None
+        with self._lock:
+            return {
+                "root": self.root,
+                "filesystem": filesystem_type(self.root),
+                "quota_bytes": self.quota_bytes,
+                "reserved_bytes": self._reserved,
+                "peak_reserved_bytes": self._peak_reserved,
+                "rejected_bytes": self._rejected_bytes,
+                "active_leases": len(self._active),
+                # Bytes in scratch process directories at the last reaper pass. Spooled temporary files are unlinked
+                # on creation, so they count towards reserved_bytes but not here.
+                "file_bytes": self._last_reap.get("file_bytes", 0),
+                "filesystem_free_bytes": free_bytes,
+                "last_reap": dict(self._last_reap),
+            }
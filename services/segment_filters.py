@@ -0,0 +1,143 @@
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Older index entries only carry the segment length inside matched_features, e.g. "Duration: 20s".
+_DURATION_FEATURE = re.compile(r"^Duration:\s*([0-9.]+)\s*s$")
+
+SegmentAttributes = Tuple[str, Optional[float], Tuple[str, ...]]
+
+
+def _key(value: str) -> str:
+    return value.strip().casefold()
+
+
+def segment_attributes(metadata: Dict[str, Any]) -> SegmentAttributes:
+    """Extracts the filterable attributes (artist, duration in seconds, tags) from SegmentInfo fields."""
+    tags = tuple(str(t) for t in metadata.get("matched_features") or ())
+    duration = metadata.get("duration_seconds")
+    if duration is None:
+        for tag in tags:
+            match = _DURATION_FEATURE.match(tag)
+            if match:
+                duration = float(match.group(1))
+                break
+    return str(metadata.get("artist") or ""), (float(duration) if duration is not None else None), tags
+
+
+class SearchFilter:
+    """
+    Attribute constraints for a similarity search. Every given constraint must hold.
+
+    Artists and tags match case-insensitively. Tags are SegmentInfo.matched_features; a segment
+    must carry all of `tags`. Segments of unknown duration never match a duration bound.
+    """
+
+    __slots__ = ("artists", "exclude_artists", "tags", "min_duration_seconds", "max_duration_seconds")
+
+    def __init__(
+        self,
+        artists: Optional[Iterable[str]] = None,
+        exclude_artists: Optional[Iterable[str]] = None,
+        tags: Optional[Iterable[str]] = None,
+        min_duration_seconds: Optional[float] = None,
+        max_duration_seconds: Optional[float] = None,
+    ):
+        self.artists = [a for a in artists or () if a]
+        self.exclude_artists = [a for a in exclude_artists or () if a]
+        self.tags = [t for t in tags or () if t]
+        self.min_duration_seconds = min_duration_seconds
+        self.max_duration_seconds = max_duration_seconds
+
+    def is_empty(self) -> bool:
+        return not (self.artists or self.exclude_artists or self.tags) and self.min_duration_seconds is None and self.max_duration_seconds is None
+
+    def describe(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__ if getattr(self, name) not in (None, [])}
+
+
+class AttributeIndex:
+    """
+    Per-row attribute columns used to pre-filter vector search candidates.
+
+    Artists are dictionary-encoded into an int32 column, durations are a float32 column (NaN
+    when unknown), and each tag has a boolean row mask. A filter is evaluated with a few
+    vectorised comparisons over these columns into one candidate mask, before any vector is
+    scored, so the cost does not depend on how many results the filter removes.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._artist_codes = np.full(capacity, -1, dtype=np.int32)
+        self._durations = np.full(capacity, np.nan, dtype=np.float32)
+        self._tag_masks: Dict[str, np.ndarray] = {}
+        self._artist_ids: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _ensure_capacity(self, needed: int) -> None:
+        capacity = self._artist_codes.shape[0]
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2)
+        self._artist_codes = np.concatenate((self._artist_codes, np.full(new_capacity - capacity, -1, dtype=np.int32)))
+        self._durations = np.concatenate((self._durations, np.full(new_capacity - capacity, np.nan, dtype=np.float32)))
+        for tag, mask in self._tag_masks.items():
+            self._tag_masks[tag] = np.concatenate((mask, np.zeros(new_capacity - capacity, dtype=bool)))
+
+    def set(self, row: int, artist: str, duration_seconds: Optional[float], tags: Sequence[str]) -> None:
+        """Records the attributes of `row`, replacing any recorded before."""
+        with self._lock:
+            self._ensure_capacity(row + 1)
+            self._artist_codes[row] = self._artist_ids.setdefault(_key(artist), len(self._artist_ids))
+            self._durations[row] = np.nan if duration_seconds is None else duration_seconds
+            row_tags = {_key(t) for t in tags}
+            for tag, mask in self._tag_masks.items():
+                mask[row] = tag in row_tags
+            for tag in row_tags - self._tag_masks.keys():
+                mask = np.zeros(self._artist_codes.shape[0], dtype=bool)
+                mask[row] = True
+                self._tag_masks[tag] = mask
+
+    def mask(self, search_filter: SearchFilter, count: int) -> np.ndarray:
+        """Returns a boolean mask over rows [0, count) of the rows that satisfy `search_filter`."""
+        with self._lock:
+            self._ensure_capacity(count)
+            codes = self._artist_codes[:count]
+            mask = np.ones(count, dtype=bool)
+            if search_filter.artists:
+                wanted = [self._artist_ids[k] for k in map(_key, search_filter.artists) if k in self._artist_ids]
+                mask &= np.isin(codes, wanted)
+            if search_filter.exclude_artists:
+                unwanted = [self._artist_ids[k] for k in map(_key, search_filter.exclude_artists) if k in self._artist_ids]
+                if unwanted:
+                    mask &= ~np.isin(codes, unwanted)
+            durations = self._durations[:count]
+            # Comparisons with NaN are False, so unknown durations fail any bound.
+            if search_filter.min_duration_seconds is not None:
+                mask &= durations >= search_filter.min_duration_seconds
+            if search_filter.max_duration_seconds is not None:
+                mask &= durations <= search_filter.max_duration_seconds
+            for tag in map(_key, search_filter.tags):
+                tag_mask = self._tag_masks.get(tag)
+                if tag_mask is None:
+                    return np.zeros(count, dtype=bool)
+                mask &= tag_mask[:count]
+            return mask
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "artists": len(self._artist_ids),
+                "tags": len(self._tag_masks),
+                "bytes": int(self._artist_codes.nbytes + self._durations.nbytes + sum(m.nbytes for m in self._tag_masks.values())),
+            }
+
+
+def encode_tags(tags: Sequence[str]) -> str:
+    """Joins tags for storage in a single text column."""
+    return "\x1f".join(tags)
+
+
+def decode_tags(encoded: Optional[str]) -> List[str]:
+    return encoded.split("\x1f") if encoded else []
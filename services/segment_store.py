@@ -0,0 +1,223 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .segment_filters import SegmentAttributes, decode_tags, encode_tags, segment_attributes
+
+logger = logging.getLogger(__name__)
+
+# Rows per metadata query, below SQLite's limit on bound parameters.
+METADATA_QUERY_ROWS = 500
+# The matrix file is extended this many rows at a time (2 MB at 512 dimensions), so appends
+# rarely have to remap it.
+GROW_ROWS = 1024
+
+
+class SegmentStore:
+    """
+    On-disk, append-only store of segment embeddings and their SegmentInfo metadata.
+
+    '<path_prefix>.f32' is a headerless row-major float32 matrix. It is memory-mapped, so
+    opening the store reads nothing up front, and every process that opens it shares the same
+    page-cache pages. '<path_prefix>.sqlite3' maps row numbers to segment IDs and holds
+    metadata as JSON, which is read only for the rows a search returns. The filterable
+    attributes (artist, duration, tags) are also kept in their own columns, so an index can
+    load them without parsing every metadata document. Segments embedded with temporal
+    re-ranking also have a packed frame sketch (see temporal_embedding) in a separate table.
+
+    New segments are appended. A segment ID that is already stored has its row overwritten in
+    place. Each vector is written before its metadata row is committed, and readers only use
+    committed rows, so another process never sees a half-written row.
+    """
+
+    def __init__(self, path_prefix: str, dim: int = 512, grow_rows: int = GROW_ROWS):
+        self.path_prefix = path_prefix
+        self.matrix_path = f"{path_prefix}.f32"
+        self.db_path = f"{path_prefix}.sqlite3"
+        self.grow_rows = grow_rows
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path_prefix)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS store_info (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS segments ("
+            " row INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, metadata TEXT NOT NULL,"
+            " artist TEXT, duration_seconds REAL, tags TEXT)"
+        )
+        self._add_attribute_columns()
+        self._db.execute("CREATE TABLE IF NOT EXISTS sketches (row INTEGER PRIMARY KEY, sketch BLOB NOT NULL)")
+        self._db.execute("INSERT OR IGNORE INTO store_info (key, value) VALUES ('dim', ?)", (str(dim),))
+        stored_dim = int(self._db.execute("SELECT value FROM store_info WHERE key = 'dim'").fetchone()[0])
+        if stored_dim != dim:
+            raise ValueError(f"Segment store {path_prefix} holds {stored_dim}-dimensional vectors, not {dim}")
+        self.dim = dim
+
+        if not os.path.exists(self.matrix_path):
+            open(self.matrix_path, "ab").close()
+        self._matrix: Optional[np.memmap] = None
+        self._mapped_rows = 0
+        self._map(self.count())
+        logger.info(f"Opened segment store {path_prefix} with {self.count()} segments")
+
+    def _add_attribute_columns(self) -> None:
+        # Stores created before filtered search have no attribute columns; add and backfill them.
+        columns = {info[1] for info in self._db.execute("PRAGMA table_info(segments)")}
+        if "artist" in columns:
+            return
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            for column in ("artist TEXT", "duration_seconds REAL", "tags TEXT"):
+                self._db.execute(f"ALTER TABLE segments ADD COLUMN {column}")
+            for row, metadata in self._db.execute("SELECT row, metadata FROM segments").fetchall():
+                artist, duration, tags = segment_attributes(json.loads(metadata))
+                self._db.execute("UPDATE segments SET artist = ?, duration_seconds = ?, tags = ? WHERE row = ?", (artist, duration, encode_tags(tags), row))
+            self._db.execute("COMMIT")
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+
+    def _map(self, min_rows: int) -> None:
+        row_bytes = self.dim * 4
+        file_rows = os.path.getsize(self.matrix_path) // row_bytes
+        if file_rows < min_rows:
+            file_rows = -(-min_rows // self.grow_rows) * self.grow_rows
+            with open(self.matrix_path, "r+b") as f:
+                f.truncate(file_rows * row_bytes)
+        if file_rows == self._mapped_rows:
+            return
+        if self._matrix is not None:
+            self._matrix.flush()
+        self._matrix = np.memmap(self.matrix_path, dtype=np.float32, mode="r+", shape=(file_rows, self.dim)) if file_rows else None
+        self._mapped_rows = file_rows
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """The mapped matrix. Only the first count() rows hold stored segments."""
+        with self._lock:
+            if self._matrix is None:
+                return np.zeros((0, self.dim), dtype=np.float32)
+            return self._matrix
+
+    def count(self) -> int:
+        row = self._db.execute("SELECT MAX(row) FROM segments").fetchone()[0]
+        return 0 if row is None else row + 1
+
+    def rows_since(self, first_row: int) -> List[Tuple[int, str, SegmentAttributes]]:
+        """Returns (row, segment_id, (artist, duration_seconds, tags)) for every committed row numbered `first_row` or higher, in row order."""
+        rows = self._db.execute("SELECT row, id, artist, duration_seconds, tags FROM segments WHERE row >= ? ORDER BY row", (first_row,)).fetchall()
+        if rows:
+            with self._lock:
+                # Another process may have grown the file past our mapping.
+                self._map(rows[-1][0] + 1)
+        return [(row, segment_id, (artist or "", duration, tuple(decode_tags(tags)))) for row, segment_id, artist, duration, tags in rows]
+
+    def upsert(
+        self,
+        segment_ids: Sequence[str],
+        vectors: np.ndarray,
+        metadatas: Sequence[Dict[str, Any]],
+        sketches: Optional[Sequence[Optional[bytes]]] = None,
+    ) -> List[Tuple[int, bool]]:
+        """
+        Stores segments, appending new IDs and overwriting the rows of known ones.
+
+        Args:
+            segment_ids: Segment IDs.
+            vectors: Array of shape (len(segment_ids), dim), stored as given.
+            metadatas: JSON-serialisable SegmentInfo fields per segment.
+            sketches: Optional packed frame sketch per segment. None leaves a segment's stored sketch as it is.
+
+        Returns:
+            (row, is_new) for each segment.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(segment_ids), self.dim)
+        results: List[Tuple[int, bool]] = []
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so row numbers are allocated once across processes.
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                next_row = self.count()
+                assigned: Dict[str, int] = {}
+                for segment_id in segment_ids:
+                    existing = assigned.get(segment_id)
+                    if existing is None:
+                        found = self._db.execute("SELECT row FROM segments WHERE id = ?", (segment_id,)).fetchone()
+                        existing = found[0] if found is not None else None
+                    if existing is None:
+                        results.append((next_row, True))
+                        assigned[segment_id] = next_row
+                        next_row += 1
+                    else:
+                        results.append((existing, False))
+                self._map(next_row)
+                for (row, _), vector in zip(results, vectors):
+                    self._matrix[row] = vector
+                records = []
+                for (row, _), segment_id, metadata in zip(results, segment_ids, metadatas):
+                    artist, duration, tags = segment_attributes(metadata)
+                    records.append((row, segment_id, json.dumps(metadata), artist, duration, encode_tags(tags)))
+                self._db.executemany(
+                    "INSERT INTO segments (row, id, metadata, artist, duration_seconds, tags) VALUES (?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT(id) DO UPDATE SET metadata = excluded.metadata, artist = excluded.artist,"
+                    " duration_seconds = excluded.duration_seconds, tags = excluded.tags",
+                    records,
+                )
+                if sketches is not None:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO sketches (row, sketch) VALUES (?, ?)",
+                        [(row, sketch) for (row, _), sketch in zip(results, sketches) if sketch is not None],
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return results
+
+    def metadata(self, rows: Sequence[int]) -> List[Dict[str, Any]]:
+        """Returns the stored metadata for each row in `rows`, in the same order."""
+        rows = [int(r) for r in rows]
+        found: Dict[int, str] = {}
+        for offset in range(0, len(rows), METADATA_QUERY_ROWS):
+            chunk = rows[offset:offset + METADATA_QUERY_ROWS]
+            placeholders = ",".join("?" * len(chunk))
+            found.update(self._db.execute(f"SELECT row, metadata FROM segments WHERE row IN ({placeholders})", chunk).fetchall())
+        return [json.loads(found[r]) if r in found else {} for r in rows]
+
+    def sketches(self, rows: Sequence[int]) -> List[Optional[bytes]]:
+        """Returns the packed frame sketch of each row in `rows`, or None for rows without one."""
+        rows = [int(r) for r in rows]
+        found: Dict[int, bytes] = {}
+        for offset in range(0, len(rows), METADATA_QUERY_ROWS):
+            chunk = rows[offset:offset + METADATA_QUERY_ROWS]
+            placeholders = ",".join("?" * len(chunk))
+            found.update(self._db.execute(f"SELECT row, sketch FROM sketches WHERE row IN ({placeholders})", chunk).fetchall())
+        return [found.get(r) for r in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path_prefix,
+            "segments": self.count(),
+            "sketches": self._db.execute("SELECT COUNT(*) FROM sketches").fetchone()[0],
+            "mapped_rows": self._mapped_rows,
+            "matrix_file_bytes": os.path.getsize(self.matrix_path),
+        }
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._matrix is not None:
+                self._matrix.flush()
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            self._matrix = None
+            self._db.close()
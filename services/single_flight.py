@@ -0,0 +1,93 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Listener = Callable[[Any], None]
+
+
+class _Flight:
+    __slots__ = ("task", "listeners", "last_event")
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.listeners: List[Listener] = []
+        self.last_event: Any = None
+
+    def notify(self, event: Any) -> None:
+        self.last_event = event
+        for listener in list(self.listeners):
+            try:
+                listener(event)
+            except Exception as e:
+                logger.warning(f"Single-flight listener failed on {event!r}: {e}")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent async calls that share a key into a single execution.
+
+    The first caller for a key starts the work as its own task; callers arriving while it is
+    still running await the same task instead of starting another. Every caller gets the same
+    result or the same exception. The work is shielded from each caller's cancellation, so one
+    client going away does not fail the others. Once the work finishes the key is released: later
+    callers start fresh (repeat calls are expected to be answered by a cache in front of this).
+
+    The work is started as factory(notify). Progress events it passes to notify (e.g. the stage
+    it has reached) go to the `listener` of every caller sharing it, not only the first; a caller
+    that joins late is sent the latest event straight away.
+    """
+
+    def __init__(self, name: str = "single-flight"):
+        self.name = name
+        self._in_flight: Dict[Hashable, _Flight] = {}
+        self._counters = {"executions": 0, "coalesced": 0, "failures": 0}
+
+    def _release(self, key: Hashable, flight: _Flight) -> None:
+        if self._in_flight.get(key) is flight:
+            del self._in_flight[key]
+        if flight.task.cancelled():
+            return
+        # Retrieve the exception so asyncio does not log it as never retrieved when no caller is left.
+        if flight.task.exception() is not None:
+            self._counters["failures"] += 1
+
+    async def run(
+        self, key: Hashable, factory: Callable[[Listener], Awaitable[Any]], listener: Optional[Listener] = None
+    ) -> Tuple[Any, bool]:
+        """
+        Returns (result, coalesced). `factory` is only called if no call for `key` is in flight;
+        `coalesced` is True when this caller shared another caller's execution. `listener`
+        receives the progress events of the execution until it finishes.
+        """
+        flight = self._in_flight.get(key)
+        coalesced = flight is not None
+        if flight is None:
+            flight = _Flight()
+            flight.task = asyncio.ensure_future(factory(flight.notify))
+            self._in_flight[key] = flight
+            flight.task.add_done_callback(lambda t: self._release(key, flight))
+            self._counters["executions"] += 1
+        else:
+            # Counted in stats(); logging each one would be one line per request for a popular key.
+            self._counters["coalesced"] += 1
+            logger.debug(f"{self.name}: coalesced request for {key} onto the call already in flight")
+        if listener is None:
+            return await asyncio.shield(flight.task), coalesced
+        if flight.last_event is not None:
+            listener(flight.last_event)
+        flight.listeners.append(listener)
+        try:
+            return await asyncio.shield(flight.task), coalesced
+        finally:
+            flight.listeners.remove(listener)
+
+    def stats(self) -> Dict[str, Any]:
+        requests = self._counters["executions"] + self._counters["coalesced"]
+        return {
+            **self._counters,
+            "requests": requests,
+            "coalesced_rate": round(self._counters["coalesced"] / requests, 4) if requests else 0.0,
+            "in_flight": len(self._in_flight),
+        }
@@ -0,0 +1,154 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# OpenL3's default hop between one-second frames.
+FRAME_HOP_SECONDS = 0.1
+# Frame embeddings are averaged into bins of this length for the stored sketch: 20 bins of 512
+# int8 values (~10 KB) for a 20-second segment, against 200 float32 frames (400 KB) unpooled.
+SKETCH_HOP_SECONDS = 1.0
+# Longer clips are pooled into wider bins so a sketch never exceeds this many rows.
+MAX_SKETCH_FRAMES = 120
+# An alignment must overlap at least this fraction of the shorter of the two sketches.
+MIN_ALIGNMENT_OVERLAP = 0.5
+# Weight of the alignment score against the pooled cosine similarity in re-ranked scores.
+DEFAULT_RERANK_WEIGHT = 0.5
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _bin_means(frames: np.ndarray, bins: int) -> np.ndarray:
+    """Means of `frames` over `bins` consecutive, near-equal runs of rows."""
+    edges = np.linspace(0, frames.shape[0], bins + 1).round().astype(np.int64)
+    sums = np.add.reduceat(frames, edges[:-1], axis=0)
+    return sums / np.diff(edges)[:, None]
+
+
+class TemporalEmbedding:
+    """
+    Frame-level OpenL3 embeddings of one clip, pooled at two time scales.
+
+    - `mean`: the clip-level vector, identical to what the single-vector pipeline returns. It is
+      what the similarity index retrieves candidates with.
+    - `sketch`: L2-normalised means of SKETCH_HOP_SECONDS bins, the compact frame sequence kept
+      for re-ranking (see alignment_scores).
+    """
+
+    __slots__ = ("mean", "sketch", "frame_count")
+
+    def __init__(
+        self,
+        frames: np.ndarray,
+        hop_seconds: float = FRAME_HOP_SECONDS,
+        sketch_hop_seconds: float = SKETCH_HOP_SECONDS,
+        max_sketch_frames: int = MAX_SKETCH_FRAMES,
+    ):
+        frames = np.asarray(frames, dtype=np.float32)
+        if frames.ndim != 2 or frames.shape[0] == 0:
+            raise ValueError(f"Expected a non-empty (frames, dim) array, got shape {frames.shape}")
+        self.frame_count = frames.shape[0]
+        self.mean = frames.mean(axis=0)
+        frames_per_bin = max(1, int(round(sketch_hop_seconds / hop_seconds)))
+        bins = min(max_sketch_frames, -(-self.frame_count // frames_per_bin))
+        self.sketch = _normalize_rows(_bin_means(frames, bins)).astype(np.float32)
+
+
+# --- Sketch storage ---
+# A packed sketch is its row count (uint32), one float32 scale per row, then the rows quantised
+# to int8 with those scales.
+
+def pack_sketch(sketch: np.ndarray) -> bytes:
+    sketch = np.asarray(sketch, dtype=np.float32)
+    peaks = np.abs(sketch).max(axis=1)
+    scales = np.where(peaks > 0, peaks / 127.0, 1.0).astype(np.float32)
+    quantised = np.clip(np.rint(sketch / scales[:, None]), -127, 127).astype(np.int8)
+    header = np.array([sketch.shape[0]], dtype="<u4").tobytes()
+    return header + scales.astype("<f4").tobytes() + quantised.tobytes()
+
+
+def unpack_sketch(packed: bytes, dim: int) -> np.ndarray:
+    rows = int(np.frombuffer(packed, dtype="<u4", count=1)[0])
+    scales = np.frombuffer(packed, dtype="<f4", count=rows, offset=4)
+    quantised = np.frombuffer(packed, dtype=np.int8, count=rows * dim, offset=4 + 4 * rows).reshape(rows, dim)
+    return quantised.astype(np.float32) * scales[:, None]
+
+
+# --- Re-ranking ---
+
+def alignment_scores(query: np.ndarray, candidates: Sequence[np.ndarray], min_overlap: float = MIN_ALIGNMENT_OVERLAP) -> np.ndarray:
+    """
+    Scores how well each candidate's frame sequence lines up with the query's.
+
+    For every relative shift of the two sketches, the cosine similarities of the frames that
+    overlap are averaged; a candidate's score is its best shift. Unlike the pooled mean, this
+    rewards segments whose frames match in the same order and spacing. All candidates and
+    shifts are scored together: one batched matrix product gives every frame pair, and a
+    strided view lines each shift's diagonal up as a column to sum.
+
+    Args:
+        query: Query sketch, shape (query_frames, dim), rows L2-normalised.
+        candidates: Candidate sketches, each (frames, dim), rows L2-normalised.
+        min_overlap: Shifts overlapping less than this fraction of the shorter sketch are not considered.
+
+    Returns:
+        One score in [-1, 1] per candidate.
+    """
+    if not candidates:
+        return np.zeros(0, dtype=np.float32)
+    query_frames = query.shape[0]
+    lengths = np.array([c.shape[0] for c in candidates], dtype=np.int64)
+    # Zero padding contributes nothing to the diagonal sums below.
+    stacked = np.zeros((len(candidates), int(lengths.max()), query.shape[1]), dtype=np.float32)
+    for i, candidate in enumerate(candidates):
+        stacked[i, :candidate.shape[0]] = candidate
+    candidate_frames = stacked.shape[1]
+    # Pad both sides of the candidate axis so every shift stays in bounds.
+    padded = np.zeros((len(candidates), query_frames, candidate_frames + 2 * (query_frames - 1)), dtype=np.float32)
+    padded[:, :, query_frames - 1:query_frames - 1 + candidate_frames] = np.matmul(stacked, query.T).transpose(0, 2, 1)
+    # Query frame q aligns with candidate frame q + shift, for shift in [-(query_frames - 1), candidate_frames).
+    shifts = np.arange(-(query_frames - 1), candidate_frames)
+    c_stride, q_stride, t_stride = padded.strides
+    by_shift = np.lib.stride_tricks.as_strided(padded, (len(candidates), query_frames, shifts.size), (c_stride, q_stride + t_stride, t_stride), writeable=False)
+    sums = by_shift.sum(axis=1)
+
+    overlap = np.minimum(query_frames, lengths[:, None] - shifts[None, :]) - np.maximum(0, -shifts)[None, :]
+    required = np.maximum(1, np.ceil(min_overlap * np.minimum(lengths, query_frames)))[:, None]
+    scores = np.where(overlap >= required, sums / np.maximum(overlap, 1), -np.inf)
+    best = scores.max(axis=1)
+    # A candidate too short to meet the overlap at any shift keeps no alignment evidence.
+    return np.where(np.isfinite(best), best, 0.0).astype(np.float32)
+
+
+def rerank(
+    query_sketch: np.ndarray,
+    hits: Sequence[Tuple[str, float, Dict]],
+    sketches: Sequence[Optional[np.ndarray]],
+    k: int,
+    weight: float = DEFAULT_RERANK_WEIGHT,
+) -> List[Tuple[str, float, Dict]]:
+    """
+    Re-orders coarse search hits by pooled similarity blended with frame alignment.
+
+    Args:
+        query_sketch: TemporalEmbedding.sketch of the query.
+        hits: (segment_id, cosine_similarity, metadata) from VectorIndex.search.
+        sketches: The stored sketch of each hit, or None where the segment has none.
+        k: Number of hits to return.
+        weight: Share of the alignment score in the final score.
+
+    Returns:
+        The best k hits, rescored as (1 - weight) * cosine + weight * alignment. Hits without a
+        sketch keep their cosine similarity.
+    """
+    with_sketch = [i for i, sketch in enumerate(sketches) if sketch is not None]
+    scores = [score for _, score, _ in hits]
+    if with_sketch:
+        aligned = alignment_scores(query_sketch, [sketches[i] for i in with_sketch])
+        for i, alignment in zip(with_sketch, aligned):
+            scores[i] = (1.0 - weight) * scores[i] + weight * float(alignment)
+    order = sorted(range(len(hits)), key=lambda i: scores[i], reverse=True)[:k]
+    return [(hits[i][0], scores[i], hits[i][2]) for i in order]
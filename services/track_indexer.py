@@ -0,0 +1,287 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+
+from .audio_processor import CACHE_KEY_PARAMS, EMBEDDING_PARAMS
+from .embedding_cache import EmbeddingCache, youtube_cache_key
+from .temporal_embedding import TemporalEmbedding
+from .vector_index import VectorIndex
+from .youtube_service import (
+    SEGMENT_SECONDS,
+    download_youtube_track,
+    format_segment_display_time,
+    plan_track_segments,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT_PATH = os.path.join("cache", "index_checkpoint.txt")
+DEFAULT_INDEX_PATH = os.environ.get("RESONA_VECTOR_INDEX_PATH", os.path.join("cache", "segment_index"))
+DEFAULT_CACHE_PATH = os.environ.get("RESONA_EMBEDDING_CACHE_PATH", os.path.join("cache", "embeddings.sqlite3"))
+# Windows embedded per process-pool task. They share one audio slice, so overlapping windows are
+# pickled once per task instead of once per window.
+WINDOWS_PER_TASK = 4
+# Tracks downloaded ahead of the one being embedded. Bounds memory to a few decoded tracks.
+DOWNLOAD_PREFETCH = 2
+
+Window = Tuple[int, int]
+
+
+# --- Worker process ---
+
+def _init_worker(intra_op_threads: int) -> None:
+    # Each worker owns one model; cap TensorFlow's thread pool so workers don't oversubscribe the CPU.
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    from .model_registry import get_model
+    get_model(EMBEDDING_PARAMS["input_repr"], EMBEDDING_PARAMS["content_type"], EMBEDDING_PARAMS["embedding_size"])
+
+
+def _embed_windows(
+    audio: np.ndarray, sample_rate: int, slice_start: int, windows: Sequence[Window], temporal: bool = False
+) -> List[Optional[Union[np.ndarray, TemporalEmbedding]]]:
+    """Embeds each window of `audio`, a slice of the track starting at `slice_start` seconds."""
+    from .audio_processor import process_audio_segment
+    embeddings = []
+    for start, end in windows:
+        offset = (start - slice_start) * sample_rate
+        embeddings.append(process_audio_segment(audio[offset:offset + (end - start) * sample_rate], sample_rate, None, temporal))
+    return embeddings
+
+
+# --- Checkpoint ---
+
+def read_checkpoint(path: str) -> Set[str]:
+    """Returns the video IDs recorded in a checkpoint file (yt-dlp download-archive format: 'youtube <id>')."""
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {parts[1] for parts in (line.split() for line in f) if len(parts) == 2 and parts[0] == "youtube"}
+
+
+def _append_checkpoint(path: str, video_ids: Iterable[str]) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "a") as f:
+        for video_id in video_ids:
+            f.write(f"youtube {video_id}\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# --- Job ---
+
+class TrackIndexer:
+    """
+    Indexes every overlapping window of whole YouTube tracks into the similarity index.
+
+    Each track is downloaded once (on a small thread pool, a couple of tracks ahead), cut into
+    windows locally and embedded on a process pool with one OpenL3 model per process. Segment IDs,
+    index metadata and embedding-cache entries use the same format as /api/analyze-segment, so an
+    indexed window is found by similarity search and served from the cache when requested directly.
+
+    Progress is checkpointed per track. A track is recorded in the checkpoint only after the
+    stored vectors of its windows have been flushed, so an interrupted job resumes without losing
+    or duplicating work. Windows are appended to the same on-disk segment store the API searches,
+    so it can run while the API is serving; the API picks up new segments without a restart.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        window_seconds: int = SEGMENT_SECONDS,
+        hop_seconds: int = SEGMENT_SECONDS // 2,
+        checkpoint_path: str = DEFAULT_CHECKPOINT_PATH,
+        index_path: str = DEFAULT_INDEX_PATH,
+        cache_path: Optional[str] = DEFAULT_CACHE_PATH,
+        save_every_tracks: int = 10,
+        max_track_seconds: Optional[int] = None,
+        sketches: bool = False,
+    ):
+        self.workers = workers or os.cpu_count() or 1
+        self.window_seconds = window_seconds
+        self.hop_seconds = hop_seconds
+        self.checkpoint_path = checkpoint_path
+        self.index_path = index_path
+        self.save_every_tracks = max(1, save_every_tracks)
+        self.max_track_seconds = max_track_seconds
+        # Also store each window's frame sketch, for the API's RESONA_TEMPORAL_RERANK mode.
+        self.sketches = sketches
+        # Segments are appended to the shared segment store as each track finishes, so a running
+        # API picks them up without a restart.
+        self.index = VectorIndex.open_store(index_path, dim=EMBEDDING_PARAMS["embedding_size"], mode="exact")
+        self.cache = EmbeddingCache(db_path=cache_path) if cache_path else None
+
+    def _submit_track(self, pool: ProcessPoolExecutor, track: Dict[str, Any], windows: List[Window]) -> List[Tuple[List[Window], Future]]:
+        audio, sample_rate = track["audio"], track["sample_rate"]
+        tasks = []
+        for i in range(0, len(windows), WINDOWS_PER_TASK):
+            group = windows[i:i + WINDOWS_PER_TASK]
+            slice_start, slice_end = group[0][0], group[-1][1]
+            audio_slice = audio[slice_start * sample_rate:slice_end * sample_rate]
+            tasks.append((group, pool.submit(_embed_windows, audio_slice, sample_rate, slice_start, group, self.sketches)))
+        return tasks
+
+    def _store_track(
+        self, video_id: str, track: Dict[str, Any], results: List[Tuple[Window, Optional[Union[np.ndarray, TemporalEmbedding]]]]
+    ) -> int:
+        segment_ids, embeddings, metadatas, sketches = [], [], [], []
+        for (start, end), embedding in results:
+            if embedding is None:
+                continue
+            if isinstance(embedding, TemporalEmbedding):
+                sketches.append(embedding.sketch)
+                embedding = embedding.mean
+            segment_id = f"yt_{video_id}_{start}_{end}"
+            display_time = format_segment_display_time(start, end)
+            segment_ids.append(segment_id)
+            embeddings.append(embedding)
+            metadatas.append({
+                "id": segment_id,
+                "title": track["title"],
+                "artist": track["artist"],
+                "youtube_link": track["original_url"],
+                "thumbnail_url": track["thumbnail_url"],
+                "segment_display_time": display_time,
+                "duration_seconds": end - start,
+                "matched_features": ["YouTube Segment", f"Duration: {end - start}s"],
+            })
+            if self.cache is not None:
+                self.cache.put(youtube_cache_key(video_id, start, end, CACHE_KEY_PARAMS), embedding, {
+                    "title": track["title"],
+                    "artist": track["artist"],
+                    "album": track["album"],
+                    "thumbnail_url": track["thumbnail_url"],
+                    "original_url": track["original_url"],
+                    "duration_seconds": end - start,
+                    "segment_display_time": display_time,
+                })
+        if segment_ids:
+            self.index.add_batch(segment_ids, np.vstack(embeddings), metadatas, sketches or None)
+        return len(segment_ids)
+
+    def _save(self, completed: List[str]) -> None:
+        # Flush the stored vectors before checkpointing, so a checkpointed track is never lost.
+        self.index.store.flush()
+        if completed:
+            _append_checkpoint(self.checkpoint_path, completed)
+            completed.clear()
+
+    def run(self, video_ids: Sequence[str]) -> Dict[str, Any]:
+        """
+        Indexes every video in `video_ids` not already in the checkpoint.
+
+        Returns:
+            A summary with track and segment counts, failed video IDs, elapsed seconds and segments per second.
+        """
+        done = read_checkpoint(self.checkpoint_path)
+        unique_ids = list(dict.fromkeys(video_ids))
+        pending = [v for v in unique_ids if v not in done]
+        logger.info(f"Indexing {len(pending)} tracks ({len(unique_ids) - len(pending)} already in checkpoint) with {self.workers} worker processes")
+
+        summary: Dict[str, Any] = {"tracks_indexed": 0, "segments_indexed": 0, "tracks_skipped": len(unique_ids) - len(pending), "failed": {}}
+        job_start = time.perf_counter()
+        completed: List[str] = []
+        intra_op_threads = max(1, (os.cpu_count() or 1) // self.workers)
+        # spawn, not fork: TensorFlow is not fork-safe once initialised.
+        context = multiprocessing.get_context("spawn")
+
+        with ProcessPoolExecutor(self.workers, mp_context=context, initializer=_init_worker, initargs=(intra_op_threads,)) as pool, \
+                ThreadPoolExecutor(DOWNLOAD_PREFETCH, thread_name_prefix="resona-index-download") as downloads:
+            download_futures: Dict[int, Future] = {}
+
+            def _prefetch(upto: int) -> None:
+                for j in range(upto, min(upto + DOWNLOAD_PREFETCH + 1, len(pending))):
+                    if j not in download_futures:
+                        download_futures[j] = downloads.submit(download_youtube_track, pending[j], self.max_track_seconds)
+
+            for i, video_id in enumerate(pending):
+                _prefetch(i)
+                track_start = time.perf_counter()
+                try:
+                    track = download_futures.pop(i).result()
+                    windows = plan_track_segments(track["track_seconds"], self.window_seconds, self.hop_seconds)
+                    tasks = self._submit_track(pool, track, windows)
+                    results = [(window, embedding) for group, future in tasks for window, embedding in zip(group, future.result())]
+                    del track["audio"]
+                    stored = self._store_track(video_id, track, results)
+                except Exception as e:
+                    logger.error(f"Failed to index {video_id}: {e}", exc_info=True)
+                    summary["failed"][video_id] = str(e)
+                    continue
+
+                elapsed = time.perf_counter() - track_start
+                summary["tracks_indexed"] += 1
+                summary["segments_indexed"] += stored
+                completed.append(video_id)
+                total_elapsed = time.perf_counter() - job_start
+                logger.info(
+                    f"[{i + 1}/{len(pending)}] Indexed {stored}/{len(windows)} segments of {video_id} in {elapsed:.1f}s "
+                    f"({stored / elapsed if elapsed else 0.0:.2f} segments/s; job {summary['segments_indexed'] / total_elapsed:.2f} segments/s)"
+                )
+                if len(completed) >= self.save_every_tracks:
+                    self._save(completed)
+
+        self._save(completed)
+        self.index.store.close()
+        if self.cache is not None:
+            self.cache.close()
+        summary["elapsed_seconds"] = round(time.perf_counter() - job_start, 2)
+        summary["segments_per_second"] = round(summary["segments_indexed"] / summary["elapsed_seconds"], 3) if summary["elapsed_seconds"] else 0.0
+        summary["index_size"] = len(self.index)
+        return summary
+
+
+def _read_video_ids(args: argparse.Namespace) -> List[str]:
+    video_ids = list(args.video_ids)
+    if args.ids_file:
+        with open(args.ids_file) as f:
+            video_ids += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    return video_ids
+
+
+if __name__ == '__main__':
+    # Usage: python -m services.track_indexer VIDEO_ID [VIDEO_ID ...] [--ids-file ids.txt] [--workers N]
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Index every window of whole YouTube tracks into the similarity index.")
+    parser.add_argument("video_ids", nargs="*", help="YouTube video IDs to index.")
+    parser.add_argument("--ids-file", help="File with one video ID per line.")
+    parser.add_argument("--workers", type=int, default=None, help="Embedding processes (default: CPU count).")
+    parser.add_argument("--window", type=int, default=SEGMENT_SECONDS, help="Window length in seconds.")
+    parser.add_argument("--hop", type=int, default=SEGMENT_SECONDS // 2, help="Seconds between window starts.")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT_PATH, help="Checkpoint file of completed video IDs.")
+    parser.add_argument("--index-path", default=DEFAULT_INDEX_PATH, help="Similarity index path prefix.")
+    parser.add_argument("--no-cache", action="store_true", help="Do not write window embeddings to the embedding cache.")
+    parser.add_argument("--save-every", type=int, default=10, help="Save the index and checkpoint every N tracks.")
+    parser.add_argument("--max-track-seconds", type=int, default=None, help="Only index the first N seconds of each track.")
+    parser.add_argument("--sketches", action="store_true", help="Also store frame sketches for temporal re-ranking (RESONA_TEMPORAL_RERANK).")
+    args = parser.parse_args()
+
+    ids = _read_video_ids(args)
+    if not ids:
+        parser.error("no video IDs given")
+    indexer = TrackIndexer(
+        workers=args.workers,
+        window_seconds=args.window,
+        hop_seconds=args.hop,
+        checkpoint_path=args.checkpoint,
+        index_path=args.index_path,
+        cache_path=None if args.no_cache else DEFAULT_CACHE_PATH,
+        save_every_tracks=args.save_every,
+        max_track_seconds=args.max_track_seconds,
+        sketches=args.sketches,
+    )
+    result = indexer.run(ids)
+    print(f"Indexed {result['segments_indexed']} segments from {result['tracks_indexed']} tracks in {result['elapsed_seconds']}s "
+          f"({result['segments_per_second']} segments/s); {result['tracks_skipped']} skipped, {len(result['failed'])} failed. "
+          f"Index now holds {result['index_size']} segments.")
+    for video_id, error in result["failed"].items():
+        print(f"  {video_id}: {error}")
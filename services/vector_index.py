@@ -0,0 +1,486 @@
+import json
+import logging
+import os
+import threading
+import time
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .metrics import span
+from .segment_filters import AttributeIndex, SearchFilter, segment_attributes
+from .segment_store import SegmentStore
+from .temporal_embedding import pack_sketch, unpack_sketch
+
+logger = logging.getLogger(__name__)
+
+# In "auto" mode the index switches from exact brute force to IVF once it holds this many vectors.
+AUTO_IVF_THRESHOLD = 100_000
+# Query-time lists scanned in IVF mode. Higher is slower but closer to exact recall.
+DEFAULT_NPROBE = 16
+# Rows scored per matrix product when scanning or assigning, to bound temporary memory.
+SCAN_CHUNK_ROWS = 65_536
+# A filtered IVF search scans the matching rows exactly instead when no more than this many match:
+# that is about the work of probing the lists, and recall is perfect.
+FILTERED_EXACT_MAX_ROWS = 20_000
+# With a shared SegmentStore, searches check for rows appended by other processes at most this often.
+STORE_REFRESH_SECONDS = 1.0
+
+SearchResult = Tuple[str, float, Dict[str, Any]]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, without fully sorting `scores`."""
+    if k >= scores.shape[0]:
+        return np.argsort(-scores)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+
+class VectorIndex:
+    """
+    In-process cosine-similarity index over segment embeddings and their SegmentInfo metadata.
+
+    Vectors are L2-normalised on insert and kept in one contiguous float32 matrix, so cosine
+    similarity is a single matrix-vector product. Two search modes are available:
+
+    - "exact": brute-force scan of every vector. Always correct; cost grows linearly.
+    - "ivf": inverted-file index. Vectors are clustered with spherical k-means into `nlist`
+      lists; a query scans only the `nprobe` lists whose centroids are closest. Vectors added
+      after training are assigned to their nearest list, so the index never needs a full rebuild
+      for inserts. It is retrained automatically once the catalogue has grown 4x since training.
+      Training does not hold the index lock, so other searches carry on (scanning exactly
+      until the first training has finished).
+    - "auto": exact below AUTO_IVF_THRESHOLD vectors, IVF above it.
+
+    Searches can take a SearchFilter (artist, duration, tags). Candidates are pre-filtered with
+    an AttributeIndex mask before any vector is scored, so filtered searches cost about the
+    same as unfiltered ones and still return k results when k segments match.
+
+    Segments can carry a frame sketch (TemporalEmbedding.sketch) for re-ranking search results;
+    sketches are kept int8-packed and are persisted only with a store, not by save().
+
+    With a `store`, the matrix is the store's memory-mapped file instead of process memory,
+    metadata is read from the store only for returned results, and adds are persisted as they
+    happen. Rows appended to the same store by other processes are picked up incrementally
+    (assigned to IVF lists like local adds) before searches.
+    """
+
+    def __init__(
+        self,
+        dim: int = 512,
+        mode: str = "auto",
+        nlist: Optional[int] = None,
+        nprobe: int = DEFAULT_NPROBE,
+        initial_capacity: int = 1024,
+        store: Optional[SegmentStore] = None,
+    ):
+        if mode not in ("exact", "ivf", "auto"):
+            raise ValueError(f"Unknown vector index mode: {mode}")
+        if store is not None and store.dim != dim:
+            raise ValueError(f"Segment store holds {store.dim}-dimensional vectors, not {dim}")
+        self.dim = dim
+        self.mode = mode
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self._vectors = np.zeros((initial_capacity, dim), dtype=np.float32)
+        self._count = 0
+        self._ids: List[str] = []
+        self._metadata: List[Dict[str, Any]] = []
+        self._sketches: Dict[int, bytes] = {}
+        self._row_by_id: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        # IVF state. Each inverted list is an int64 array('q') of row numbers, viewed as NumPy at query time.
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: List[array] = []
+        self._trained_count = 0
+        self._training = False
+        # Bumped whenever a stored vector is replaced, so a training run that started before
+        # the replacement knows its lists may be stale.
+        self._ivf_generation = 0
+        self._attributes = AttributeIndex(initial_capacity)
+        self._store = store
+        self._refreshed_at = 0.0
+        if store is not None:
+            self._vectors = store.matrix
+            self.refresh()
+
+    def __len__(self) -> int:
+        return self._count
+
+    # --- Writes ---
+
+    def _ensure_capacity(self, needed: int) -> None:
+        if self._store is not None:
+            return
+        capacity = self._vectors.shape[0]
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2)
+        grown = np.zeros((new_capacity, self.dim), dtype=np.float32)
+        grown[:self._count] = self._vectors[:self._count]
+        self._vectors = grown
+
+    def add(
+        self, segment_id: str, embedding: Sequence[float], metadata: Optional[Dict[str, Any]] = None, sketch: Optional[np.ndarray] = None
+    ) -> int:
+        """Adds or replaces one segment. Returns its row number."""
+        sketches = [sketch] if sketch is not None else None
+        return self.add_batch([segment_id], np.asarray(embedding, dtype=np.float32).reshape(1, -1), [metadata or {}], sketches)[0]
+
+    def add_batch(
+        self,
+        segment_ids: Sequence[str],
+        embeddings: np.ndarray,
+        metadatas: Optional[Sequence[Dict[str, Any]]] = None,
+        sketches: Optional[Sequence[Optional[np.ndarray]]] = None,
+    ) -> List[int]:
+        """
+        Adds or replaces many segments at once.
+
+        Args:
+            segment_ids: Unique segment IDs. An ID already in the index has its vector and metadata replaced.
+            embeddings: Array of shape (len(segment_ids), dim).
+            metadatas: Optional SegmentInfo fields per segment (without the embedding).
+            sketches: Optional frame sketch per segment, of shape (frames, dim), or None for none.
+
+        Returns:
+            The row number of each segment.
+        """
+        embeddings = _normalize(np.asarray(embeddings, dtype=np.float32).reshape(len(segment_ids), self.dim))
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in segment_ids]
+        packed = [pack_sketch(s) if s is not None else None for s in sketches] if sketches is not None else None
+        rows: List[int] = []
+        if self._store is not None:
+            with self._lock:
+                stored = self._store.upsert(segment_ids, embeddings, metadatas, packed)
+                if not all(is_new for _, is_new in stored):
+                    self._invalidate_ivf()
+                # Also picks up anything other processes appended since the last refresh.
+                self._refresh_locked()
+                for (row, _), metadata in zip(stored, metadatas):
+                    self._attributes.set(row, *segment_attributes(metadata))
+            return [row for row, _ in stored]
+        with self._lock:
+            self._ensure_capacity(self._count + len(segment_ids))
+            new_rows: List[int] = []
+            for segment_id, vector, metadata in zip(segment_ids, embeddings, metadatas):
+                row = self._row_by_id.get(segment_id)
+                if row is None:
+                    row = self._count
+                    self._count += 1
+                    self._ids.append(segment_id)
+                    self._metadata.append(dict(metadata))
+                    self._row_by_id[segment_id] = row
+                    new_rows.append(row)
+                else:
+                    self._metadata[row] = dict(metadata)
+                    self._invalidate_ivf()
+                self._vectors[row] = vector
+                self._attributes.set(row, *segment_attributes(metadata))
+                rows.append(row)
+            if packed is not None:
+                self._sketches.update((row, sketch) for row, sketch in zip(rows, packed) if sketch is not None)
+            if self._centroids is not None and new_rows:
+                self._assign_to_lists(np.asarray(new_rows, dtype=np.int64))
+        return rows
+
+    def sketches(self, segment_ids: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Returns the frame sketch stored for each segment, or None for unknown segments and segments without one."""
+        with self._lock:
+            rows = [self._row_by_id.get(segment_id) for segment_id in segment_ids]
+            known = [row for row in rows if row is not None]
+            if self._store is not None:
+                found = dict(zip(known, self._store.sketches(known)))
+            else:
+                found = {row: self._sketches.get(row) for row in known}
+        return [unpack_sketch(found[row], self.dim) if row is not None and found[row] is not None else None for row in rows]
+
+    @property
+    def store(self) -> Optional[SegmentStore]:
+        return self._store
+
+    def refresh(self) -> int:
+        """Picks up rows appended to the store (by this or another process). Returns how many were added."""
+        if self._store is None:
+            return 0
+        with self._lock:
+            return self._refresh_locked()
+
+    def _refresh_locked(self) -> int:
+        new_rows = self._store.rows_since(self._count)
+        self._refreshed_at = time.monotonic()
+        self._vectors = self._store.matrix
+        if not new_rows:
+            return 0
+        for row, segment_id, attributes in new_rows:
+            self._ids.append(segment_id)
+            self._row_by_id[segment_id] = row
+            self._attributes.set(row, *attributes)
+        first_new = self._count
+        self._count = new_rows[-1][0] + 1
+        if self._centroids is not None:
+            self._assign_to_lists(np.arange(first_new, self._count, dtype=np.int64))
+        return len(new_rows)
+
+    # --- IVF ---
+
+    def _default_nlist(self) -> int:
+        return self.nlist or max(1, int(np.sqrt(self._count)))
+
+    def _invalidate_ivf(self) -> None:
+        # Replacing a vector could move it to another IVF list; retrain lazily rather than track it.
+        self._centroids = None
+        self._ivf_generation += 1
+
+    def train(self, iterations: int = 10, sample_size: Optional[int] = None, seed: int = 0) -> None:
+        """
+        (Re)builds the IVF lists with spherical k-means over a sample of the stored vectors.
+
+        k-means runs on the rows present when training starts, without holding the index lock;
+        the new lists are swapped in at the end, and rows added meanwhile are assigned to them
+        then. Does nothing if another thread is already training.
+        """
+        with self._lock:
+            count = self._count
+            if count == 0 or self._training:
+                return
+            self._training = True
+            # Rows below `count` are only ever overwritten by replacements, which bump the generation.
+            vectors = self._vectors
+            generation = self._ivf_generation
+            nlist = min(self._default_nlist(), count)
+        try:
+            start = time.perf_counter()
+            centroids, lists = self._build_lists(vectors, count, nlist, iterations, sample_size, seed)
+            elapsed = time.perf_counter() - start
+        except BaseException:
+            with self._lock:
+                self._training = False
+            raise
+        with self._lock:
+            self._training = False
+            if self._ivf_generation != generation:
+                logger.info("Discarding IVF training run: segments were replaced while it ran")
+                return
+            self._centroids = centroids
+            self._lists = lists
+            self._trained_count = count
+            if self._count > count:
+                self._assign_to_lists(np.arange(count, self._count, dtype=np.int64))
+        logger.info(f"Trained IVF index: {count} vectors, {nlist} lists in {elapsed:.2f}s")
+
+    @classmethod
+    def _build_lists(
+        cls, vectors: np.ndarray, count: int, nlist: int, iterations: int, sample_size: Optional[int], seed: int
+    ) -> Tuple[np.ndarray, List[array]]:
+        """Clusters rows [0, count) of `vectors` into `nlist` lists. Returns the centroids and the lists."""
+        rng = np.random.default_rng(seed)
+        sample_size = min(count, sample_size or max(32 * nlist, 10_000))
+        sample = vectors[rng.choice(count, size=sample_size, replace=False)] if sample_size < count else vectors[:count]
+        centroids = sample[rng.choice(sample.shape[0], size=nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignment = cls._nearest_centroid(sample, centroids)
+            # Per-cluster sums via one sort + reduceat, which is far faster than np.add.at.
+            order = np.argsort(assignment, kind="stable")
+            counts = np.bincount(assignment, minlength=nlist)
+            sums = np.zeros_like(centroids)
+            present = np.flatnonzero(counts)
+            sums[present] = np.add.reduceat(sample[order], np.concatenate(([0], np.cumsum(counts[present])[:-1])), axis=0)
+            empty = counts == 0
+            # Re-seed empty clusters from random sample points so every list stays useful.
+            if empty.any():
+                sums[empty] = sample[rng.choice(sample.shape[0], size=int(empty.sum()))]
+            centroids = _normalize(sums)
+
+        centroids = centroids.astype(np.float32)
+        lists = [array("q") for _ in range(nlist)]
+        cls._fill_lists(lists, vectors, np.arange(count, dtype=np.int64), centroids)
+        return centroids, lists
+
+    @staticmethod
+    def _nearest_centroid(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        assignment = np.empty(vectors.shape[0], dtype=np.int64)
+        for offset in range(0, vectors.shape[0], SCAN_CHUNK_ROWS):
+            chunk = vectors[offset:offset + SCAN_CHUNK_ROWS]
+            assignment[offset:offset + chunk.shape[0]] = np.argmax(chunk @ centroids.T, axis=1)
+        return assignment
+
+    def _assign_to_lists(self, rows: np.ndarray) -> None:
+        self._fill_lists(self._lists, self._vectors, rows, self._centroids)
+
+    @classmethod
+    def _fill_lists(cls, lists: List[array], vectors: np.ndarray, rows: np.ndarray, centroids: np.ndarray) -> None:
+        assignment = np.concatenate([
+            cls._nearest_centroid(vectors[rows[offset:offset + SCAN_CHUNK_ROWS]], centroids)
+            for offset in range(0, rows.shape[0], SCAN_CHUNK_ROWS)
+        ])
+        # Group rows by list with one sort instead of one boolean mask per list.
+        order = np.argsort(assignment, kind="stable")
+        sorted_lists = assignment[order]
+        sorted_rows = rows[order]
+        boundaries = np.flatnonzero(np.diff(sorted_lists)) + 1
+        starts = np.concatenate(([0], boundaries))
+        for start, list_rows in zip(starts, np.split(sorted_rows, boundaries)):
+            if list_rows.size:
+                lists[int(sorted_lists[start])].extend(list_rows.tolist())
+
+    def _wants_ivf(self) -> bool:
+        if self.mode == "exact":
+            return False
+        return self.mode == "ivf" or self._count >= AUTO_IVF_THRESHOLD
+
+    def _needs_training(self) -> bool:
+        with self._lock:
+            stale = self._centroids is None or self._count > 4 * self._trained_count
+            return self._wants_ivf() and stale and not self._training and self._count > 0
+
+    def _use_ivf(self) -> bool:
+        # Until the first training run has finished, searches scan exactly.
+        return self._wants_ivf() and self._centroids is not None
+
+    # --- Queries ---
+
+    def search(
+        self,
+        query: Sequence[float],
+        k: int = 10,
+        exclude_ids: Iterable[str] = (),
+        nprobe: Optional[int] = None,
+        search_filter: Optional[SearchFilter] = None,
+    ) -> List[SearchResult]:
+        """
+        Returns the top-k most cosine-similar segments to `query`.
+
+        Args:
+            query: Query embedding of length `dim`.
+            k: Number of results to return.
+            exclude_ids: Segment IDs to leave out of the results (e.g. the query segment itself).
+            nprobe: IVF lists to scan; defaults to the index's nprobe. Ignored in exact mode. A
+                filtered search probes more lists if the first ones hold too few matching rows.
+            search_filter: Attribute constraints every result must satisfy.
+
+        Returns:
+            A list of (segment_id, cosine_similarity, metadata) tuples, most similar first.
+        """
+        excluded = set(exclude_ids)
+        q = _normalize(np.asarray(query, dtype=np.float32).reshape(-1))
+        if self._needs_training():
+            self.train()
+        with span("vector_search"), self._lock:
+            if self._store is not None and time.monotonic() - self._refreshed_at > STORE_REFRESH_SECONDS:
+                self._refresh_locked()
+            if self._count == 0 or k <= 0:
+                return []
+            want = k + len(excluded)
+            mask: Optional[np.ndarray] = None
+            matching = self._count
+            if search_filter is not None and not search_filter.is_empty():
+                mask = self._attributes.mask(search_filter, self._count)
+                matching = int(np.count_nonzero(mask))
+                if matching == 0:
+                    return []
+            if (mask is None or matching > FILTERED_EXACT_MAX_ROWS) and self._use_ivf():
+                hits = self._search_ivf(q, want, nprobe or self.nprobe, mask)
+            elif mask is not None and matching <= self._count // 2:
+                # Selective filter: score only the matching rows.
+                candidate_rows = np.flatnonzero(mask)
+                scores = self._vectors[candidate_rows] @ q
+                best = _top_k(scores, want)
+                hits = [(int(candidate_rows[i]), float(scores[i])) for i in best]
+            else:
+                scores = self._vectors[:self._count] @ q
+                if mask is not None:
+                    scores[~mask] = -np.inf
+                best = _top_k(scores, min(want, matching))
+                hits = [(int(i), float(scores[i])) for i in best]
+
+            hits = [(row, score) for row, score in hits if self._ids[row] not in excluded][:k]
+            if self._store is not None:
+                metadatas = self._store.metadata([row for row, _ in hits])
+            else:
+                metadatas = [dict(self._metadata[row]) for row, _ in hits]
+            return [(self._ids[row], score, metadata) for (row, score), metadata in zip(hits, metadatas)]
+
+    def _search_ivf(self, q: np.ndarray, want: int, nprobe: int, mask: Optional[np.ndarray]) -> List[Tuple[int, float]]:
+        list_scores = self._centroids @ q
+        probe = min(nprobe, len(self._lists))
+        while True:
+            closest_lists = _top_k(list_scores, probe)
+            candidate_rows = np.concatenate([np.frombuffer(self._lists[i], dtype=np.int64) for i in closest_lists])
+            if mask is not None:
+                candidate_rows = candidate_rows[mask[candidate_rows]]
+            # Widen the probe until the filter leaves enough candidates (or every list is scanned).
+            if mask is None or candidate_rows.size >= want or probe >= len(self._lists):
+                break
+            probe = min(probe * 2, len(self._lists))
+        if candidate_rows.size == 0:
+            return []
+        scores = self._vectors[candidate_rows] @ q
+        best = _top_k(scores, want)
+        return [(int(candidate_rows[i]), float(scores[i])) for i in best]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "vectors": self._count,
+                "dim": self.dim,
+                "ivf_trained": self._centroids is not None,
+                "ivf_lists": len(self._lists) if self._centroids is not None else 0,
+                "nprobe": self.nprobe,
+                "matrix_bytes": int(self._vectors.nbytes),
+                "attributes": self._attributes.stats(),
+                **({"sketches": len(self._sketches)} if self._store is None else {}),
+                **({"store": self._store.stats()} if self._store is not None else {}),
+            }
+
+    # --- Persistence ---
+
+    def save(self, path_prefix: str) -> None:
+        """Writes vectors to '<path_prefix>.npy' and IDs/metadata to '<path_prefix>.json'."""
+        with self._lock:
+            metadata = self._store.metadata(range(self._count)) if self._store is not None else self._metadata
+            directory = os.path.dirname(path_prefix)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            np.save(f"{path_prefix}.npy", self._vectors[:self._count])
+            with open(f"{path_prefix}.json", "w") as f:
+                json.dump({"ids": self._ids, "metadata": metadata}, f)
+        logger.info(f"Saved vector index with {self._count} vectors to {path_prefix}")
+
+    @classmethod
+    def open_store(cls, path_prefix: str, dim: int = 512, **kwargs: Any) -> "VectorIndex":
+        """
+        Opens (or creates) the SegmentStore at `path_prefix` and returns an index backed by it.
+
+        If the store is empty and a snapshot written by save() exists at the same prefix, the
+        snapshot is imported once. Extra keyword arguments are passed to the constructor.
+        """
+        index = cls(dim=dim, store=SegmentStore(path_prefix, dim=dim), **kwargs)
+        if len(index) == 0 and os.path.exists(f"{path_prefix}.npy"):
+            with open(f"{path_prefix}.json") as f:
+                saved = json.load(f)
+            index.add_batch(saved["ids"], np.load(f"{path_prefix}.npy"), saved["metadata"])
+            logger.info(f"Imported {len(index)} segments from the {path_prefix}.npy snapshot into the segment store")
+        return index
+
+    @classmethod
+    def load(cls, path_prefix: str, **kwargs: Any) -> "VectorIndex":
+        """Loads an index written by save(). Extra keyword arguments are passed to the constructor."""
+        vectors = np.load(f"{path_prefix}.npy")
+        with open(f"{path_prefix}.json") as f:
+            saved = json.load(f)
+        index = cls(dim=vectors.shape[1], initial_capacity=max(1024, vectors.shape[0]), **kwargs)
+        if vectors.shape[0]:
+            index.add_batch(saved["ids"], vectors, saved["metadata"])
+        logger.info(f"Loaded vector index with {len(index)} vectors from {path_prefix}")
+        return index
@@ -3,11 +3,45 @@ import os
 import re
 from urllib.parse import urlparse, parse_qs
 import logging
-from typing import Tuple, Optional, Dict, Any
+from typing import Callable, Tuple, Optional, Dict, Any, List
+
+import numpy as np
+
+from .audio_decoding import ffmpeg_decode, AudioDecodeError
+from .metrics import BYTES_FETCHED, span
+from .ytdlp_session import ExtractedStream, StreamInfoCache, YtDlpSession
 
 TEMP_AUDIO_DIR = "temp_audio" # Should align with main.py or be passed as config
 
-logging.basicConfig(level=logging.INFO)
+# How segments are fetched:
+#   "ranged" - ffmpeg seeks into the remote stream before decoding, so only the bytes covering
+#              [start, end) are transferred. This is the default.
+#   "full"   - the stream is read from the beginning and decoded up to the segment end. Kept as a
+#              fallback for formats where remote seeking is unreliable.
+SEGMENT_FETCH_MODE = os.environ.get("RESONA_SEGMENT_FETCH_MODE", "ranged")
+
+# Segments are decoded straight to the embedder's input format: 48 kHz mono float32 PCM.
+SEGMENT_SAMPLE_RATE = 48000
+SEGMENT_CHANNELS = 1
+
+# Length of one analysed segment. parse_youtube_url caps user-selected segments at this length and
+# whole-track indexing cuts tracks into windows of this length.
+SEGMENT_SECONDS = 20
+
+# yt-dlp extraction. Extractor instances are reused (see YtDlpSession), and resolved stream URLs
+# and track metadata are cached per video ID for YTDLP_INFO_TTL_SECONDS (0 disables the cache),
+# so further windows of a recently seen video skip extraction. See StreamInfoCache.
+YTDLP_INFO_TTL_SECONDS = float(os.environ.get("RESONA_YTDLP_INFO_TTL_SECONDS", "1800"))
+YTDLP_INFO_CACHE_ENTRIES = int(os.environ.get("RESONA_YTDLP_INFO_CACHE_ENTRIES", "2048"))
+YDL_OPTIONS = {
+    # Prefer plain HTTP(S) audio so ffmpeg can seek it with range requests.
+    'format': 'bestaudio[protocol^=http]/bestaudio/best',
+    'quiet': False,
+    'no_warnings': False,
+    'noprogress': True,
+    'noplaylist': True, # Ensures only single video is downloaded if URL accidentally points to a playlist
+}
+
 logger = logging.getLogger(__name__)
 
 def parse_time_to_seconds(time_str: Optional[str]) -> Optional[int]:
@@ -54,8 +88,8 @@ def parse_youtube_url(url_string: str) -> Tuple[str, int, int]:
     if "end" in query_params: # Using 'end' as a custom parameter for end time
         end_seconds_user = parse_time_to_seconds(query_params["end"][0])
 
-    MAX_DURATION = 20
-    DEFAULT_DURATION = 20
+    MAX_DURATION = SEGMENT_SECONDS
+    DEFAULT_DURATION = SEGMENT_SECONDS
 
     start_seconds = 0
     end_seconds = DEFAULT_DURATION
@@ -101,93 +135,103 @@ def parse_youtube_url(url_string: str) -> Tuple[str, int, int]:
 
     return video_id, start_seconds, end_seconds
 
-def download_youtube_segment(video_id: str, start_seconds: int, end_seconds: int, output_dir: str = TEMP_AUDIO_DIR) -> Dict[str, Any]:
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # Sanitize video_id to prevent directory traversal or command injection issues
-    safe_video_id = re.sub(r'[^a-zA-Z0-9_\-]', '', video_id)
-    # Further safeguard against excessively long names, though yt-dlp might truncate anyway
-    safe_video_id = safe_video_id[:50] 
+def plan_track_segments(track_seconds: float, window_seconds: int = SEGMENT_SECONDS, hop_seconds: int = SEGMENT_SECONDS // 2) -> List[Tuple[int, int]]:
+    """
+    Splits a track into overlapping (start_seconds, end_seconds) windows for indexing.
+
+    Windows use whole seconds, like parse_youtube_url, so a window's segment ID and cache key are
+    the same as those of a user request for that range. A final partial window is kept if it is
+    at least half a window long; a track shorter than one window yields a single window.
+    """
+    whole_seconds = int(track_seconds)
+    if whole_seconds <= 0:
+        return []
+    if whole_seconds <= window_seconds:
+        return [(0, whole_seconds)]
+    windows = []
+    start = 0
+    while start + window_seconds <= whole_seconds:
+        windows.append((start, start + window_seconds))
+        start += hop_seconds
+    if whole_seconds - windows[-1][1] >= window_seconds // 2 and start < whole_seconds:
+        windows.append((start, whole_seconds))
+    return windows
+
+def format_segment_display_time(start_seconds: int, end_seconds: int) -> str:
+    return f"{start_seconds//60:02d}:{start_seconds%60:02d} - {end_seconds//60:02d}:{end_seconds%60:02d}"
+
+def _select_stream(info_dict: Dict[str, Any]) -> Tuple[str, Dict[str, str]]:
+    """Returns the media URL and HTTP headers of the format yt-dlp selected for `info_dict`."""
+    if info_dict.get("url"):
+        return info_dict["url"], info_dict.get("http_headers") or {}
+    for fmt in info_dict.get("requested_formats") or []:
+        if fmt.get("url") and fmt.get("acodec") not in (None, "none"):
+            return fmt["url"], fmt.get("http_headers") or {}
+    raise ValueError("yt-dlp did not resolve a playable audio stream URL.")
 
-    output_template = os.path.join(output_dir, f"{safe_video_id}_segment.%(ext)s")
+def download_youtube_segment(video_id: str, start_seconds: int, end_seconds: int, fetch_mode: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Fetches one segment of a YouTube video's audio straight into memory.
+
+    yt-dlp only resolves metadata and the audio stream URL; ffmpeg then reads the stream and
+    writes 48 kHz mono float32 PCM to a pipe. Nothing is written to disk, so concurrent requests
+    for the same video cannot collide on file names.
+
+    Returns:
+        Segment metadata plus 'audio' (float32 NumPy array), 'sample_rate' and 'bytes_fetched'.
+    """
+    fetch_mode = fetch_mode or SEGMENT_FETCH_MODE
+    if fetch_mode not in ("ranged", "full"):
+        raise ValueError(f"Unknown segment fetch mode: {fetch_mode}")
 
     segment_duration = end_seconds - start_seconds
     if segment_duration <= 0:
         logger.warning(f"Segment duration for {video_id} is {segment_duration}s (start: {start_seconds}, end: {end_seconds}). FFmpeg requires positive duration. Setting to 1s.")
         segment_duration = 1 # Prevent FFmpeg error with -t 0 or negative
 
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'outtmpl': output_template,
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }],
-        'postprocessor_args': [
-            '-ss', str(start_seconds),
-            '-t', str(segment_duration)
-        ],
-        'quiet': False, 
-        'no_warnings': False,
-        'noprogress': True,
-        'noplaylist': True, # Ensures only single video is downloaded if URL accidentally points to a playlist
-    }
-
-    downloaded_file_path = None
     video_info: Dict[str, Any] = {}
 
+    def fetch(stream_url: str, header_args: List[str]) -> Tuple[np.ndarray, Dict[str, Any]]:
+        if fetch_mode == "ranged":
+            # Input seeking: ffmpeg jumps into the remote stream with range requests, so only
+            # the bytes covering [start, end) are transferred.
+            pre_input_args = header_args + ['-ss', str(start_seconds)]
+        else:
+            # Output seeking: the stream is read from the beginning and decoded up to the segment.
+            pre_input_args = header_args
+        post_input_args = (['-ss', str(start_seconds)] if fetch_mode == "full" else []) + ['-t', str(segment_duration)]
+        with span("ffmpeg_fetch_decode"):
+            return ffmpeg_decode(
+                stream_url,
+                pre_input_args=pre_input_args,
+                post_input_args=post_input_args,
+                sample_rate=SEGMENT_SAMPLE_RATE,
+                channels=SEGMENT_CHANNELS,
+            )
+
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            logger.info(f"Attempting to download segment for {video_id} from {start_seconds}s to {end_seconds}s (duration: {segment_duration}s)")
-            info_dict = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=True)
-            
-            # Construct the expected filename. yt-dlp replaces the original extension with .mp3.
-            # We need to find which file was actually created.
-            # A simple way is to list files and find the one matching the video_id pattern if ydl.prepare_filename is tricky.
-            
-            # Try to get the filename from info_dict if possible, otherwise scan the directory
-            # This assumes yt-dlp has finished writing the file.
-            # The exact filename after postprocessing can be tricky.
-            # We'll assume the base name is `safe_video_id}_segment` and extension is `mp3`.
-            downloaded_file_path = os.path.join(output_dir, f"{safe_video_id}_segment.mp3")
-            
-            if not os.path.exists(downloaded_file_path):
-                logger.warning(f"Expected file {downloaded_file_path} not found after download attempt. Trying to find it by scanning directory...")
-                found_files = [f for f in os.listdir(output_dir) if safe_video_id in f and f.endswith(".mp3")]
-                if found_files:
-                    downloaded_file_path = os.path.join(output_dir, found_files[0])
-                    logger.info(f"Found file by scanning: {downloaded_file_path}")
-                else:
-                    logger.error(f"Could not find the downloaded MP3 segment for {safe_video_id} in {output_dir}")
-                    raise FileNotFoundError(f"Downloaded MP3 segment for {safe_video_id} not found.")
-
-            video_info = {
-                "file_path": downloaded_file_path,
-                "title": info_dict.get('title', "Unknown Title"),
-                "artist": info_dict.get('artist') or info_dict.get('uploader') or "Unknown Artist",
-                "album": info_dict.get('album', "Unknown Album"),
-                "thumbnail_url": info_dict.get('thumbnail'),
-                "original_url": f"https://www.youtube.com/watch?v={video_id}",
-                "duration_seconds": segment_duration, 
-                "start_time_seconds": start_seconds,
-                "end_time_seconds": end_seconds,
-                "segment_display_time": f"{start_seconds//60:02d}:{start_seconds%60:02d} - {end_seconds//60:02d}:{end_seconds%60:02d}"
-            }
-            logger.info(f"Successfully processed segment: {video_info.get('title')}, saved to {video_info.get('file_path')}")
+        logger.debug(f"Attempting to fetch segment for {video_id} from {start_seconds}s to {end_seconds}s (duration: {segment_duration}s, mode: {fetch_mode})")
+        info_dict, audio, decode_stats, info_cached = _fetch_from_stream(video_id, fetch)
+        BYTES_FETCHED.inc(decode_stats["bytes_read"])
+
+        video_info = {
+            "audio": audio,
+            "sample_rate": SEGMENT_SAMPLE_RATE,
+            **_track_metadata(info_dict, video_id),
+            "duration_seconds": segment_duration, 
+            "start_time_seconds": start_seconds,
+            "end_time_seconds": end_seconds,
+            "segment_display_time": format_segment_display_time(start_seconds, end_seconds),
+            "fetch_mode": fetch_mode,
+            "bytes_fetched": decode_stats["bytes_read"],
+            "info_cached": info_cached,
+        }
+        logger.debug(f"Successfully fetched segment: {video_info.get('title')}, {audio.shape[0]} samples ({decode_stats['bytes_read']} bytes fetched, {fetch_mode})")
 
     except yt_dlp.utils.DownloadError as e:
-        logger.error(f"yt-dlp DownloadError for video ID {video_id}: {str(e)}")
-        error_str = str(e).lower()
-        if "video is unavailable" in error_str or \
-           "private video" in error_str or \
-           "премьера" in error_str or \
-           "this video is private" in error_str or \
-           "members-only content" in error_str:
-            raise ValueError(f"The video (ID: {video_id}) is unavailable, private, a premiere, or members-only.") from e
-        raise # Re-raise other download errors
-    except FileNotFoundError as e:
-        logger.error(f"File not found error during segment processing for {video_id}: {str(e)}")
+        _raise_download_error(video_id, e)
+    except AudioDecodeError as e:
+        logger.error(f"Could not decode audio segment for {video_id}: {str(e)}")
         raise
     except Exception as e:
         logger.error(f"An unexpected error occurred in download_youtube_segment for video ID {video_id}: {str(e)}")
@@ -195,7 +239,107 @@ def download_youtube_segment(video_id: str, start_seconds: int, end_seconds: int
 
     return video_info
 
+def download_youtube_track(video_id: str, max_seconds: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Fetches a video's whole audio track (or its first `max_seconds`) into memory in one pass.
+
+    Used for whole-track indexing, where every window of the track is needed and one sequential
+    read is cheaper than a ranged fetch per window.
+
+    Returns:
+        Track metadata plus 'audio' (float32 NumPy array), 'sample_rate', 'track_seconds' and 'bytes_fetched'.
+    """
+    try:
+        logger.info(f"Attempting to fetch full track for {video_id}" + (f" (first {max_seconds}s)" if max_seconds else ""))
+
+        def fetch(stream_url: str, header_args: List[str]) -> Tuple[np.ndarray, Dict[str, Any]]:
+            with span("ffmpeg_fetch_track"):
+                return ffmpeg_decode(
+                    stream_url,
+                    pre_input_args=header_args,
+                    post_input_args=['-t', str(max_seconds)] if max_seconds else [],
+                    sample_rate=SEGMENT_SAMPLE_RATE,
+                    channels=SEGMENT_CHANNELS,
+                    timeout=None,
+                )
+
+        info_dict, audio, decode_stats, _ = _fetch_from_stream(video_id, fetch)
+        BYTES_FETCHED.inc(decode_stats["bytes_read"])
+    except yt_dlp.utils.DownloadError as e:
+        _raise_download_error(video_id, e)
+    except AudioDecodeError as e:
+        logger.error(f"Could not decode audio track for {video_id}: {str(e)}")
+        raise
+
+    track_info = {
+        "audio": audio,
+        "sample_rate": SEGMENT_SAMPLE_RATE,
+        **_track_metadata(info_dict, video_id),
+        "track_seconds": audio.shape[0] / SEGMENT_SAMPLE_RATE,
+        "bytes_fetched": decode_stats["bytes_read"],
+    }
+    logger.info(f"Successfully fetched track: {track_info['title']}, {track_info['track_seconds']:.1f}s ({decode_stats['bytes_read']} bytes fetched)")
+    return track_info
+
+def _extract_stream(video_id: str) -> ExtractedStream:
+    """Runs yt-dlp metadata extraction and returns (info_dict, stream_url, http_headers)."""
+    with span("ytdlp_extract"):
+        info_dict = ytdlp_session.extract_info(f"https://www.youtube.com/watch?v={video_id}")
+    stream_url, http_headers = _select_stream(info_dict)
+    return info_dict, stream_url, http_headers
+
+ytdlp_session = YtDlpSession(YDL_OPTIONS)
+stream_info_cache = StreamInfoCache(_extract_stream, ttl_seconds=YTDLP_INFO_TTL_SECONDS, max_entries=YTDLP_INFO_CACHE_ENTRIES)
+
+def _fetch_from_stream(
+    video_id: str, fetch: Callable[[str, List[str]], Tuple[np.ndarray, Dict[str, Any]]]
+) -> Tuple[Dict[str, Any], np.ndarray, Dict[str, Any], bool]:
+    """
+    Resolves the audio stream of `video_id` (from stream_info_cache when possible) and calls
+    fetch(stream_url, ffmpeg header args) on it.
+
+    Returns:
+        (info_dict, audio, decode_stats, info_cached).
+    """
+    stream, cached = stream_info_cache.get(video_id)
+    try:
+        audio, decode_stats = fetch(stream.stream_url, _header_args(stream.http_headers))
+    except AudioDecodeError:
+        if not cached:
+            raise
+        # The cached stream URL may have expired or been revoked early; extract again once.
+        logger.info(f"Cached stream for {video_id} failed to decode; resolving it again")
+        stream_info_cache.invalidate(video_id)
+        stream, cached = stream_info_cache.get(video_id)
+        audio, decode_stats = fetch(stream.stream_url, _header_args(stream.http_headers))
+    return stream.info, audio, decode_stats, cached
+
+def _header_args(http_headers: Dict[str, str]) -> List[str]:
+    return ['-headers', "".join(f"{k}: {v}\r\n" for k, v in http_headers.items())] if http_headers else []
+
+def _track_metadata(info_dict: Dict[str, Any], video_id: str) -> Dict[str, Any]:
+    return {
+        "title": info_dict.get('title', "Unknown Title"),
+        "artist": info_dict.get('artist') or info_dict.get('uploader') or "Unknown Artist",
+        "album": info_dict.get('album', "Unknown Album"),
+        "thumbnail_url": info_dict.get('thumbnail'),
+        "original_url": f"https://www.youtube.com/watch?v={video_id}",
+    }
+
+def _raise_download_error(video_id: str, e: Exception) -> None:
+    """Maps yt-dlp errors for unavailable videos to ValueError (a 400 in the API) and re-raises the rest."""
+    logger.error(f"yt-dlp DownloadError for video ID {video_id}: {str(e)}")
+    error_str = str(e).lower()
+    if "video is unavailable" in error_str or \
+       "private video" in error_str or \
+       "премьера" in error_str or \
+       "this video is private" in error_str or \
+       "members-only content" in error_str:
+        raise ValueError(f"The video (ID: {video_id}) is unavailable, private, a premiere, or members-only.") from e
+    raise e # Re-raise other download errors
+
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
     # --- Test functions ---
     test_urls = [
         ("https://www.youtube.com/watch?v=dQw4w9WgXcQ", "Standard, 0-20s"),
@@ -223,15 +367,9 @@ if __name__ == '__main__':
                 download_info = download_youtube_segment(vid_id, start, end)
                 if download_info:
                     print(f"  Successfully processed: {download_info['title']}")
-                    print(f"  File at: {download_info['file_path']}")
+                    print(f"  Samples: {download_info['audio'].shape[0]} at {download_info['sample_rate']} Hz")
+                    print(f"  Bytes fetched: {download_info['bytes_fetched']} ({download_info['fetch_mode']})")
                     print(f"  Segment: {download_info['segment_display_time']}")
-                    # Clean up test file (optional - good for testing)
-                    try:
-                        if os.path.exists(download_info['file_path']):
-                           os.remove(download_info['file_path'])
-                           print(f"  Cleaned up: {download_info['file_path']}")
-                    except Exception as e_clean:
-                       print(f"  Error cleaning up {download_info['file_path']}: {e_clean}")
                 else:
                     print(f"  Failed to process {name} (no download info returned).")
             except ValueError as ve:
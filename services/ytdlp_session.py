@@ -0,0 +1,175 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import yt_dlp
+
+logger = logging.getLogger(__name__)
+
+# A cached stream URL is dropped this long before the expiry time YouTube embeds in it, so
+# ffmpeg never starts reading a URL that runs out mid-segment.
+URL_EXPIRY_MARGIN_SECONDS = 300
+# info_dict fields kept in the cache: what _track_metadata reads, plus the duration.
+CACHED_INFO_FIELDS = ("title", "artist", "uploader", "album", "thumbnail", "duration")
+
+# (info_dict, stream_url, http_headers), as resolved by one extraction.
+ExtractedStream = Tuple[Dict[str, Any], str, Dict[str, str]]
+
+
+class YtDlpSession:
+    """
+    Reusable yt-dlp extractor state.
+
+    Creating a YoutubeDL loads its extractors and configuration, and each instance keeps what it
+    has learned (player JavaScript, signature functions, cookies) for later extractions. One
+    instance is kept per thread, since YoutubeDL is not safe to share between threads and the
+    download pool calls in from several.
+    """
+
+    def __init__(self, options: Dict[str, Any], factory: Callable[[Dict[str, Any]], Any] = yt_dlp.YoutubeDL):
+        self.options = options
+        self.factory = factory
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._instances = 0
+        self._extractions = 0
+
+    def extract_info(self, url: str) -> Dict[str, Any]:
+        ydl = getattr(self._local, "ydl", None)
+        if ydl is None:
+            ydl = self.factory(self.options)
+            self._local.ydl = ydl
+            with self._lock:
+                self._instances += 1
+        with self._lock:
+            self._extractions += 1
+        return ydl.extract_info(url, download=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"instances": self._instances, "extractions": self._extractions}
+
+
+class CachedStream:
+    __slots__ = ("info", "stream_url", "http_headers", "expires_at")
+
+    def __init__(self, info: Dict[str, Any], stream_url: str, http_headers: Dict[str, str], expires_at: float):
+        self.info = info
+        self.stream_url = stream_url
+        self.http_headers = http_headers
+        self.expires_at = expires_at
+
+
+def _url_expiry(stream_url: str) -> Optional[float]:
+    """The Unix time a googlevideo stream URL stops working, from its 'expire' parameter, if present."""
+    try:
+        return float(parse_qs(urlparse(stream_url).query)["expire"][0])
+    except (KeyError, ValueError, IndexError):
+        return None
+
+
+class StreamInfoCache:
+    """
+    TTL cache of resolved audio streams and track metadata, keyed by video ID.
+
+    A hit skips yt-dlp extraction (player page fetch and format resolution) entirely, so a second
+    window of a recently analysed video goes straight to fetching audio. Entries expire after
+    `ttl_seconds` or shortly before the stream URL itself does, whichever is sooner; at most
+    `max_entries` are kept, least recently used evicted first. Concurrent misses for the same
+    video share one extraction. Callers that find a cached URL no longer works call invalidate().
+    """
+
+    def __init__(self, extract: Callable[[str], ExtractedStream], ttl_seconds: float = 1800.0, max_entries: int = 2048):
+        self.extract = extract
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, CachedStream]" = OrderedDict()
+        self._in_flight: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "invalidations": 0, "shared_extractions": 0}
+        self._extract_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0 and self.max_entries > 0
+
+    def _lookup(self, video_id: str) -> Optional[CachedStream]:
+        # Caller holds self._lock.
+        entry = self._entries.get(video_id)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.time():
+            del self._entries[video_id]
+            self._counters["expired"] += 1
+            return None
+        self._entries.move_to_end(video_id)
+        return entry
+
+    def get(self, video_id: str) -> Tuple[CachedStream, bool]:
+        """Returns (stream, hit): the cached stream for `video_id`, or a freshly extracted one."""
+        while self.enabled:
+            with self._lock:
+                entry = self._lookup(video_id)
+                if entry is not None:
+                    self._counters["hits"] += 1
+                    return entry, True
+                pending = self._in_flight.get(video_id)
+                if pending is None:
+                    self._in_flight[video_id] = threading.Event()
+                    break
+                self._counters["shared_extractions"] += 1
+            # Another thread is extracting this video; use its result (or extract ourselves if it failed).
+            pending.wait()
+        try:
+            return self._extract(video_id), False
+        finally:
+            if self.enabled:
+                with self._lock:
+                    self._in_flight.pop(video_id).set()
+
+    def _extract(self, video_id: str) -> CachedStream:
+        start = time.perf_counter()
+        info_dict, stream_url, http_headers = self.extract(video_id)
+        elapsed = time.perf_counter() - start
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        url_expiry = _url_expiry(stream_url)
+        if url_expiry is not None:
+            expires_at = min(expires_at, url_expiry - URL_EXPIRY_MARGIN_SECONDS)
+        # Absent fields stay absent, so readers' .get() defaults apply to cached info as to fresh.
+        entry = CachedStream({k: info_dict[k] for k in CACHED_INFO_FIELDS if k in info_dict}, stream_url, dict(http_headers), expires_at)
+        with self._lock:
+            self._counters["misses"] += 1
+            self._extract_seconds += elapsed
+            if self.enabled and expires_at > now:
+                self._entries[video_id] = entry
+                self._entries.move_to_end(video_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._counters["evictions"] += 1
+        return entry
+
+    def invalidate(self, video_id: str) -> None:
+        with self._lock:
+            if self._entries.pop(video_id, None) is not None:
+                self._counters["invalidations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            mean_extract = self._extract_seconds / self._counters["misses"] if self._counters["misses"] else 0.0
+            return {
+                **self._counters,
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hit_rate": round(self._counters["hits"] / lookups, 4) if lookups else 0.0,
+                "extract_seconds_total": round(self._extract_seconds, 3),
+                "mean_extract_seconds": round(mean_extract, 3),
+                # Each hit skipped one extraction, which costs about the mean of the ones that ran.
+                "estimated_seconds_saved": round(self._counters["hits"] * mean_extract, 3),
+            }
@@ -0,0 +1,51 @@
+import io
+import json
+import wave
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from services.scheduler import SchedulerBusyError
+
+
+def _wav_bytes(seconds: float = 1.0, sample_rate: int = 16000) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(np.zeros(int(seconds * sample_rate), dtype=np.int16).tobytes())
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def busy_once(monkeypatch):
+    """Rejects the first embed stage call as busy, then runs every call as usual."""
+    run = main.scheduler.run
+    rejected = []
+
+    async def run_busy_once(stage, fn, *args, **kwargs):
+        if stage == "embed" and not rejected:
+            rejected.append(stage)
+            raise SchedulerBusyError(stage, 503, retry_after_seconds=0)
+        return await run(stage, fn, *args, **kwargs)
+
+    monkeypatch.setattr(main.scheduler, "run", run_busy_once)
+    monkeypatch.setattr(main, "embedding_cache", None)
+    monkeypatch.setattr(main, "process_audio_segment", lambda audio_bytes, *args: np.ones(512, dtype=np.float32) if audio_bytes else None)
+    return rejected
+
+
+def test_bulk_upload_retried_after_busy_rejection_succeeds(busy_once):
+    client = TestClient(main.app)
+    response = client.post("/api/bulk/analyze-audio", files=[("audio_files", ("clip.wav", _wav_bytes(), "audio/wav"))])
+
+    assert response.status_code == 200
+    records = [json.loads(line) for line in response.text.splitlines()]
+    item, summary = records[0], records[-1]["summary"]
+    assert busy_once == ["embed"]
+    assert item["status"] == "ok", item
+    assert item["result"]["source_segment_info"]["title"] == "clip.wav"
+    assert summary["busy_retries"] == 1
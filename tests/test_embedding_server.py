@@ -0,0 +1,105 @@
+import os
+import threading
+from multiprocessing.connection import Listener
+
+import numpy as np
+import pytest
+
+from services.embedding_server import AUTHKEY_FILE, EmbeddingServerClient, EmbeddingServerError
+
+AUTHKEY = b"test-key"
+KEY = ("mel256", "music", 512)
+
+
+class FakeWorker:
+    """
+    Answers pings like a worker. Embedding requests get `reply`, or no reply at all if it is
+    None; once crash() is called they get their connection closed, as when the worker dies.
+    """
+
+    def __init__(self, socket_dir, name, reply=None):
+        self.path = os.path.join(socket_dir, f"worker-{name}.sock")
+        self.reply = reply
+        self.crashed = False
+        self.requests = 0
+        self._listener = Listener(self.path, family="AF_UNIX", authkey=AUTHKEY)
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        with conn:
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    return
+                if message["op"] == "ping":
+                    conn.send({"ok": True, "pid": 0})
+                    continue
+                self.requests += 1
+                if self.crashed:
+                    return
+                if self.reply is not None:
+                    conn.send(self.reply)
+
+    def crash(self):
+        self.crashed = True
+
+
+@pytest.fixture
+def socket_dir(tmp_path):
+    with open(tmp_path / AUTHKEY_FILE, "wb") as f:
+        f.write(AUTHKEY)
+    return str(tmp_path)
+
+
+def _client(socket_dir, timeout=5.0):
+    client = EmbeddingServerClient(socket_dir, request_timeout_seconds=timeout)
+    client.check_health()
+    return client
+
+
+def test_request_is_retried_on_another_worker_when_one_died(socket_dir):
+    reply = {"ok": True, "embeddings": np.ones((3, 4), np.float32)}
+    dead = FakeWorker(socket_dir, "0", reply=reply)
+    alive = FakeWorker(socket_dir, "1", reply=reply)
+    client = _client(socket_dir)
+    assert client.healthy_workers() == 2
+    dead.crash()
+
+    for _ in range(3):
+        assert client.embed_frames(np.zeros(48000, np.float32), 48000, 4800, KEY).shape == (3, 4)
+    # At most one request reached the dead worker before it was taken out of rotation.
+    assert dead.requests <= 1 and alive.requests == 3
+    workers = client.stats()["workers"]
+    assert workers[os.path.basename(dead.path)]["healthy"] is False
+    assert workers[os.path.basename(alive.path)]["healthy"] is True
+
+
+def test_timed_out_request_is_not_sent_again(socket_dir):
+    slow = [FakeWorker(socket_dir, str(i)) for i in range(2)]
+    client = _client(socket_dir, timeout=0.2)
+
+    with pytest.raises(EmbeddingServerError, match="no reply"):
+        client.embed_frames(np.zeros(48000, np.float32), 48000, 4800, KEY)
+    assert sum(worker.requests for worker in slow) == 1
+    # A slow worker is still alive, so it stays in rotation.
+    assert client.healthy_workers() == 2
+
+
+def test_worker_errors_are_raised_without_retry(socket_dir):
+    failing = FakeWorker(socket_dir, "0", reply={"ok": False, "error": "bad input"})
+    other = FakeWorker(socket_dir, "1", reply={"ok": False, "error": "bad input"})
+    client = _client(socket_dir)
+
+    with pytest.raises(EmbeddingServerError, match="bad input"):
+        client.embed_frames(np.zeros(48000, np.float32), 48000, 4800, KEY)
+    assert failing.requests + other.requests == 1
+    assert client.healthy_workers() == 2
@@ -0,0 +1,118 @@
+import asyncio
+import threading
+
+import pytest
+
+from services.scheduler import PipelineScheduler, SchedulerBusyError, StagePool
+
+
+def _blocker():
+    """A job that runs until the returned event is set."""
+    release = threading.Event()
+    started = threading.Event()
+
+    def job():
+        started.set()
+        release.wait(5)
+        return "done"
+
+    return job, started, release
+
+
+async def _wait_for(event: threading.Event) -> None:
+    for _ in range(500):
+        if event.is_set():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("job did not start")
+
+
+def test_pool_rejects_beyond_workers_and_queue():
+    async def scenario():
+        pool = StagePool("x", max_workers=1, max_queue=1, reject_status_code=503)
+        job, started, release = _blocker()
+        running = asyncio.ensure_future(pool.run(job))
+        await _wait_for(started)
+        queued = asyncio.ensure_future(pool.run(lambda: "queued"))
+        await asyncio.sleep(0)
+        assert pool.stats()["running"] == 1 and pool.stats()["queued"] == 1
+
+        with pytest.raises(SchedulerBusyError) as rejected:
+            await pool.run(lambda: "rejected")
+        assert rejected.value.status_code == 503
+        assert rejected.value.stage == "x"
+
+        release.set()
+        assert await running == "done"
+        assert await queued == "queued"
+        stats = pool.stats()
+        assert (stats["running"], stats["queued"], stats["completed"], stats["rejected"]) == (0, 0, 2, 1)
+        pool.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_scheduler_stage_status_codes():
+    async def scenario():
+        scheduler = PipelineScheduler(download_workers=1, download_queue=0, embed_workers=1, embed_queue=0)
+        codes = {}
+        for stage in ("download", "embed"):
+            job, started, release = _blocker()
+            running = asyncio.ensure_future(scheduler.run(stage, job))
+            await _wait_for(started)
+            with pytest.raises(SchedulerBusyError) as rejected:
+                await scheduler.run(stage, lambda: None)
+            codes[stage] = rejected.value.status_code
+            release.set()
+            await running
+        scheduler.shutdown()
+        return codes
+
+    assert asyncio.run(scenario()) == {"download": 429, "embed": 503}
+
+
+def test_failed_job_releases_its_slot():
+    async def scenario():
+        pool = StagePool("x", max_workers=1, max_queue=0)
+
+        def fail():
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError):
+            await pool.run(fail)
+        assert await pool.run(lambda: 1) == 1
+        stats = pool.stats()
+        pool.shutdown()
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert (stats["running"], stats["queued"], stats["completed"]) == (0, 0, 2)
+
+
+def test_cancelled_queued_job_releases_its_slot():
+    async def scenario():
+        pool = StagePool("x", max_workers=1, max_queue=1)
+        job, started, release = _blocker()
+        ran = threading.Event()
+        running = asyncio.ensure_future(pool.run(job))
+        await _wait_for(started)
+        queued = asyncio.ensure_future(pool.run(ran.set))
+        await asyncio.sleep(0)
+        assert pool.stats()["queued"] == 1
+
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        assert pool.stats()["queued"] == 0
+
+        release.set()
+        await running
+        # The freed slot can be used again, and the cancelled job never ran.
+        assert await pool.run(lambda: "again") == "again"
+        stats = pool.stats()
+        pool.shutdown()
+        return stats, ran.is_set()
+
+    stats, cancelled_job_ran = asyncio.run(scenario())
+    assert (stats["running"], stats["queued"]) == (0, 0)
+    assert not cancelled_job_ran
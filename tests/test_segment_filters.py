@@ -0,0 +1,68 @@
+import numpy as np
+
+from services import vector_index
+from services.segment_filters import AttributeIndex, SearchFilter, segment_attributes
+from services.vector_index import VectorIndex
+
+SEGMENTS = [
+    {"artist": "Daft Punk", "duration_seconds": 20, "matched_features": ["House", "French"]},
+    {"artist": "daft punk ", "duration_seconds": 45, "matched_features": ["House"]},
+    {"artist": "Burial", "matched_features": ["Garage", "Duration: 30s"]},
+    {"artist": "Burial", "matched_features": ["Garage"]},
+]
+
+
+def _attributes() -> AttributeIndex:
+    attributes = AttributeIndex(capacity=2)
+    for row, metadata in enumerate(SEGMENTS):
+        attributes.set(row, *segment_attributes(metadata))
+    return attributes
+
+
+def _rows(search_filter: SearchFilter) -> list:
+    return np.flatnonzero(_attributes().mask(search_filter, len(SEGMENTS))).tolist()
+
+
+def test_duration_falls_back_to_matched_features():
+    assert segment_attributes(SEGMENTS[2]) == ("Burial", 30.0, ("Garage", "Duration: 30s"))
+    assert segment_attributes(SEGMENTS[3])[1] is None
+
+
+def test_artist_filters_are_case_insensitive():
+    assert _rows(SearchFilter(artists=["DAFT PUNK"])) == [0, 1]
+    assert _rows(SearchFilter(exclude_artists=["daft punk"])) == [2, 3]
+    assert _rows(SearchFilter(artists=["Nobody"])) == []
+    assert _rows(SearchFilter(exclude_artists=["Nobody"])) == [0, 1, 2, 3]
+
+
+def test_duration_bounds_exclude_unknown_durations():
+    assert _rows(SearchFilter(min_duration_seconds=25)) == [1, 2]
+    assert _rows(SearchFilter(max_duration_seconds=30)) == [0, 2]
+
+
+def test_tags_must_all_match():
+    assert _rows(SearchFilter(tags=["house"])) == [0, 1]
+    assert _rows(SearchFilter(tags=["House", "French"])) == [0]
+    assert _rows(SearchFilter(tags=["Techno"])) == []
+
+
+def test_replacing_a_row_updates_its_attributes():
+    attributes = _attributes()
+    attributes.set(0, "Burial", None, ["Garage"])
+    assert np.flatnonzero(attributes.mask(SearchFilter(tags=["House"]), 4)).tolist() == [1]
+    assert np.flatnonzero(attributes.mask(SearchFilter(artists=["burial"]), 4)).tolist() == [0, 2, 3]
+
+
+def test_filtered_search_returns_k_matching_results(monkeypatch):
+    # Make filtered IVF searches probe lists instead of scanning the few matching rows exactly.
+    monkeypatch.setattr(vector_index, "FILTERED_EXACT_MAX_ROWS", 0)
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((600, 16)).astype(np.float32)
+    metadatas = [{"artist": f"artist-{i % 3}", "duration_seconds": float(i % 60)} for i in range(600)]
+    search_filter = SearchFilter(artists=["artist-1"], max_duration_seconds=30)
+    for mode in ("exact", "ivf"):
+        index = VectorIndex(dim=16, mode=mode)
+        index.add_batch([f"s{i}" for i in range(600)], vectors, metadatas)
+        results = index.search(vectors[0], k=10, search_filter=search_filter)
+        assert len(results) == 10
+        assert all(m["artist"] == "artist-1" and m["duration_seconds"] <= 30 for _, _, m in results)
@@ -0,0 +1,79 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from services.segment_store import SegmentStore
+from services.vector_index import VectorIndex
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _unit(dim: int, hot: int) -> np.ndarray:
+    vector = np.zeros(dim, dtype=np.float32)
+    vector[hot] = 1.0
+    return vector
+
+
+def test_upsert_appends_new_ids_and_overwrites_known_ones(tmp_path):
+    store = SegmentStore(str(tmp_path / "segments"), dim=8, grow_rows=4)
+    assert store.upsert(["a", "b"], np.stack([_unit(8, 0), _unit(8, 1)]), [{"title": "A"}, {"title": "B"}]) == [(0, True), (1, True)]
+    assert store.upsert(["b", "c"], np.stack([_unit(8, 2), _unit(8, 3)]), [{"title": "B2"}, {"title": "C"}]) == [(1, False), (2, True)]
+
+    assert store.count() == 3
+    assert np.array_equal(store.matrix[1], _unit(8, 2))
+    assert store.metadata([2, 1, 9]) == [{"title": "C"}, {"title": "B2"}, {}]
+    assert [(row, segment_id) for row, segment_id, _ in store.rows_since(1)] == [(1, "b"), (2, "c")]
+    store.close()
+
+
+def test_store_grows_past_its_mapping_and_reopens(tmp_path):
+    prefix = str(tmp_path / "segments")
+    store = SegmentStore(prefix, dim=8, grow_rows=4)
+    vectors = np.random.default_rng(0).standard_normal((10, 8)).astype(np.float32)
+    store.upsert([f"s{i}" for i in range(10)], vectors, [{"i": i} for i in range(10)], [b"sketch" if i == 3 else None for i in range(10)])
+    store.close()
+
+    reopened = SegmentStore(prefix, dim=8, grow_rows=4)
+    assert reopened.count() == 10
+    assert np.array_equal(reopened.matrix[:10], vectors)
+    assert reopened.sketches([3, 4]) == [b"sketch", None]
+    reopened.close()
+
+
+def test_index_reopens_from_store(tmp_path):
+    prefix = str(tmp_path / "segments")
+    index = VectorIndex.open_store(prefix, dim=8, mode="exact")
+    index.add("a", _unit(8, 0), {"title": "A", "artist": "X"})
+    index.add("b", _unit(8, 1), {"title": "B", "artist": "Y"})
+    index.store.close()
+
+    reopened = VectorIndex.open_store(prefix, dim=8, mode="exact")
+    assert len(reopened) == 2
+    segment_id, score, metadata = reopened.search(_unit(8, 1), k=1)[0]
+    assert (segment_id, metadata["title"]) == ("b", "B")
+    reopened.store.close()
+
+
+def test_index_picks_up_segments_added_by_another_process(tmp_path, monkeypatch):
+    prefix = str(tmp_path / "segments")
+    index = VectorIndex.open_store(prefix, dim=8, mode="exact")
+    index.add("local", _unit(8, 0), {"title": "local"})
+
+    writer = (
+        "import sys, numpy as np\n"
+        "from services.segment_store import SegmentStore\n"
+        "store = SegmentStore(sys.argv[1], dim=8, grow_rows=1)\n"
+        "vectors = np.eye(8, dtype=np.float32)[[5, 6]]\n"
+        "store.upsert(['remote-5', 'remote-6'], vectors, [{'title': 'five', 'artist': 'R'}, {'title': 'six'}])\n"
+        "store.close()\n"
+    )
+    subprocess.run([sys.executable, "-c", writer, prefix], cwd=REPO_ROOT, check=True)
+
+    # The next search refreshes from the store once STORE_REFRESH_SECONDS have passed.
+    monkeypatch.setattr("services.vector_index.STORE_REFRESH_SECONDS", 0.0)
+    segment_id, _, metadata = index.search(_unit(8, 6), k=1)[0]
+    assert (segment_id, metadata["title"]) == ("remote-6", "six")
+    assert len(index) == 3
+    index.store.close()
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+
+import pytest
+
+from services.single_flight import SingleFlight
+
+
+def test_concurrent_callers_share_one_execution_and_its_events(caplog):
+    async def scenario():
+        flights = SingleFlight("test")
+        release = asyncio.Event()
+        calls = []
+
+        async def work(notify):
+            calls.append(1)
+            notify("download")
+            await release.wait()
+            notify("embed")
+            return "result"
+
+        leader_events, follower_events = [], []
+        leader = asyncio.ensure_future(flights.run("k", work, listener=leader_events.append))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flights.run("k", work, listener=follower_events.append))
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(leader, follower)
+        return flights, calls, results, leader_events, follower_events
+
+    with caplog.at_level(logging.INFO, logger="services.single_flight"):
+        flights, calls, results, leader_events, follower_events = asyncio.run(scenario())
+    assert calls == [1]
+    assert results == [("result", False), ("result", True)]
+    assert leader_events == ["download", "embed"]
+    # The follower joined after "download" was sent, so it gets that first, then "embed".
+    assert follower_events == ["download", "embed"]
+    stats = flights.stats()
+    assert (stats["executions"], stats["coalesced"], stats["in_flight"]) == (1, 1, 0)
+    assert caplog.records == []
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_work():
+    async def scenario():
+        flights = SingleFlight()
+        release = asyncio.Event()
+
+        async def work(notify):
+            await release.wait()
+            notify("done")
+            return 42
+
+        events = []
+        first = asyncio.ensure_future(flights.run("k", work, listener=events.append))
+        second = asyncio.ensure_future(flights.run("k", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        return await second, first.cancelled(), events
+
+    result, first_cancelled, events = asyncio.run(scenario())
+    assert result == (42, True)
+    assert first_cancelled
+    assert events == []
+
+
+def test_failures_reach_every_caller_and_release_the_key():
+    async def scenario():
+        flights = SingleFlight()
+
+        async def fail(notify):
+            await asyncio.sleep(0)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(flights.run("k", fail), flights.run("k", fail), return_exceptions=True)
+        again = await flights.run("k", lambda notify: asyncio.sleep(0, result="ok"))
+        return flights.stats(), results, again
+
+    stats, results, again = asyncio.run(scenario())
+    assert all(isinstance(r, ValueError) for r in results)
+    assert again == ("ok", False)
+    assert (stats["executions"], stats["failures"]) == (2, 1)
@@ -0,0 +1,73 @@
+import importlib.util
+import types
+
+import numpy as np
+import pytest
+
+from services import audio_embedding_service
+from services.audio_embedding_service import TARGET_SR, StreamingEmbedder, compute_frame_embeddings
+
+
+def _openl3_preprocess(audio, sr, hop_size=0.1, input_repr=None, center=True):
+    """openl3.core.preprocess_audio's framing for mono audio at TARGET_SR (_center_audio, then _pad_audio)."""
+    frame_len = TARGET_SR
+    hop_len = int(hop_size * TARGET_SR)
+    if center:
+        audio = np.pad(audio, (int(frame_len / 2.0), 0))
+    if audio.size < frame_len:
+        pad_length = frame_len - audio.size
+    else:
+        pad_length = int(np.ceil((audio.size - frame_len) / float(hop_len))) * hop_len - (audio.size - frame_len)
+    if pad_length > 0:
+        audio = np.pad(audio, (0, pad_length))
+    n_frames = 1 + int((len(audio) - frame_len) / float(hop_len))
+    frames = np.lib.stride_tricks.as_strided(audio, shape=(frame_len, n_frames), strides=(audio.itemsize, hop_len * audio.itemsize)).T
+    return np.ascontiguousarray(frames)[:, np.newaxis, :]
+
+
+class _SummaryBackend:
+    """Embeds a frame as a few of its samples and its energy, so frame contents and order matter."""
+
+    def predict(self, frames, batch_size):
+        samples = frames[:, 0, ::6000]
+        energy = (frames[:, 0, :] ** 2).mean(axis=1, keepdims=True)
+        return np.hstack((samples, energy)).astype(np.float32)
+
+
+@pytest.fixture(autouse=True)
+def fake_model(monkeypatch):
+    monkeypatch.setattr(audio_embedding_service, "get_backend", lambda *key: _SummaryBackend())
+    monkeypatch.setattr(audio_embedding_service, "get_running_batcher", lambda *key: None)
+    monkeypatch.setattr(audio_embedding_service, "get_embedding_client", lambda: None)
+    if importlib.util.find_spec("openl3") is None:
+        stub = types.SimpleNamespace(core=types.SimpleNamespace(preprocess_audio=_openl3_preprocess))
+        monkeypatch.setattr(audio_embedding_service, "import_openl3", lambda: stub)
+
+
+def _stream(audio, block_size):
+    embedder = StreamingEmbedder()
+    for offset in range(0, audio.shape[0], block_size):
+        embedder.feed(audio[offset:offset + block_size])
+    return embedder.finish()
+
+
+@pytest.mark.parametrize("seconds", [0.3, 1.0, 1.05, 1.5, 2.37, 3.0, 4.0001])
+@pytest.mark.parametrize("block_size", [4096, 48000 * 5])
+def test_streaming_matches_whole_buffer_embedding(seconds, block_size):
+    audio = np.random.default_rng(0).uniform(-1, 1, int(seconds * TARGET_SR)).astype(np.float32)
+    embeddings, _ = compute_frame_embeddings(audio, TARGET_SR)
+
+    streamed = _stream(audio, block_size)
+    assert streamed["frame_count"] == embeddings.shape[0]
+    np.testing.assert_allclose(streamed["embedding"], embeddings.mean(axis=0), rtol=1e-5, atol=1e-6)
+
+
+def test_reference_framing_covers_every_sample():
+    # 1.05 s: the centred audio is 1.55 s, so frames start at 0.0 .. 0.6 s and the last one is padded.
+    frames = _openl3_preprocess(np.ones(int(1.05 * TARGET_SR), dtype=np.float32), TARGET_SR)
+    assert frames.shape[0] == 7
+    assert frames[-1, 0, -1] == 0.0 and frames[-1, 0, 0] == 1.0
+
+
+def test_empty_stream_returns_none():
+    assert StreamingEmbedder().finish() is None
@@ -0,0 +1,114 @@
+import threading
+
+import numpy as np
+import pytest
+
+from services import vector_index
+from services.vector_index import VectorIndex
+
+
+def _clustered(count: int, dim: int = 32, clusters: int = 40, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    return (centers[rng.integers(clusters, size=count)] + 0.3 * rng.standard_normal((count, dim))).astype(np.float32)
+
+
+def _index(vectors: np.ndarray, **kwargs) -> VectorIndex:
+    index = VectorIndex(dim=vectors.shape[1], **kwargs)
+    index.add_batch([f"s{i}" for i in range(len(vectors))], vectors)
+    return index
+
+
+def test_exact_search_returns_nearest_first_and_skips_excluded():
+    vectors = _clustered(500)
+    index = _index(vectors, mode="exact")
+    query = vectors[7]
+
+    results = index.search(query, k=5)
+    assert results[0][0] == "s7"
+    assert results[0][1] == pytest.approx(1.0, abs=1e-5)
+    assert [score for _, score, _ in results] == sorted((score for _, score, _ in results), reverse=True)
+    assert "s7" not in [segment_id for segment_id, _, _ in index.search(query, k=5, exclude_ids=["s7"])]
+
+
+def test_ivf_recall_close_to_exact():
+    vectors = _clustered(4000)
+    exact = _index(vectors, mode="exact")
+    ivf = _index(vectors, mode="ivf", nprobe=8)
+    queries = _clustered(50, seed=1)
+
+    recalls = []
+    for query in queries:
+        truth = {segment_id for segment_id, _, _ in exact.search(query, k=10)}
+        found = {segment_id for segment_id, _, _ in ivf.search(query, k=10)}
+        recalls.append(len(truth & found) / 10)
+    assert ivf.stats()["ivf_trained"]
+    assert np.mean(recalls) >= 0.9
+
+
+def test_ivf_assigns_rows_added_after_training():
+    vectors = _clustered(2000)
+    index = _index(vectors, mode="ivf")
+    index.train()
+    extra = _clustered(1, seed=5)[0]
+    index.add("late", extra)
+    assert index.search(extra, k=1)[0][0] == "late"
+
+
+def test_auto_mode_switches_to_ivf_at_threshold(monkeypatch):
+    monkeypatch.setattr(vector_index, "AUTO_IVF_THRESHOLD", 1000)
+    vectors = _clustered(1500)
+    index = _index(vectors[:999], mode="auto")
+    index.search(vectors[0], k=3)
+    assert not index.stats()["ivf_trained"]
+
+    index.add_batch([f"t{i}" for i in range(501)], vectors[999:])
+    assert index.search(vectors[1200], k=1)[0][0] == "t201"
+    assert index.stats()["ivf_trained"]
+
+
+def test_training_does_not_block_searches(monkeypatch):
+    vectors = _clustered(1000)
+    index = _index(vectors, mode="ivf")
+    building = threading.Event()
+    release = threading.Event()
+    build_lists = VectorIndex._build_lists
+
+    def slow_build_lists(*args):
+        building.set()
+        release.wait(5)
+        return build_lists(*args)
+
+    monkeypatch.setattr(VectorIndex, "_build_lists", staticmethod(slow_build_lists))
+    trainer = threading.Thread(target=index.train)
+    trainer.start()
+    assert building.wait(5)
+
+    # Training is in progress, so this search scans exactly instead of waiting for it.
+    finished = []
+    searcher = threading.Thread(target=lambda: finished.append(index.search(vectors[3], k=1)))
+    searcher.start()
+    searcher.join(5)
+    assert finished and finished[0][0][0] == "s3"
+    index.add("during", vectors[4] + 1.0)
+
+    release.set()
+    trainer.join(5)
+    stats = index.stats()
+    assert stats["ivf_trained"]
+    assert sum(len(rows) for rows in index._lists) == stats["vectors"]
+
+
+def test_replacement_during_training_discards_the_run(monkeypatch):
+    vectors = _clustered(1000)
+    index = _index(vectors, mode="ivf")
+    build_lists = VectorIndex._build_lists
+
+    def build_lists_then_replace(*args):
+        result = build_lists(*args)
+        index.add("s0", vectors[1])
+        return result
+
+    monkeypatch.setattr(VectorIndex, "_build_lists", staticmethod(build_lists_then_replace))
+    index.train()
+    assert not index.stats()["ivf_trained"]
@@ -0,0 +1,144 @@
+import threading
+
+import pytest
+
+from services import ytdlp_session
+from services.youtube_service import _track_metadata
+from services.ytdlp_session import StreamInfoCache, YtDlpSession
+
+
+class StubExtractor:
+    """Stands in for yt-dlp: returns a fixed info dict and counts extractions."""
+
+    def __init__(self, info=None, stream_url="https://example.invalid/audio"):
+        self.info = info if info is not None else {"title": "Song", "uploader": "Channel", "duration": 200, "formats": ["dropped"]}
+        self.stream_url = stream_url
+        self.calls = []
+
+    def __call__(self, video_id):
+        self.calls.append(video_id)
+        return dict(self.info), self.stream_url, {"User-Agent": "stub"}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(ytdlp_session.time, "time", lambda: now[0])
+    return now
+
+
+def test_hits_and_misses_are_counted(clock):
+    extract = StubExtractor()
+    cache = StreamInfoCache(extract, ttl_seconds=60)
+
+    first, first_hit = cache.get("abc")
+    second, second_hit = cache.get("abc")
+    cache.get("def")
+
+    assert (first_hit, second_hit) == (False, True)
+    assert second is first
+    assert extract.calls == ["abc", "def"]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 2, 2)
+    assert stats["hit_rate"] == pytest.approx(1 / 3, abs=1e-4)
+
+
+def test_entries_expire_after_ttl(clock):
+    extract = StubExtractor()
+    cache = StreamInfoCache(extract, ttl_seconds=60)
+    cache.get("abc")
+
+    clock[0] += 59
+    assert cache.get("abc")[1]
+    clock[0] += 2
+    assert not cache.get("abc")[1]
+    assert cache.stats()["expired"] == 1
+    assert len(extract.calls) == 2
+
+
+def test_entries_expire_before_the_stream_url(clock):
+    expire = int(clock[0]) + ytdlp_session.URL_EXPIRY_MARGIN_SECONDS + 30
+    cache = StreamInfoCache(StubExtractor(stream_url=f"https://example.invalid/audio?expire={expire}"), ttl_seconds=3600)
+    cache.get("abc")
+    clock[0] += 31
+    assert not cache.get("abc")[1]
+
+
+def test_lru_eviction_and_invalidate(clock):
+    cache = StreamInfoCache(StubExtractor(), ttl_seconds=60, max_entries=2)
+    for video_id in ("a", "b", "a", "c"):
+        cache.get(video_id)
+    assert cache.get("a")[1]
+    assert not cache.get("b")[1]
+    cache.invalidate("a")
+    stats = cache.stats()
+    assert (stats["evictions"], stats["invalidations"]) == (2, 1)
+
+
+def test_disabled_cache_always_extracts(clock):
+    extract = StubExtractor()
+    cache = StreamInfoCache(extract, ttl_seconds=0)
+    assert not cache.get("abc")[1]
+    assert not cache.get("abc")[1]
+    assert len(extract.calls) == 2
+
+
+def test_concurrent_misses_share_one_extraction(clock):
+    started, release = threading.Event(), threading.Event()
+
+    def slow_extract(video_id):
+        started.set()
+        release.wait(5)
+        return {"title": "Song"}, "https://example.invalid/audio", {}
+
+    cache = StreamInfoCache(slow_extract, ttl_seconds=60)
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cache.get("abc")))
+    leader.start()
+    assert started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(cache.get("abc")))
+    follower.start()
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert sorted(hit for _, hit in results) == [False, True]
+    stats = cache.stats()
+    assert (stats["misses"], stats["shared_extractions"]) == (1, 1)
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_track_metadata_defaults_for_missing_fields(clock, cached):
+    cache = StreamInfoCache(StubExtractor(), ttl_seconds=60)
+    if cached:
+        cache.get("abc")
+    stream, hit = cache.get("abc")
+    assert hit == cached
+    assert "formats" not in stream.info
+
+    metadata = _track_metadata(stream.info, "abc")
+    assert metadata["title"] == "Song"
+    assert metadata["artist"] == "Channel"
+    assert metadata["album"] == "Unknown Album"
+    assert metadata["original_url"] == "https://www.youtube.com/watch?v=abc"
+
+    untitled = _track_metadata(StreamInfoCache(StubExtractor(info={}), ttl_seconds=60).get("xyz")[0].info, "xyz")
+    assert (untitled["title"], untitled["artist"], untitled["album"]) == ("Unknown Title", "Unknown Artist", "Unknown Album")
+
+
+def test_session_reuses_one_extractor_per_thread():
+    created = []
+
+    class StubYoutubeDL:
+        def __init__(self, options):
+            created.append(options)
+
+        def extract_info(self, url, download=False):
+            return {"id": url}
+
+    session = YtDlpSession({"quiet": True}, factory=StubYoutubeDL)
+    session.extract_info("a")
+    session.extract_info("b")
+    worker = threading.Thread(target=session.extract_info, args=("c",))
+    worker.start()
+    worker.join(5)
+    assert session.stats() == {"instances": 2, "extractions": 3}